@@ -1,5 +1,6 @@
 import os
 import sys
+import tempfile
 from typing import NamedTuple
 
 
@@ -11,6 +12,16 @@ def check_config_values(config: dict):
 
 class Config(NamedTuple):
     DATABASE_URL: str = os.getenv("DATABASE_URL", "")
+    # Connection pools of the database engines (ignored for SQLite). Each worker
+    # opens up to the sum of both pools' size and overflow, 15 by default: most
+    # queries go through the async engine, the sync one serves auth and admin
+    DB_POOL_SIZE: int = int(os.getenv("DB_POOL_SIZE", "2"))
+    DB_MAX_OVERFLOW: int = int(os.getenv("DB_MAX_OVERFLOW", "3"))
+    DB_ASYNC_POOL_SIZE: int = int(os.getenv("DB_ASYNC_POOL_SIZE", "3"))
+    DB_ASYNC_MAX_OVERFLOW: int = int(os.getenv("DB_ASYNC_MAX_OVERFLOW", "7"))
+    DB_POOL_PRE_PING: bool = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+    # Seconds after which a connection is recycled, below MySQL's wait_timeout
+    DB_POOL_RECYCLE: int = int(os.getenv("DB_POOL_RECYCLE", "3600"))
 
     # # to get a string like this run:
     # # openssl rand -hex 32
@@ -24,6 +35,106 @@ class Config(NamedTuple):
     DEFAULT_ADMIN_EMAIL: str = os.getenv("DEFAULT_ADMIN_EMAIL", "")
     DEFAULT_ADMIN_PASSWORD: str = os.getenv("DEFAULT_ADMIN_PASSWORD", "")
 
+    # Limits of a single YAML upload
+    UPLOAD_MAX_BYTES: int = int(os.getenv("UPLOAD_MAX_BYTES", str(10 * 1024 * 1024)))
+    UPLOAD_MAX_DOCUMENTS: int = int(os.getenv("UPLOAD_MAX_DOCUMENTS", "500"))
+
+    # Resolved users kept in memory by the auth dependencies, and for how long
+    USER_CACHE_SIZE: int = int(os.getenv("USER_CACHE_SIZE", "1024"))
+    USER_CACHE_TTL: float = float(os.getenv("USER_CACHE_TTL", "60"))
+    # Verified token payloads kept in memory, never longer than the token's exp
+    TOKEN_CACHE_SIZE: int = int(os.getenv("TOKEN_CACHE_SIZE", "4096"))
+    TOKEN_CACHE_TTL: float = float(os.getenv("TOKEN_CACHE_TTL", "600"))
+
+    # Threads hashing and verifying passwords (bcrypt releases the GIL)
+    HASH_MAX_WORKERS: int = int(os.getenv("HASH_MAX_WORKERS", str(os.cpu_count() or 1)))
+    # Hash/verify calls allowed to wait for a thread before answering 503
+    HASH_MAX_PENDING: int = int(os.getenv("HASH_MAX_PENDING", "64"))
+
+    # Threads used to run blocking Kubernetes client calls from async routes
+    K8S_MAX_WORKERS: int = int(os.getenv("K8S_MAX_WORKERS", "16"))
+    # Calls allowed to wait for a free thread before being rejected
+    K8S_MAX_PENDING: int = int(os.getenv("K8S_MAX_PENDING", "256"))
+    # Kubernetes calls a single upload may have in flight at once
+    K8S_MAX_FANOUT: int = int(os.getenv("K8S_MAX_FANOUT", "8"))
+    # Connections kept per API server in the shared Kubernetes client pool
+    K8S_POOL_MAXSIZE: int = int(os.getenv("K8S_POOL_MAXSIZE", "16"))
+    # Seconds before an idle connection sends TCP keep-alive probes (0 = OS default)
+    K8S_KEEPALIVE_IDLE: int = int(os.getenv("K8S_KEEPALIVE_IDLE", "60"))
+    # Connect and read timeouts in seconds for Kubernetes calls (0 = no timeout)
+    K8S_CONNECT_TIMEOUT: float = float(os.getenv("K8S_CONNECT_TIMEOUT", "5"))
+    K8S_REQUEST_TIMEOUT: float = float(os.getenv("K8S_REQUEST_TIMEOUT", "30"))
+
+    # How uploads are validated: "dryrun" sends every document to the API server,
+    # "local" checks it against the cluster's OpenAPI schema first and only dry
+    # runs documents that pass, "fast" only does the local check
+    K8S_VALIDATION_MODE: str = os.getenv("K8S_VALIDATION_MODE", "dryrun")
+    # Where the cluster's OpenAPI schema is cached, one file per server version
+    K8S_SCHEMA_CACHE_DIR: str = os.getenv(
+        "K8S_SCHEMA_CACHE_DIR", os.path.join(tempfile.gettempdir(), "quick_k8s")
+    )
+    # Validation verdicts cached per document, namespace and server version
+    VALIDATION_CACHE_SIZE: int = int(os.getenv("VALIDATION_CACHE_SIZE", "4096"))
+    VALIDATION_CACHE_TTL: float = float(os.getenv("VALIDATION_CACHE_TTL", "3600"))
+
+    # Serve deployment/service listings from a watch-backed in-memory cache
+    K8S_CACHE_ENABLED: bool = os.getenv("K8S_CACHE_ENABLED", "true").lower() == "true"
+    # Seconds to wait for the first list of a namespace before falling back
+    K8S_CACHE_SYNC_TIMEOUT: float = float(os.getenv("K8S_CACHE_SYNC_TIMEOUT", "10"))
+    # Server-side timeout of a single watch request, after which it is restarted
+    K8S_WATCH_TIMEOUT: int = int(os.getenv("K8S_WATCH_TIMEOUT", "300"))
+    # Seconds a namespace known to exist isn't checked again
+    K8S_NAMESPACE_CACHE_TTL: float = float(os.getenv("K8S_NAMESPACE_CACHE_TTL", "300"))
+
+    # Validations and deploys running at once, over all uploads
+    ADMISSION_MAX_CONCURRENT: int = int(os.getenv("ADMISSION_MAX_CONCURRENT", "16"))
+    # Uploads in progress, in total and per user, over which new uploads are
+    # answered 429 instead of being queued
+    ADMISSION_MAX_QUEUED: int = int(os.getenv("ADMISSION_MAX_QUEUED", "128"))
+    ADMISSION_MAX_QUEUED_PER_USER: int = int(
+        os.getenv("ADMISSION_MAX_QUEUED_PER_USER", "16")
+    )
+    # Share of the slots of each role when they are contended
+    ADMISSION_WEIGHTS: str = os.getenv(
+        "ADMISSION_WEIGHTS", "ADMIN=8,TRUSTED=4,EXPERIENCED=2,NEW=1"
+    )
+
+    # Background workers deploying asynchronous uploads, per process (0 = none)
+    JOB_WORKERS: int = int(os.getenv("JOB_WORKERS", "2"))
+    # Seconds between checks for jobs submitted to other processes
+    JOB_POLL_INTERVAL: float = float(os.getenv("JOB_POLL_INTERVAL", "5"))
+    # Seconds without heartbeat after which a running job is resumed elsewhere
+    JOB_CLAIM_TIMEOUT: float = float(os.getenv("JOB_CLAIM_TIMEOUT", "60"))
+    # Attempts at a job before it is failed
+    JOB_MAX_ATTEMPTS: int = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+
+    # Seconds between keepalive comments on idle event streams
+    STREAM_HEARTBEAT_INTERVAL: float = float(
+        os.getenv("STREAM_HEARTBEAT_INTERVAL", "15")
+    )
+    # Objects with unsent updates after which a slow event stream is closed
+    STREAM_MAX_PENDING: int = int(os.getenv("STREAM_MAX_PENDING", "1000"))
+
+    # Seconds between reconciliations of the resources table with the cluster
+    # (0 = never)
+    RECONCILE_INTERVAL: float = float(os.getenv("RECONCILE_INTERVAL", "300"))
+    # Label selector of the objects deployed by the API
+    RECONCILE_SELECTOR: str = os.getenv(
+        "RECONCILE_SELECTOR", "app.kubernetes.io/managed-by=quick-k8s"
+    )
+
+    # Log the stage timings of every request as a JSON line
+    TIMING_LOG_ENABLED: bool = os.getenv("TIMING_LOG_ENABLED", "false").lower() == "true"
+    # Append the spans of requests slower than TIMING_TRACE_MIN_MS to TIMING_TRACE_FILE
+    TIMING_TRACE_ENABLED: bool = (
+        os.getenv("TIMING_TRACE_ENABLED", "false").lower() == "true"
+    )
+    TIMING_TRACE_FILE: str = os.getenv(
+        "TIMING_TRACE_FILE",
+        os.path.join(tempfile.gettempdir(), "quick_k8s", "spans.jsonl"),
+    )
+    TIMING_TRACE_MIN_MS: float = float(os.getenv("TIMING_TRACE_MIN_MS", "0"))
+
 
 cfg = Config()
 
@@ -1,4 +1,4 @@
 """API for communicating with the database.
 Contains ORM and functions for getting, modifying and deleting data."""
 
-from app.database import orm, roles, users, utils, resources # noqa: 401
+from app.database import orm, roles, users, utils, resources, jobs # noqa: 401
@@ -0,0 +1,216 @@
+"""API for accessing the deploy_jobs and deploy_job_documents tables."""
+
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import and_, or_, select, update
+
+from app.database.orm import DeployJob, DeployJobDocument, Resource
+from app.database.utils import async_session_scope
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+# states of documents
+PENDING = "pending"
+VALID = "valid"
+INVALID = "invalid"
+DEPLOYED = "deployed"
+SKIPPED = "skipped"
+
+# position -> (state, reason)
+DocumentStates = Dict[int, Tuple[str, Optional[str]]]
+
+
+async def add_job_async(job: DeployJob, documents: List[DeployJobDocument]) -> None:
+    """Add job and its documents to database."""
+
+    async with async_session_scope() as session:
+        session.add(job)
+        await session.flush()
+        session.add_all(documents)
+        await session.commit()
+
+
+async def get_job_async(job_id: str) -> Optional[DeployJob]:
+    """Get job by id."""
+
+    async with async_session_scope() as session:
+        job = await session.get(DeployJob, job_id)
+
+    return job
+
+
+async def get_job_documents_async(job_id: str) -> List[DeployJobDocument]:
+    """Documents of a job, in upload order."""
+
+    async with async_session_scope() as session:
+        result = await session.execute(
+            select(DeployJobDocument)
+            .filter_by(job_id=job_id)
+            .order_by(DeployJobDocument.position)
+        )
+        documents = result.scalars().all()
+
+    return documents
+
+
+def _claimable(stale_before: datetime):
+    return or_(
+        DeployJob.state == QUEUED,
+        and_(
+            DeployJob.state == RUNNING,
+            DeployJob.heartbeat_timestamp < stale_before,
+        ),
+    )
+
+
+async def claim_job_async(
+    worker_id: str, stale_before: datetime, max_attempts: int, candidates: int = 5
+) -> Optional[DeployJob]:
+    """Claim the oldest job that is queued, or running without a heartbeat
+    since stale_before (its worker died). Workers race with a conditional
+    UPDATE, so a job is claimed by one of them only. Idle workers only run the
+    SELECT looking for candidates.
+
+    Stale jobs already attempted max_attempts times are failed instead."""
+
+    now = datetime.now()
+
+    async with async_session_scope() as session:
+        result = await session.execute(
+            select(DeployJob.id, DeployJob.attempts)
+            .where(_claimable(stale_before))
+            .order_by(DeployJob.created_timestamp)
+            .limit(candidates)
+        )
+        rows = result.all()
+        if not rows:
+            return None
+
+        exhausted = [job_id for job_id, attempts in rows if attempts >= max_attempts]
+        if exhausted:
+            await session.execute(
+                update(DeployJob)
+                .where(
+                    DeployJob.id.in_(exhausted),
+                    _claimable(stale_before),
+                    DeployJob.attempts >= max_attempts,
+                )
+                .values(
+                    state=FAILED,
+                    error=f"Gave up after {max_attempts} attempts.",
+                    claimed_by=None,
+                    finished_timestamp=now,
+                )
+                .execution_options(synchronize_session=False)
+            )
+            await session.commit()
+
+        for job_id, attempts in rows:
+            if attempts >= max_attempts:
+                continue
+
+            result = await session.execute(
+                update(DeployJob)
+                .where(
+                    DeployJob.id == job_id,
+                    _claimable(stale_before),
+                    DeployJob.attempts < max_attempts,
+                )
+                .values(
+                    state=RUNNING,
+                    claimed_by=worker_id,
+                    heartbeat_timestamp=now,
+                    attempts=DeployJob.attempts + 1,
+                )
+                .execution_options(synchronize_session=False)
+            )
+            await session.commit()
+
+            if result.rowcount == 1:
+                return await session.get(DeployJob, job_id)
+
+    return None
+
+
+async def heartbeat_job_async(job_id: str, worker_id: str) -> bool:
+    """Refresh the claim of worker_id on a job. Returns False if the claim was
+    lost, e.g. to a worker that took it over after a missed heartbeat."""
+
+    async with async_session_scope() as session:
+        result = await session.execute(
+            update(DeployJob)
+            .where(DeployJob.id == job_id, DeployJob.claimed_by == worker_id)
+            .values(heartbeat_timestamp=datetime.now())
+            .execution_options(synchronize_session=False)
+        )
+        await session.commit()
+
+    return result.rowcount == 1
+
+
+async def record_progress_async(
+    job_id: str,
+    worker_id: str,
+    states: DocumentStates,
+    resources: Optional[List[Resource]] = None,
+    job_state: Optional[str] = None,
+    error: Optional[str] = None,
+) -> bool:
+    """Set the states of documents of a job, add the resources they deployed
+    and optionally finish the job, in one transaction. Nothing is written and
+    False is returned if worker_id lost its claim on the job."""
+
+    now = datetime.now()
+    values = {"heartbeat_timestamp": now}
+    if job_state is not None:
+        values.update(
+            state=job_state, error=error, claimed_by=None, finished_timestamp=now
+        )
+
+    async with async_session_scope() as session:
+        result = await session.execute(
+            update(DeployJob)
+            .where(DeployJob.id == job_id, DeployJob.claimed_by == worker_id)
+            .values(**values)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount != 1:
+            await session.rollback()
+            return False
+
+        for position, (state, reason) in states.items():
+            await session.execute(
+                update(DeployJobDocument)
+                .where(
+                    DeployJobDocument.job_id == job_id,
+                    DeployJobDocument.position == position,
+                )
+                .values(state=state, reason=reason)
+                .execution_options(synchronize_session=False)
+            )
+
+        session.add_all(resources or [])
+        await session.commit()
+
+    return True
+
+
+async def release_jobs_async(worker_ids: List[str]) -> int:
+    """Queue the running jobs of worker_ids again, e.g. on shutdown, so that
+    other workers resume them without waiting for their claims to go stale.
+    The interrupted attempt isn't counted."""
+
+    async with async_session_scope() as session:
+        result = await session.execute(
+            update(DeployJob)
+            .where(DeployJob.state == RUNNING, DeployJob.claimed_by.in_(worker_ids))
+            .values(state=QUEUED, claimed_by=None, attempts=DeployJob.attempts - 1)
+            .execution_options(synchronize_session=False)
+        )
+        await session.commit()
+
+    return result.rowcount
@@ -4,7 +4,16 @@ The tables' definitions.
 
 # pylint: disable=too-few-public-methods
 from sqlalchemy.orm import registry
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, DateTime
+from sqlalchemy import (
+    Column,
+    Integer,
+    String,
+    Boolean,
+    ForeignKey,
+    DateTime,
+    Index,
+    Text,
+)
 
 mapper_registry = registry()
 Base = mapper_registry.generate_base()
@@ -64,6 +73,10 @@ class Resource(Base):  # type: ignore
     """Kubernetes resource model."""
 
     __tablename__ = "resources"
+    __table_args__ = (
+        Index("ix_resources_owner_name", "owner", "name"),
+        Index("ix_resources_owner_deleted", "owner", "deleted_timestamp"),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     owner = Column(Integer, ForeignKey("users.id"))
@@ -72,3 +85,43 @@ class Resource(Base):  # type: ignore
     created_timestamp = Column(DateTime(timezone=False))
     modified_timestamp = Column(DateTime(timezone=False), nullable=True)
     deleted_timestamp = Column(DateTime(timezone=False), nullable=True)
+
+
+class DeployJob(Base):  # type: ignore
+    """Asynchronous upload, deployed in the background by app.jobs."""
+
+    __tablename__ = "deploy_jobs"
+    __table_args__ = (
+        Index("ix_deploy_jobs_state_created", "state", "created_timestamp"),
+    )
+
+    # also the upload id the deployed objects are labelled with
+    id = Column(String(36), primary_key=True)
+    owner = Column(Integer, ForeignKey("users.id"))
+    filename = Column(String(256))
+    # queued, running, succeeded or failed
+    state = Column(String(20))
+    error = Column(Text, nullable=True)
+    attempts = Column(Integer, default=0)
+    claimed_by = Column(String(100), nullable=True)
+    heartbeat_timestamp = Column(DateTime(timezone=False), nullable=True)
+    created_timestamp = Column(DateTime(timezone=False))
+    finished_timestamp = Column(DateTime(timezone=False), nullable=True)
+
+
+class DeployJobDocument(Base):  # type: ignore
+    """Document of a DeployJob, with its progress."""
+
+    __tablename__ = "deploy_job_documents"
+    __table_args__ = (Index("ix_deploy_job_documents_job", "job_id", "position"),)
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    job_id = Column(String(36), ForeignKey("deploy_jobs.id"))
+    position = Column(Integer)
+    kind = Column(String(50))
+    name = Column(String(253))
+    # JSON of the parsed document
+    body = Column(Text)
+    # pending, valid, invalid, deployed, failed or skipped
+    state = Column(String(20))
+    reason = Column(Text, nullable=True)
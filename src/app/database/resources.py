@@ -2,52 +2,122 @@
 
 from datetime import datetime
 from functools import singledispatch
-from typing import List, Optional
+from typing import Dict, List, NamedTuple, Optional
 
-from app.database.orm import Resource
-from app.database.utils import get_session
+from sqlalchemy import and_, func, or_, select, update
+from sqlalchemy.sql import Select
+
+from app.database.orm import Resource, User
+from app.database.utils import async_session_scope, session_scope
+
+
+class ResourcePage(NamedTuple):
+    """A page of resources, newest first. Pass next_cursor as cursor to get
+    the next page; it is None on the last page."""
+
+    resources: List[Resource]
+    next_cursor: Optional[int]
+
+
+def select_resources(
+    owner_id: Optional[int] = None,
+    state: Optional[str] = None,
+    resource_type: Optional[str] = None,
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+    cursor: Optional[int] = None,
+    limit: int = 100,
+) -> Select:
+    """Query for one page of resources matching the filters, newest first.
+    state is "online", "deleted" or None for both, resource_type is matched
+    case-insensitively. One extra row is selected to know if there is a next
+    page."""
+
+    query = select(Resource)
+
+    if owner_id is not None:
+        query = query.where(Resource.owner == owner_id)
+    if state == "online":
+        query = query.where(Resource.deleted_timestamp.is_(None))
+    elif state == "deleted":
+        query = query.where(Resource.deleted_timestamp.isnot(None))
+    if resource_type is not None:
+        query = query.where(func.lower(Resource.type) == resource_type.lower())
+    if created_after is not None:
+        query = query.where(Resource.created_timestamp >= created_after)
+    if created_before is not None:
+        query = query.where(Resource.created_timestamp < created_before)
+    if cursor is not None:
+        query = query.where(Resource.id < cursor)
+
+    return query.order_by(Resource.id.desc()).limit(limit + 1)
+
+
+def _to_page(resources: List[Resource], limit: int) -> ResourcePage:
+    if len(resources) > limit:
+        return ResourcePage(resources[:limit], resources[limit - 1].id)
+
+    return ResourcePage(resources, None)
+
+
+def list_resources(limit: int = 100, **filters) -> ResourcePage:
+    """Get one page of resources. See select_resources for the filters."""
+
+    with session_scope() as session:
+        resources = (
+            session.execute(select_resources(limit=limit, **filters)).scalars().all()
+        )
+
+    return _to_page(resources, limit)
 
 
 def add_resource(resource: Resource) -> None:
     """Add resource to database."""
 
-    session = get_session()
-    session.add(resource)
-    session.commit()
+    with session_scope() as session:
+        session.add(resource)
+        session.commit()
+
+
+def add_resources(resources: List[Resource]) -> None:
+    """Add several resources to database in a single transaction."""
+
+    with session_scope() as session:
+        session.add_all(resources)
+        session.commit()
 
 
 def delete_resource(resource: Resource) -> None:
     """Delete resource from database."""
 
-    session = get_session()
-    session.delete(resource)
-    session.commit()
+    with session_scope() as session:
+        session.delete(resource)
+        session.commit()
 
 
 def fake_delete_resource(resource: Resource) -> None:
     """Delete resource from database."""
 
-    session = get_session()
-    resource = session.query(Resource).filter_by(id=resource.id).first()
-    resource.deleted_timestamp = datetime.now()
-    session.commit()
-    session.close()
+    with session_scope() as session:
+        resource = session.query(Resource).filter_by(id=resource.id).first()
+        resource.deleted_timestamp = datetime.now()
+        session.commit()
 
 
 @singledispatch
 def get_resource(resource_name: str, owner_id: int) -> Optional[Resource]:
-    """Get resource by username."""
-
-    session = get_session()
-    resource = (
-        session.query(Resource)
-        .filter_by(
-            owner=owner_id,
-            name=resource_name,
+    """Get online resource by name."""
+
+    with session_scope() as session:
+        resource = (
+            session.query(Resource)
+            .filter_by(
+                owner=owner_id,
+                name=resource_name,
+                deleted_timestamp=None,
+            )
+            .first()
         )
-        .first()
-    )
-    session.close()
 
     return resource
 
@@ -56,16 +126,15 @@ def get_resource(resource_name: str, owner_id: int) -> Optional[Resource]:
 def _(resource_id: int, owner_id: int) -> Optional[Resource]:  # type: ignore
     """Get resource by id."""
 
-    session = get_session()
-    resource = (
-        session.query(Resource)
-        .filter_by(
-            owner=owner_id,
-            id=resource_id,
+    with session_scope() as session:
+        resource = (
+            session.query(Resource)
+            .filter_by(
+                owner=owner_id,
+                id=resource_id,
+            )
+            .first()
         )
-        .first()
-    )
-    session.close()
 
     return resource
 
@@ -73,9 +142,8 @@ def _(resource_id: int, owner_id: int) -> Optional[Resource]:  # type: ignore
 def get_all_resources() -> List[Resource]:
     """Get all resources in the database."""
 
-    session = get_session()
-    resource = session.query(Resource).all()
-    session.close()
+    with session_scope() as session:
+        resource = session.query(Resource).all()
 
     return resource
 
@@ -83,25 +151,203 @@ def get_all_resources() -> List[Resource]:
 def get_user_resources(owner_id: int) -> List[Resource]:
     """Get all resources for a user by owner id."""
 
-    session = get_session()
-    resource = session.query(Resource).filter_by(owner=owner_id).all()
-    session.close()
+    with session_scope() as session:
+        resource = session.query(Resource).filter_by(owner=owner_id).all()
 
     return resource
 
 
 def set_update_time(resource_name: str, owner_id: int, new_timestamp):
-    session = get_session()
-    resource = (
-        session.query(Resource)
-        .filter_by(
-            owner=owner_id,
-            name=resource_name,
+    with session_scope() as session:
+        resource = (
+            session.query(Resource)
+            .filter_by(
+                owner=owner_id,
+                name=resource_name,
+                deleted_timestamp=None,
+            )
+            .first()
+        )
+
+        resource.modified_timestamp = new_timestamp
+        session.commit()
+
+
+async def add_resource_async(resource: Resource) -> None:
+    """Async version of add_resource."""
+
+    async with async_session_scope() as session:
+        session.add(resource)
+        await session.commit()
+
+
+async def add_resources_async(resources: List[Resource]) -> None:
+    """Async version of add_resources."""
+
+    async with async_session_scope() as session:
+        session.add_all(resources)
+        await session.commit()
+
+
+async def fake_delete_resource_async(resource: Resource) -> None:
+    """Async version of fake_delete_resource."""
+
+    async with async_session_scope() as session:
+        resource = await session.get(Resource, resource.id)
+        resource.deleted_timestamp = datetime.now()
+        await session.commit()
+
+
+async def fake_delete_owned_resource_async(
+    resource_name: str, resource_type: str, username: str
+) -> int:
+    """Set the deleted timestamp of the online resource resource_name of type
+    resource_type (lowercase) owned by username, in a single UPDATE. Returns
+    the number of rows updated."""
+
+    owner_id = select(User.id).where(User.username == username).scalar_subquery()
+
+    async with async_session_scope() as session:
+        result = await session.execute(
+            update(Resource)
+            .where(
+                Resource.owner == owner_id,
+                Resource.name == resource_name,
+                func.lower(Resource.type) == resource_type,
+                Resource.deleted_timestamp.is_(None),
+            )
+            .values(deleted_timestamp=datetime.now())
+            .execution_options(synchronize_session=False)
+        )
+        await session.commit()
+
+    return result.rowcount
+
+
+async def fake_delete_resources_by_name_async(
+    names: Dict[str, List[str]], username: Optional[str] = None
+) -> int:
+    """Set the deleted timestamp of the online resources named in names, by
+    resource type (lowercase), owned by username if given, in a single UPDATE.
+    Returns the number of rows updated."""
+
+    conditions = [
+        and_(func.lower(Resource.type) == resource_type, Resource.name.in_(type_names))
+        for resource_type, type_names in names.items()
+        if type_names
+    ]
+    if not conditions:
+        return 0
+
+    filters = [or_(*conditions), Resource.deleted_timestamp.is_(None)]
+    if username is not None:
+        owner_id = select(User.id).where(User.username == username).scalar_subquery()
+        filters.append(Resource.owner == owner_id)
+
+    async with async_session_scope() as session:
+        result = await session.execute(
+            update(Resource)
+            .where(*filters)
+            .values(deleted_timestamp=datetime.now())
+            .execution_options(synchronize_session=False)
+        )
+        await session.commit()
+
+    return result.rowcount
+
+
+async def get_resource_async(resource_name: str, owner_id: int) -> Optional[Resource]:
+    """Async version of get_resource, by name only."""
+
+    async with async_session_scope() as session:
+        result = await session.execute(
+            select(Resource).filter_by(
+                owner=owner_id, name=resource_name, deleted_timestamp=None
+            )
+        )
+        resource = result.scalars().first()
+
+    return resource
+
+
+async def list_resources_async(limit: int = 100, **filters) -> ResourcePage:
+    """Async version of list_resources."""
+
+    async with async_session_scope() as session:
+        result = await session.execute(select_resources(limit=limit, **filters))
+        resources = result.scalars().all()
+
+    return _to_page(resources, limit)
+
+
+async def get_all_resources_async() -> List[Resource]:
+    """Async version of get_all_resources."""
+
+    async with async_session_scope() as session:
+        result = await session.execute(select(Resource))
+        resources = result.scalars().all()
+
+    return resources
+
+
+async def get_user_resources_async(owner_id: int) -> List[Resource]:
+    """Async version of get_user_resources."""
+
+    async with async_session_scope() as session:
+        result = await session.execute(select(Resource).filter_by(owner=owner_id))
+        resources = result.scalars().all()
+
+    return resources
+
+
+async def set_update_time_async(resource_name: str, owner_id: int, new_timestamp):
+    """Async version of set_update_time."""
+
+    async with async_session_scope() as session:
+        result = await session.execute(
+            select(Resource).filter_by(
+                owner=owner_id, name=resource_name, deleted_timestamp=None
+            )
         )
-        .first()
-    )
+        resource = result.scalars().first()
+
+        resource.modified_timestamp = new_timestamp
+        await session.commit()
+
+
+async def get_online_resources_async() -> List[Resource]:
+    """All resources that are not deleted."""
+
+    async with async_session_scope() as session:
+        result = await session.execute(
+            select(Resource).filter_by(deleted_timestamp=None)
+        )
+        resources = result.scalars().all()
+
+    return resources
+
+
+async def mark_deleted_async(
+    resource_ids: List[int], deleted_timestamp: datetime, batch_size: int = 500
+) -> int:
+    """Set the deleted timestamp of the resources that aren't deleted yet among
+    resource_ids, batch_size rows per UPDATE. Returns the number of rows updated."""
+
+    updated = 0
+
+    async with async_session_scope() as session:
+        for i in range(0, len(resource_ids), batch_size):
+            result = await session.execute(
+                update(Resource)
+                .where(
+                    Resource.id.in_(resource_ids[i : i + batch_size]),
+                    Resource.deleted_timestamp.is_(None),
+                )
+                .values(deleted_timestamp=deleted_timestamp)
+                .execution_options(synchronize_session=False)
+            )
+            updated += result.rowcount
 
-    resource.modified_timestamp = new_timestamp
-    session.commit()
+        await session.commit()
 
-    session.close()
+    return updated
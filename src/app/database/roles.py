@@ -1,5 +1,5 @@
 from app.database import orm
-from app.database.utils import get_session
+from app.database.utils import async_session_scope, session_scope
 from app.utils import auth
 
 
@@ -8,7 +8,36 @@ def populate_roles_table():
 
     all_roles = [orm.Role(id=role.value, name=role.name) for role in auth.Role]
 
-    session = get_session()
-    session.add_all(all_roles)
+    with session_scope() as session:
+        session.add_all(all_roles)
 
-    session.commit()
+        session.commit()
+
+
+def add_missing_roles() -> int:
+    """Add the roles missing from the roles table. Returns how many were added."""
+
+    with session_scope() as session:
+        existing_ids = {role_id for (role_id,) in session.query(orm.Role.id)}
+        missing_roles = [
+            orm.Role(id=role.value, name=role.name)
+            for role in auth.Role
+            if role.value not in existing_ids
+        ]
+
+        if missing_roles:
+            session.add_all(missing_roles)
+            session.commit()
+
+    return len(missing_roles)
+
+
+async def populate_roles_table_async():
+    """Async version of populate_roles_table."""
+
+    all_roles = [orm.Role(id=role.value, name=role.name) for role in auth.Role]
+
+    async with async_session_scope() as session:
+        session.add_all(all_roles)
+
+        await session.commit()
@@ -1,33 +1,90 @@
 # from functools import singledispatch
 from typing import Optional
 
+from sqlalchemy import select
+
+from app.config import cfg
 from app.database.orm import User
-from app.database.utils import get_session
+from app.database.utils import async_session_scope, session_scope
+from app.utils.cache import TTLCache
+
+# Users resolved by app.utils.auth.get_user, keyed by username
+user_cache = TTLCache(cfg.USER_CACHE_SIZE, cfg.USER_CACHE_TTL)
 
 
 def add_user(user: User) -> None:
     """Add user to database."""
 
-    session = get_session()
-    session.add(user)
-    session.commit()
+    username = user.username
+
+    with session_scope() as session:
+        session.add(user)
+        session.commit()
+
+    user_cache.invalidate(username)
 
 
 def delete_user(user: User) -> None:
     """Delete user from database."""
 
-    session = get_session()
-    session.delete(user)
-    session.commit()
+    username = user.username
+
+    with session_scope() as session:
+        session.delete(user)
+        session.commit()
+
+    user_cache.invalidate(username)
 
 
 # @singledispatch
 def get_user(username: str) -> Optional[User]:
     """Get user by username."""
 
-    session = get_session()
-    user = session.query(User).filter_by(username=username).first()
-    session.close()
+    with session_scope() as session:
+        user = session.query(User).filter_by(username=username).first()
+
+    return user
+
+
+async def add_user_async(user: User) -> None:
+    """Async version of add_user."""
+
+    username = user.username
+
+    async with async_session_scope() as session:
+        session.add(user)
+        await session.commit()
+
+    user_cache.invalidate(username)
+
+
+async def delete_user_async(user: User) -> None:
+    """Async version of delete_user."""
+
+    username = user.username
+
+    async with async_session_scope() as session:
+        await session.delete(await session.merge(user))
+        await session.commit()
+
+    user_cache.invalidate(username)
+
+
+async def get_user_async(username: str) -> Optional[User]:
+    """Async version of get_user."""
+
+    async with async_session_scope() as session:
+        result = await session.execute(select(User).filter_by(username=username))
+        user = result.scalars().first()
+
+    return user
+
+
+async def get_user_by_id_async(user_id: int) -> Optional[User]:
+    """Get user by id."""
+
+    async with async_session_scope() as session:
+        user = await session.get(User, user_id)
 
     return user
 
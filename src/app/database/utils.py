@@ -1,26 +1,183 @@
-from sqlalchemy import create_engine
-from sqlalchemy.engine import Engine
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncIterator, Iterator, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None  # type: ignore
+
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import Engine, URL, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker, Session
 
+from app import metrics
 from app.database.orm import Base
+from app.utils import timing
+
+# async driver used for each backend by setup_async_engine
+ASYNC_DRIVERS = {"mysql": "aiomysql", "sqlite": "aiosqlite"}
 
-_engine: Engine
+_engine: Optional[Engine] = None
 _session = sessionmaker(autocommit=False, expire_on_commit=True)
 
+_async_engine: Optional[AsyncEngine] = None
+# objects can't lazy load outside of an async session, so don't expire them
+_async_session = sessionmaker(
+    autocommit=False, expire_on_commit=False, class_=AsyncSession
+)
+
+_pool_counters = {
+    "sync": {"connects": 0, "checkouts": 0, "checkins": 0},
+    "async": {"connects": 0, "checkouts": 0, "checkins": 0},
+}
+
+
+def _count_pool_events(engine: Engine, counters: dict) -> None:
+    def count(counter: str):
+        def listener(*_):
+            counters[counter] += 1
+
+        return listener
+
+    event.listen(engine, "connect", count("connects"))
+    event.listen(engine, "checkout", count("checkouts"))
+    event.listen(engine, "checkin", count("checkins"))
+
+
+def _time_queries(engine: Engine, name: str) -> None:
+    """Record the duration of every query of engine in metrics.DB_QUERY_DURATION
+    and in the timings of the current request."""
+
+    # pylint: disable=too-many-arguments
+    def before(conn, _cursor, _statement, _parameters, _context, _executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    def after(conn, _cursor, statement, _parameters, _context, _executemany):
+        start = conn.info["query_start"].pop()
+        duration = time.perf_counter() - start
+        statement_type = statement.split(None, 1)[0].upper()
+        metrics.DB_QUERY_DURATION.labels(name, statement_type).observe(duration)
+        timing.record("db", start, duration)
+
+    def on_error(context):
+        if context.connection is not None and context.connection.info.get(
+            "query_start"
+        ):
+            context.connection.info["query_start"].pop()
+
+    event.listen(engine, "before_cursor_execute", before)
+    event.listen(engine, "after_cursor_execute", after)
+    event.listen(engine, "handle_error", on_error)
+
+
+def _pool_gauges(engine: Engine):
+    def stats() -> dict:
+        status = _pool_status(engine, {})
+        return {
+            stat: status[stat]
+            for stat in ("size", "checkedin", "checkedout", "overflow")
+            if stat in status
+        }
+
+    return stats
+
 
-def setup_engine(url: str, echo: bool = False) -> Engine:
+def _engine_options(
+    url: URL,
+    pool_size: int,
+    max_overflow: int,
+    pool_pre_ping: bool,
+    pool_recycle: int,
+) -> dict:
+    options: dict = {"pool_pre_ping": pool_pre_ping}
+
+    if url.get_backend_name() == "sqlite":
+        # request-scoped sessions are opened and closed in different threads
+        options["connect_args"] = {"check_same_thread": False}
+    else:
+        options.update(
+            pool_size=pool_size,
+            max_overflow=max_overflow,
+            pool_recycle=pool_recycle,
+        )
+
+    return options
+
+
+def setup_engine(
+    url: str,
+    echo: bool = False,
+    pool_size: int = 5,
+    max_overflow: int = 10,
+    pool_pre_ping: bool = False,
+    pool_recycle: int = -1,
+) -> Engine:
     """Sets up engine with provided url. Set echo to True if you want
-    commands sent to database to be echoed in terminal."""
+    commands sent to database to be echoed in terminal.
+
+    Pool size, overflow and recycle are ignored for SQLite, which doesn't
+    use a QueuePool."""
 
     global _engine
 
-    _engine = create_engine(url, echo=echo)
+    sync_url = make_url(url)
+    _engine = create_engine(
+        sync_url,
+        echo=echo,
+        **_engine_options(
+            sync_url, pool_size, max_overflow, pool_pre_ping, pool_recycle
+        ),
+    )
     _session.configure(bind=_engine)
 
+    _count_pool_events(_engine, _pool_counters["sync"])
+    _time_queries(_engine, "sync")
+    metrics.register_pool("db_sync", _pool_gauges(_engine))
+
+    return _engine
+
+
+def setup_async_engine(
+    url: str,
+    echo: bool = False,
+    pool_size: int = 5,
+    max_overflow: int = 10,
+    pool_pre_ping: bool = False,
+    pool_recycle: int = -1,
+) -> AsyncEngine:
+    """Sets up the async engine used by the *_async functions. The driver in
+    url is replaced by the async driver of its backend (see ASYNC_DRIVERS),
+    so the same url as setup_engine() can be used."""
+
+    global _async_engine
+
+    sync_url = make_url(url)
+    backend = sync_url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver for database backend {backend}.")
+
+    async_url = sync_url.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}")
+    _async_engine = create_async_engine(
+        async_url,
+        echo=echo,
+        **_engine_options(
+            async_url, pool_size, max_overflow, pool_pre_ping, pool_recycle
+        ),
+    )
+    _async_session.configure(bind=_async_engine)
+
+    _count_pool_events(_async_engine.sync_engine, _pool_counters["async"])
+    _time_queries(_async_engine.sync_engine, "async")
+    metrics.register_pool("db_async", _pool_gauges(_async_engine.sync_engine))
+
+    return _async_engine
+
 
 def create_tables():
-    """Creates tables as registered in orm.py.
-    Doesn't change anything if tables already exist."""
+    """Creates tables and indexes as registered in orm.py.
+    Doesn't change anything if they already exist."""
 
     if _engine is None:
         raise ValueError(
@@ -29,9 +186,67 @@ def create_tables():
 
     Base.metadata.create_all(_engine)
 
+    # create_all() skips indexes added to tables that already exist
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(_engine, checkfirst=True)
+
+
+@contextmanager
+def advisory_lock(name: str, timeout: int = 60) -> Iterator[None]:
+    """Hold a database wide lock, e.g. to run startup work in a single worker
+    at a time. Waits up to timeout seconds for the lock.
+
+    Uses MySQL's GET_LOCK(), and a lock file next to the database for SQLite.
+    For other backends, and in-memory SQLite databases, this is a no-op."""
+
+    if _engine is None:
+        raise ValueError(
+            "Engine is not setup. Call setup_engine() before advisory_lock()."
+        )
+
+    if _engine.dialect.name == "mysql":
+        with _engine.connect() as conn:
+            acquired = conn.execute(
+                text("SELECT GET_LOCK(:name, :timeout)"),
+                {"name": name, "timeout": timeout},
+            ).scalar()
+            if acquired != 1:
+                raise TimeoutError(f"Could not acquire database lock {name}.")
+
+            try:
+                yield
+            finally:
+                conn.execute(text("SELECT RELEASE_LOCK(:name)"), {"name": name})
+    elif (
+        _engine.dialect.name == "sqlite"
+        and _engine.url.database not in (None, "", ":memory:")
+        and fcntl is not None
+    ):
+        with open(f"{_engine.url.database}.{name}.lock", "w") as lock_file:
+            deadline = time.monotonic() + timeout
+            while True:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    if time.monotonic() > deadline:
+                        raise TimeoutError(
+                            f"Could not acquire database lock {name}."
+                        ) from None
+                    time.sleep(0.05)
+
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+    else:
+        yield
+
 
 def get_session() -> Session:
-    """Returns a session to interact with the database. Expires after each commit."""
+    """Returns a session to interact with the database. Expires after each commit.
+    The caller must close it, prefer session_scope() or get_db()."""
 
     if _engine is None:
         raise ValueError(
@@ -41,3 +256,81 @@ def get_session() -> Session:
     session = _session()
 
     return session
+
+
+@contextmanager
+def session_scope() -> Iterator[Session]:
+    """Context manager yielding a session that is rolled back on error
+    and always closed."""
+
+    session = get_session()
+    try:
+        yield session
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+def get_db() -> Iterator[Session]:
+    """FastAPI dependency yielding one session per request."""
+
+    with session_scope() as session:
+        yield session
+
+
+@asynccontextmanager
+async def async_session_scope() -> AsyncIterator[AsyncSession]:
+    """Async version of session_scope()."""
+
+    if _async_engine is None:
+        raise ValueError(
+            "Async engine is not setup. "
+            "Call setup_async_engine() before async_session_scope()."
+        )
+
+    session = _async_session()
+    try:
+        yield session
+    except Exception:
+        await session.rollback()
+        raise
+    finally:
+        await session.close()
+
+
+async def get_async_db() -> AsyncIterator[AsyncSession]:
+    """FastAPI dependency yielding one async session per request."""
+
+    async with async_session_scope() as session:
+        yield session
+
+
+def _pool_status(engine: Engine, counters: dict) -> dict:
+    pool = engine.pool
+    status = {"pool": type(pool).__name__, **counters}
+
+    # only QueuePool tracks its size and overflow
+    for stat in ("size", "checkedin", "checkedout", "overflow"):
+        if hasattr(pool, stat):
+            status[stat] = getattr(pool, stat)()
+
+    return status
+
+
+def pool_status() -> dict:
+    """Connection pool usage of the sync and async engines."""
+
+    if _engine is None:
+        raise ValueError(
+            "Engine is not setup. Call setup_engine() before pool_status()."
+        )
+
+    status = {"sync": _pool_status(_engine, _pool_counters["sync"])}
+    if _async_engine is not None:
+        status["async"] = _pool_status(
+            _async_engine.sync_engine, _pool_counters["async"]
+        )
+
+    return status
@@ -0,0 +1,285 @@
+"""Background deployment of asynchronous uploads.
+
+POST /k8s/resources/?asynchronous=true stores the parsed documents as a
+DeployJob and returns right away. JOB_WORKERS tasks per process then claim
+jobs from the database, validate and deploy their documents and record the
+progress of each document, which GET /k8s/jobs/{id} reports.
+
+Jobs survive restarts: a running job's worker refreshes a heartbeat, and a
+job without one for JOB_CLAIM_TIMEOUT seconds is claimed again by any worker.
+Once a tier of documents is deployed, their states are recorded with the
+resources they deployed in one transaction, so a resumed job only deploys the
+documents not recorded yet. Those of a tier interrupted before being recorded
+are found by their upload-id label instead of failing as already existing."""
+
+import asyncio
+import json
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from app import database, k8s
+from app.config import cfg
+from app.database import jobs as job_db
+from app.k8s import create_resources
+from app.utils import admission, auth
+
+logger = logging.getLogger("uvicorn.error")
+
+# identifies the workers of this process in deploy_jobs.claimed_by
+PROCESS_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+_workers: List[asyncio.Task] = []
+_wakeup: Optional[asyncio.Event] = None
+
+
+class ClaimLost(Exception):
+    """Raised when another worker took over the job being run."""
+
+
+def _worker_id(index: int) -> str:
+    return f"{PROCESS_ID}:{index}"
+
+
+def notify() -> None:
+    """Wake up the workers of this process, e.g. after submitting a job."""
+
+    if _wakeup is not None:
+        _wakeup.set()
+
+
+async def _record(job_id: str, worker_id: str, *args, **kwargs) -> None:
+    if not await job_db.record_progress_async(job_id, worker_id, *args, **kwargs):
+        raise ClaimLost(f"Job {job_id} was claimed by another worker.")
+
+
+def _resource(owner_id: int, kind: str, name: str) -> database.orm.Resource:
+    return database.orm.Resource(
+        owner=owner_id, name=name, type=kind, created_timestamp=datetime.now()
+    )
+
+
+def _reason(reason) -> str:
+    # validation and deploy failures may be dicts, e.g. Kubernetes API errors
+    return reason if isinstance(reason, str) else json.dumps(reason)
+
+
+async def _heartbeat(job_id: str, worker_id: str) -> None:
+    while True:
+        await asyncio.sleep(cfg.JOB_CLAIM_TIMEOUT / 3)
+        if not await job_db.heartbeat_job_async(job_id, worker_id):
+            return
+
+
+async def _validate(
+    job: database.orm.DeployJob,
+    worker_id: str,
+    documents: List[database.orm.DeployJobDocument],
+) -> Optional[str]:
+    """Validate the pending documents, returns the reason of the first invalid
+    one if any."""
+
+    pending = [document for document in documents if document.state == job_db.PENDING]
+    results = await k8s.aio.validate_all(
+        [json.loads(document.body) for document in pending], cfg.TARGET_NAMESPACE
+    )
+
+    states: job_db.DocumentStates = {}
+    for document, result in zip(pending, results):
+        if result.result:
+            document.state, document.reason = job_db.VALID, None
+        else:
+            document.state, document.reason = job_db.INVALID, _reason(result.reason)
+        states[document.position] = (document.state, document.reason)
+    await _record(job.id, worker_id, states)
+
+    for document in documents:
+        if document.state == job_db.INVALID:
+            return document.reason
+
+    return None
+
+
+async def _adopt_deployed(
+    job: database.orm.DeployJob,
+    worker_id: str,
+    documents: List[database.orm.DeployJobDocument],
+) -> None:
+    """Record the valid documents already deployed by an interrupted attempt."""
+
+    valid = [document for document in documents if document.state == job_db.VALID]
+    labels = await asyncio.gather(
+        *(
+            k8s.aio.get_resource_labels(
+                document.name, document.kind.lower(), cfg.TARGET_NAMESPACE
+            )
+            for document in valid
+        )
+    )
+
+    states: job_db.DocumentStates = {}
+    resources = []
+    for document, document_labels in zip(valid, labels):
+        if (document_labels or {}).get(create_resources.UPLOAD_ID_LABEL) == job.id:
+            document.state = job_db.DEPLOYED
+            states[document.position] = (job_db.DEPLOYED, None)
+            resources.append(_resource(job.owner, document.kind, document.name))
+
+    if states:
+        await _record(job.id, worker_id, states, resources)
+
+
+async def _deploy(
+    job: database.orm.DeployJob,
+    worker_id: str,
+    documents: List[database.orm.DeployJobDocument],
+    username: str,
+) -> Optional[str]:
+    """Deploy the valid documents, recording each tier once deployed. Returns
+    the reason of the first failure if any."""
+
+    valid = [document for document in documents if document.state == job_db.VALID]
+    error = None
+
+    async def record_tier(
+        tier_results: Dict[int, create_resources.DeploymentResult]
+    ) -> None:
+        nonlocal error
+
+        states: job_db.DocumentStates = {}
+        resources = []
+        for index, result in tier_results.items():
+            document = valid[index]
+            if result.result:
+                states[document.position] = (job_db.DEPLOYED, None)
+                resources.append(
+                    _resource(job.owner, result.info.kind, result.info.metadata.name)
+                )
+            else:
+                states[document.position] = (job_db.FAILED, _reason(result.info))
+                error = error or _reason(result.info)
+
+        await _record(job.id, worker_id, states, resources)
+
+    results = await k8s.aio.deploy_all(
+        [json.loads(document.body) for document in valid],
+        cfg.TARGET_NAMESPACE,
+        create_resources.owner_labels(username, job.id),
+        on_tier=record_tier,
+    )
+
+    skipped = {
+        document.position: (job_db.SKIPPED, None)
+        for document, result in zip(valid, results)
+        if result is None
+    }
+    await _record(
+        job.id,
+        worker_id,
+        skipped,
+        job_state=job_db.FAILED if error else job_db.SUCCEEDED,
+        error=error,
+    )
+
+    return error
+
+
+async def run_job(job: database.orm.DeployJob, worker_id: str) -> None:
+    """Validate and deploy the documents of a job claimed by worker_id."""
+
+    owner = await database.users.get_user_by_id_async(job.owner)
+    if owner is None:
+        await _record(
+            job.id, worker_id, {}, job_state=job_db.FAILED, error="Unknown owner."
+        )
+        return
+
+    # calls of the job are scheduled fairly with its owner's other uploads
+    admission.set_tenant(owner.username, auth.Role(owner.role).name)
+
+    documents = await job_db.get_job_documents_async(job.id)
+
+    await k8s.aio.check_namespace(cfg.TARGET_NAMESPACE)()
+
+    error = await _validate(job, worker_id, documents)
+    if error is not None:
+        skipped = {
+            document.position: (job_db.SKIPPED, None)
+            for document in documents
+            if document.state == job_db.VALID
+        }
+        await _record(job.id, worker_id, skipped, job_state=job_db.FAILED, error=error)
+        return
+
+    if job.attempts > 1:
+        await _adopt_deployed(job, worker_id, documents)
+
+    await _deploy(job, worker_id, documents, owner.username)
+
+
+async def _work(worker_id: str) -> None:
+    while True:
+        _wakeup.clear()  # type: ignore
+
+        try:
+            job = await job_db.claim_job_async(
+                worker_id,
+                datetime.now() - timedelta(seconds=cfg.JOB_CLAIM_TIMEOUT),
+                cfg.JOB_MAX_ATTEMPTS,
+            )
+        except Exception as e:  # pylint: disable=broad-except
+            logger.warning(f"Claiming a deploy job failed: {e}")
+            job = None
+
+        if job is None:
+            try:
+                await asyncio.wait_for(
+                    _wakeup.wait(), cfg.JOB_POLL_INTERVAL  # type: ignore
+                )
+            except asyncio.TimeoutError:
+                pass
+            continue
+
+        heartbeat = asyncio.ensure_future(_heartbeat(job.id, worker_id))
+        try:
+            await run_job(job, worker_id)
+        except ClaimLost as e:
+            logger.warning(str(e))
+        except Exception as e:  # pylint: disable=broad-except
+            # left running: resumed once its claim is stale, up to JOB_MAX_ATTEMPTS
+            logger.warning(f"Deploy job {job.id} failed, will be retried: {e}")
+        finally:
+            heartbeat.cancel()
+
+
+def start() -> None:
+    """Start JOB_WORKERS workers in this process."""
+
+    global _wakeup
+
+    if _workers or cfg.JOB_WORKERS <= 0:
+        return
+
+    _wakeup = asyncio.Event()
+    for index in range(cfg.JOB_WORKERS):
+        _workers.append(asyncio.ensure_future(_work(_worker_id(index))))
+
+
+async def stop() -> None:
+    """Stop the workers and queue their jobs again for other processes."""
+
+    for worker in _workers:
+        worker.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+
+    if _workers:
+        released = await job_db.release_jobs_async(
+            [_worker_id(index) for index in range(len(_workers))]
+        )
+        if released:
+            logger.info(f"Queued {released} interrupted deploy jobs again.")
+
+    _workers.clear()
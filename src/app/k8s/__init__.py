@@ -3,4 +3,4 @@ from .create_resources import deploy
 from .utils import check_namespace
 from .deployments import get_all_deployments, delete_deployment
 
-from . import resources
+from . import client, resources, aio, events
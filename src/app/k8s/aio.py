@@ -0,0 +1,270 @@
+"""Async wrappers around the blocking Kubernetes API.
+
+The kubernetes client is synchronous, so every call is offloaded to a bounded
+thread pool. Async route handlers must go through this module instead of
+calling app.k8s functions directly, or they will block the event loop."""
+
+import asyncio
+from itertools import groupby
+from typing import (
+    AsyncIterable,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+)
+
+from app import metrics
+from app.config import cfg
+from app.k8s import create_resources, resources, utils, validate_yaml
+from app.utils import timing
+from app.utils.admission import scheduler
+from app.utils.executor import BoundedExecutor
+
+executor = BoundedExecutor(
+    max_workers=cfg.K8S_MAX_WORKERS,
+    max_pending=cfg.K8S_MAX_PENDING,
+    name="k8s",
+)
+
+metrics.register_pool("k8s_workers", lambda: {"pending": executor.pending})
+
+
+def check_namespace(namespace_name: str):
+    """Async version of app.k8s.check_namespace, to be used as a dependency.
+    Namespaces known to exist are checked without leaving the event loop."""
+
+    async def check_namespace_inner() -> None:
+        if utils.namespace_known(namespace_name):
+            return
+
+        with timing.stage("namespace"):
+            await executor.run(utils.ensure_namespace, namespace_name)
+
+    return check_namespace_inner
+
+
+async def validate(data: dict, target_namespace: str) -> validate_yaml.ValidationResult:
+    """Async version of app.k8s.validate."""
+
+    async with scheduler.slot():
+        with timing.stage("validate"):
+            return await executor.run(validate_yaml.validate, data, target_namespace)
+
+
+async def deploy(
+    data: dict, target_namespace: str, labels: Optional[Dict[str, str]] = None
+) -> create_resources.DeploymentResult:
+    """Async version of app.k8s.deploy."""
+
+    async with scheduler.slot():
+        with timing.stage("deploy"):
+            return await executor.run(
+                create_resources.deploy, data, target_namespace, labels
+            )
+
+
+async def validate_all(
+    docs: List[dict], target_namespace: str
+) -> List[validate_yaml.ValidationResult]:
+    """Validate docs concurrently, at most K8S_MAX_FANOUT at a time.
+    Results are in the same order as docs."""
+
+    semaphore = asyncio.Semaphore(cfg.K8S_MAX_FANOUT)
+
+    async def validate_bounded(doc: dict) -> validate_yaml.ValidationResult:
+        async with semaphore:
+            return await validate(doc, target_namespace)
+
+    return list(await asyncio.gather(*(validate_bounded(doc) for doc in docs)))
+
+
+async def validate_stream(
+    docs: AsyncIterable[dict], target_namespace: str
+) -> Tuple[List[dict], List[validate_yaml.ValidationResult]]:
+    """Like validate_all, but starts validating each document as soon as docs
+    yields it. Returns the received documents and their results, in order."""
+
+    semaphore = asyncio.Semaphore(cfg.K8S_MAX_FANOUT)
+
+    async def validate_bounded(doc: dict) -> validate_yaml.ValidationResult:
+        async with semaphore:
+            return await validate(doc, target_namespace)
+
+    received: List[dict] = []
+    tasks: List[asyncio.Future] = []
+    try:
+        async for doc in docs:
+            received.append(doc)
+            tasks.append(asyncio.ensure_future(validate_bounded(doc)))
+
+        results = await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+
+    return received, list(results)
+
+
+TierCallback = Callable[[Dict[int, create_resources.DeploymentResult]], Awaitable[None]]
+
+
+async def deploy_all(
+    docs: List[dict],
+    target_namespace: str,
+    labels: Optional[Dict[str, str]] = None,
+    on_tier: Optional[TierCallback] = None,
+) -> List[Optional[create_resources.DeploymentResult]]:
+    """Deploy docs tier by tier (see create_resources.DEPLOY_ORDER), concurrently
+    within a tier and at most K8S_MAX_FANOUT at a time, with labels added.
+
+    Results are in the same order as docs. If a tier has a failure, later tiers
+    are not deployed and their results are None. on_tier is awaited after each
+    tier with its results by index in docs, an exception raised by it stops
+    the deployment."""
+
+    semaphore = asyncio.Semaphore(cfg.K8S_MAX_FANOUT)
+    results: List[Optional[create_resources.DeploymentResult]] = [None] * len(docs)
+
+    async def deploy_bounded(index: int) -> None:
+        async with semaphore:
+            results[index] = await deploy(docs[index], target_namespace, labels)
+
+    def tier(index: int) -> int:
+        return create_resources.deploy_tier(docs[index])
+
+    for _, tier_indexes in groupby(sorted(range(len(docs)), key=tier), key=tier):
+        indexes = list(tier_indexes)
+        await asyncio.gather(*(deploy_bounded(index) for index in indexes))
+
+        if on_tier is not None:
+            await on_tier({index: results[index] for index in indexes})  # type: ignore
+
+        if not all(results[index].result for index in indexes):  # type: ignore
+            break
+
+    return results
+
+
+async def get_all_resources(
+    namespace_name: str, labels: Optional[Dict[str, str]] = None
+) -> resources.ResourceList:
+    """Async version of app.k8s.resources.get_all_resources."""
+
+    return await executor.run(resources.get_all_resources, namespace_name, labels)
+
+
+async def get_all_deployments(
+    namespace_name: str, labels: Optional[Dict[str, str]] = None
+) -> list:
+    """Async version of app.k8s.resources.get_all_deployments."""
+
+    return await executor.run(resources.get_all_deployments, namespace_name, labels)
+
+
+async def get_all_services(
+    namespace_name: str, labels: Optional[Dict[str, str]] = None
+) -> list:
+    """Async version of app.k8s.resources.get_all_services."""
+
+    return await executor.run(resources.get_all_services, namespace_name, labels)
+
+
+async def get_resource_labels(
+    resource_name: str, resource_type: str, namespace_name: str
+) -> Optional[Dict[str, str]]:
+    """Async version of app.k8s.resources.get_resource_labels."""
+
+    return await executor.run(
+        resources.get_resource_labels, resource_name, resource_type, namespace_name
+    )
+
+
+async def delete_resource(
+    resource_name: str, resource_type: str, namespace_name: str
+) -> Tuple[str, str]:
+    """Async version of app.k8s.resources.delete_resource."""
+
+    return await executor.run(
+        resources.delete_resource, resource_name, resource_type, namespace_name
+    )
+
+
+class BulkDeleteResult(NamedTuple):
+    # (type, name) of the deleted objects
+    deleted: List[Tuple[str, str]]
+    # (type, name, reason) of the objects that couldn't be deleted
+    failed: List[Tuple[str, str, str]]
+
+
+async def delete_matching(namespace_name: str, selector: str) -> BulkDeleteResult:
+    """Delete the deployments and services matching the label selector.
+    Deployments are deleted with one collection delete, services one by one,
+    concurrently and at most K8S_MAX_FANOUT at a time."""
+
+    semaphore = asyncio.Semaphore(cfg.K8S_MAX_FANOUT)
+
+    async def delete_service(name: str) -> Tuple[str, str]:
+        async with semaphore:
+            return await delete_resource(name, "service", namespace_name)
+
+    async def delete_services() -> List[Tuple[str, Tuple[str, str]]]:
+        names = sorted(
+            await list_resource_names("service", namespace_name, selector)
+        )
+        results = await asyncio.gather(*(delete_service(name) for name in names))
+
+        return list(zip(names, results))
+
+    deployments, services = await asyncio.gather(
+        executor.run(resources.delete_deployments, namespace_name, selector),
+        delete_services(),
+    )
+
+    deleted = [("deployment", name) for name in deployments]
+    failed = []
+    for name, (ret, reason) in services:
+        if ret == "Failure":
+            failed.append(("service", name, reason))
+        else:
+            deleted.append(("service", name))
+
+    return BulkDeleteResult(deleted, failed)
+
+
+async def list_resource_names(
+    resource_type: str, namespace_name: str, label_selector: str
+) -> Set[str]:
+    """Async version of app.k8s.resources.list_resource_names."""
+
+    return await executor.run(
+        resources.list_resource_names, resource_type, namespace_name, label_selector
+    )
+
+
+async def resource_exists(
+    resource_name: str, resource_type: str, namespace_name: str
+) -> bool:
+    """Async version of app.k8s.resources.resource_exists."""
+
+    return await executor.run(
+        resources.resource_exists, resource_name, resource_type, namespace_name
+    )
+
+
+async def add_labels(
+    resource_name: str,
+    resource_type: str,
+    namespace_name: str,
+    labels: Dict[str, str],
+) -> None:
+    """Async version of app.k8s.resources.add_labels."""
+
+    await executor.run(
+        resources.add_labels, resource_name, resource_type, namespace_name, labels
+    )
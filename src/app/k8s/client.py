@@ -0,0 +1,212 @@
+"""Shared, lazily configured Kubernetes API client.
+
+Kube config is loaded on the first call to api_client() rather than at import,
+and every API object shares the same ApiClient and its urllib3 pool."""
+
+import os
+import socket
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from kubernetes import client, config
+from urllib3.connection import HTTPConnection
+
+from app import metrics
+from app.config import cfg
+
+_lock = threading.Lock()
+_configuration: Optional[client.Configuration] = None
+_api_client: Optional[client.ApiClient] = None
+_server_version: Optional[str] = None
+# failure of the last version call and when to retry it (time.monotonic())
+_server_version_error: Optional[Tuple[Exception, float]] = None
+
+SERVER_VERSION_RETRY_DELAY = 30
+
+
+def _verb_and_kind(method: str, url: str, query_params) -> Tuple[str, str]:
+    """Kubernetes verb and resource of a request, e.g. ("list", "deployments")."""
+
+    query = dict(query_params or [])
+    segments = url.split("?", 1)[0].split("/")[3:]  # drop scheme and host
+
+    # /api/v1/... and /apis/<group>/<version>/...
+    if segments[:1] == ["api"]:
+        segments = segments[2:]
+    elif segments[:1] == ["apis"]:
+        segments = segments[3:]
+
+    if len(segments) >= 3 and segments[0] == "namespaces":
+        segments = segments[2:]
+
+    kind = segments[0] if segments else ""
+    named = len(segments) > 1
+
+    if query.get("watch"):
+        verb = "watch"
+    elif method == "GET":
+        verb = "get" if named else "list"
+    elif method == "POST":
+        verb = "dryrun" if query.get("dryRun") else "create"
+    elif method == "DELETE":
+        verb = "delete" if named else "deletecollection"
+    else:
+        verb = method.lower()
+
+    return verb, kind
+
+
+class _ApiClient(client.ApiClient):
+    """ApiClient applying a default request timeout to every non-streaming call,
+    and timing every call in app.metrics."""
+
+    def request(self, method, url, *args, **kwargs):  # pylint: disable=arguments-differ
+        if (
+            kwargs.get("_request_timeout") is None
+            and kwargs.get("_preload_content", True)
+            and cfg.K8S_REQUEST_TIMEOUT > 0
+        ):
+            kwargs["_request_timeout"] = (
+                cfg.K8S_CONNECT_TIMEOUT,
+                cfg.K8S_REQUEST_TIMEOUT,
+            )
+
+        verb, kind = _verb_and_kind(method, url, kwargs.get("query_params"))
+        start = time.perf_counter()
+        try:
+            return super().request(method, url, *args, **kwargs)
+        except client.exceptions.ApiException as e:
+            metrics.K8S_REQUEST_ERRORS.labels(verb, kind, str(e.status)).inc()
+            raise
+        except Exception:
+            metrics.K8S_REQUEST_ERRORS.labels(verb, kind, "").inc()
+            raise
+        finally:
+            metrics.K8S_REQUEST_DURATION.labels(verb, kind).observe(
+                time.perf_counter() - start
+            )
+
+
+def _keepalive_socket_options() -> list:
+    options = list(HTTPConnection.default_socket_options)
+    options.append((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1))
+
+    if cfg.K8S_KEEPALIVE_IDLE > 0 and hasattr(socket, "TCP_KEEPIDLE"):
+        options.append(
+            (socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, cfg.K8S_KEEPALIVE_IDLE)
+        )
+
+    return options
+
+
+def load_configuration() -> client.Configuration:
+    """Load kube config (in cluster or from ~/.kube/config) into a new Configuration."""
+
+    configuration = client.Configuration()
+
+    if os.getenv("KUBERNETES_SERVICE_HOST") is None:
+        config.load_kube_config(client_configuration=configuration)
+    else:
+        config.load_incluster_config(client_configuration=configuration)
+
+    return configuration
+
+
+def set_configuration(configuration: client.Configuration) -> None:
+    """Use configuration instead of the kube config for the shared client.
+    Must be called before the first Kubernetes call."""
+
+    global _configuration, _api_client, _server_version, _server_version_error
+
+    with _lock:
+        if _api_client is not None:
+            _api_client.close()
+
+        _configuration = configuration
+        _api_client = None
+        _server_version = None
+        _server_version_error = None
+
+
+def api_client() -> client.ApiClient:
+    """Returns the shared ApiClient, creating it on first use."""
+
+    global _configuration, _api_client
+
+    if _api_client is not None:
+        return _api_client
+
+    with _lock:
+        if _api_client is None:
+            if _configuration is None:
+                _configuration = load_configuration()
+
+            _configuration.connection_pool_maxsize = cfg.K8S_POOL_MAXSIZE
+
+            new_client = _ApiClient(_configuration)
+            new_client.rest_client.pool_manager.connection_pool_kw[
+                "socket_options"
+            ] = _keepalive_socket_options()
+
+            _api_client = new_client
+            metrics.register_pool("k8s_connections", _connection_pool_stats)
+
+    return _api_client
+
+
+def _connection_pool_stats() -> Dict[str, float]:
+    if _api_client is None:
+        return {}
+
+    pools = _api_client.rest_client.pool_manager.pools
+    idle = 0
+    for key in pools.keys():
+        pool = pools.get(key)
+        if pool is not None and pool.pool is not None:
+            # the queue holds None for connections that were never opened
+            idle += sum(1 for conn in list(pool.pool.queue) if conn is not None)
+
+    return {
+        "maxsize": cfg.K8S_POOL_MAXSIZE,
+        "hosts": len(pools),
+        "idle": idle,
+    }
+
+
+def core_v1() -> client.CoreV1Api:
+    """CoreV1Api bound to the shared ApiClient."""
+
+    return client.CoreV1Api(api_client())
+
+
+def apps_v1() -> client.AppsV1Api:
+    """AppsV1Api bound to the shared ApiClient."""
+
+    return client.AppsV1Api(api_client())
+
+
+def server_version() -> str:
+    """git version of the API server (e.g. v1.21.2), fetched once. A failure
+    is raised again without calling the server for SERVER_VERSION_RETRY_DELAY
+    seconds, callers ask on every validation."""
+
+    global _server_version, _server_version_error
+
+    if _server_version is not None:
+        return _server_version
+
+    if _server_version_error is not None:
+        error, retry_at = _server_version_error
+        if time.monotonic() < retry_at:
+            raise error
+
+    try:
+        _server_version = client.VersionApi(api_client()).get_code().git_version
+    except Exception as e:
+        _server_version_error = (e, time.monotonic() + SERVER_VERSION_RETRY_DELAY)
+        raise
+
+    _server_version_error = None
+
+    return _server_version
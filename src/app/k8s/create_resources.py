@@ -1,23 +1,33 @@
-import os
+import hashlib
+import re
 import traceback
 from dataclasses import dataclass
-from typing import Optional, Union
+from typing import Dict, Optional, Union
 
-from kubernetes import client, config
+from kubernetes import client
+
+from app.k8s.client import apps_v1, core_v1
 
 CHILD_ROLE_NAME = "quick-k8s-child"
+# label of every object deployed by the API, see app.reconciler
+MANAGED_BY_LABEL = "app.kubernetes.io/managed-by"
+MANAGED_BY = "quick-k8s"
+# username of the owner and id of the upload of every deployed object
+OWNER_LABEL = "quick-k8s/owner"
+UPLOAD_ID_LABEL = "quick-k8s/upload-id"
+# label values are at most 63 alphanumerics, "-", "_" or ".", alphanumeric at
+# both ends
+LABEL_VALUE = re.compile(r"^(?:[A-Za-z0-9](?:[-A-Za-z0-9_.]{0,61}[A-Za-z0-9])?)?$")
 CHILD_CPU_LIMIT = ""
 CHILD_RAM_LIMIT = ""
 
-
-if os.getenv("KUBERNETES_SERVICE_HOST") is None:
-    config.load_kube_config()
-else:
-    config.load_incluster_config()
-
-
-k8s_core_v1 = client.CoreV1Api()
-k8s_apps_v1 = client.AppsV1Api()
+# Documents are deployed in tiers, lowest first, so that objects exist before
+# the ones that depend on them: a Service before the Deployment it fronts. Only
+# the kinds validate_yaml accepts are listed.
+DEPLOY_ORDER = {
+    "service": 0,
+    "deployment": 1,
+}
 
 
 @dataclass
@@ -26,6 +36,14 @@ class DeploymentResult:
     info: Optional[Union[str, dict, list]] = None
 
 
+def deploy_tier(data: dict) -> int:
+    """Tier in which data must be deployed. Unknown kinds are deployed last."""
+
+    return DEPLOY_ORDER.get(
+        data.get("kind", "").lower(), max(DEPLOY_ORDER.values()) + 1
+    )
+
+
 def add_role(data: dict) -> dict:
     data["spec"]["template"]["spec"]["serviceAccountName"] = CHILD_ROLE_NAME
     data["spec"]["template"]["spec"]["automountServiceAccountToken"] = True
@@ -33,38 +51,71 @@ def add_role(data: dict) -> dict:
     return data
 
 
+def add_labels(data: dict, labels: dict) -> dict:
+    metadata = data.setdefault("metadata", {})
+    metadata["labels"] = {**(metadata.get("labels") or {}), **labels}
+
+    return data
+
+
+def owner_label_value(username: str) -> str:
+    """Value of OWNER_LABEL for username: the username itself if it is a valid
+    label value, else a hash of it (e.g. for email addresses)."""
+
+    if LABEL_VALUE.match(username):
+        return username
+
+    return "u-" + hashlib.sha1(username.encode()).hexdigest()
+
+
+def owner_labels(username: str, upload_id: str) -> Dict[str, str]:
+    """Labels of the objects deployed by username in upload upload_id."""
+
+    return {OWNER_LABEL: owner_label_value(username), UPLOAD_ID_LABEL: upload_id}
+
+
 def add_resource_limits(data: dict) -> dict:
     # TODO
     return data
 
 
-def deploy_one(resource_type: str, data: dict, target_namespace: str) -> str:
+def deploy_one(
+    resource_type: str,
+    data: dict,
+    target_namespace: str,
+    labels: Optional[Dict[str, str]] = None,
+) -> str:
+
+    data = add_labels(data, {MANAGED_BY_LABEL: MANAGED_BY, **(labels or {})})
 
     if resource_type == "deployment":
         data = add_role(data)
         data = add_resource_limits(data)
 
-        resp = k8s_apps_v1.create_namespaced_deployment(
+        resp = apps_v1().create_namespaced_deployment(
             body=data, namespace=target_namespace
         )
     elif resource_type == "service":
-        resp = k8s_core_v1.create_namespaced_service(
+        resp = core_v1().create_namespaced_service(
             body=data, namespace=target_namespace
         )
 
     return resp
 
 
-def deploy(data: dict, target_namespace: str) -> DeploymentResult:
+def deploy(
+    data: dict, target_namespace: str, labels: Optional[Dict[str, str]] = None
+) -> DeploymentResult:
+    """Deploy data in target_namespace, with labels added to its own."""
 
     resource_type = data.get("kind", "").lower()
 
     try:
-        result = deploy_one(resource_type, data, target_namespace)
+        result = deploy_one(resource_type, data, target_namespace, labels)
     except client.exceptions.ApiException as e:
         print(f"EXCEPTION! {e}")
         print(traceback.format_exc())
 
-        return DeploymentResult(False, "")
+        return DeploymentResult(False, e.reason)
 
     return DeploymentResult(True, result)
@@ -0,0 +1,189 @@
+"""Live status of deployments and services, for streaming to clients.
+
+Subscriptions share the watches of the informers, one per kind and namespace,
+instead of each client polling the API server. Every subscription only keeps
+the latest unsent status of each object, so a slow consumer gets fewer, more
+recent updates instead of a growing backlog. It is closed if updates are
+pending for more than STREAM_MAX_PENDING objects, the client then reconnects
+and starts over from a snapshot."""
+
+import asyncio
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from kubernetes import client
+
+from app import metrics
+from app.config import cfg
+from app.k8s import informer
+
+INFORMERS = (informer.deployments, informer.services)
+
+_subscriptions: List["Subscription"] = []
+_subscriptions_lock = threading.Lock()
+
+metrics.register_pool("event_streams", lambda: {"subscribers": len(_subscriptions)})
+
+
+def _condition(condition) -> dict:
+    return {
+        "type": condition.type,
+        "status": condition.status,
+        "reason": condition.reason,
+        "message": condition.message,
+    }
+
+
+def summarize(kind: str, obj) -> dict:
+    """Status of obj as sent to clients: replicas and conditions of
+    deployments, type and addresses of services."""
+
+    if kind == "Deployment":
+        status = obj.status or client.V1DeploymentStatus()
+        return {
+            "replicas": obj.spec.replicas,
+            "ready_replicas": status.ready_replicas or 0,
+            "updated_replicas": status.updated_replicas or 0,
+            "available_replicas": status.available_replicas or 0,
+            "generation": obj.metadata.generation,
+            "observed_generation": status.observed_generation,
+            "conditions": [
+                _condition(condition) for condition in status.conditions or []
+            ],
+        }
+
+    status = obj.status or client.V1ServiceStatus()
+    ingress = (status.load_balancer and status.load_balancer.ingress) or []
+    return {
+        "type": obj.spec.type,
+        "cluster_ip": obj.spec.cluster_ip,
+        "ingress": [entry.ip or entry.hostname for entry in ingress],
+    }
+
+
+class Subscription:
+    """Changes to the objects of a namespace having all of labels."""
+
+    def __init__(
+        self, namespace: str, labels: Optional[Dict[str, str]], max_pending: int
+    ):
+        self.namespace = namespace
+        self.labels = labels or {}
+        self.max_pending = max_pending
+        self.overflowed = False
+
+        self._loop = asyncio.get_running_loop()
+        self._ready = asyncio.Event()
+        # (kind, name) -> latest unsent event
+        self._pending: Dict[Tuple[str, str], dict] = {}
+        # (kind, name) -> last status sent, to skip updates that changed nothing
+        self._sent: Dict[Tuple[str, str], dict] = {}
+        self._listeners = {
+            kind_informer: self._listener(kind_informer.kind)
+            for kind_informer in INFORMERS
+        }
+
+    def _listener(self, kind: str) -> informer.Listener:
+        def on_event(namespace: str, event_type: str, obj) -> None:
+            # runs in the informer's thread: filter here, hand over to the loop
+            if namespace != self.namespace or not self._matches(obj):
+                return
+
+            event = {"type": event_type, "kind": kind, "name": obj.metadata.name}
+            if event_type != "DELETED":
+                event["status"] = summarize(kind, obj)
+
+            try:
+                self._loop.call_soon_threadsafe(self._put, event, True)
+            except RuntimeError:
+                pass  # loop closed
+
+        return on_event
+
+    def _matches(self, obj) -> bool:
+        return self.labels.items() <= (obj.metadata.labels or {}).items()
+
+    def _put(self, event: dict, replace: bool) -> None:
+        key = (event["kind"], event["name"])
+
+        if not replace and key in self._pending:
+            return
+
+        if key not in self._pending and len(self._pending) >= self.max_pending:
+            self.overflowed = True
+        self._pending[key] = event
+        self._ready.set()
+
+    async def open(self) -> None:
+        """Start receiving changes, and queue a snapshot of the matching
+        objects as ADDED events."""
+
+        with _subscriptions_lock:
+            _subscriptions.append(self)
+
+        for kind_informer, listener in self._listeners.items():
+            kind_informer.add_listener(listener)
+
+        try:
+            # not on the k8s executor: it may block until the namespace is synced
+            await self._loop.run_in_executor(None, self._snapshot)
+        except BaseException:
+            self.close()
+            raise
+
+    def _snapshot(self) -> None:
+        for kind_informer in INFORMERS:
+            for obj in kind_informer.list(self.namespace, self.labels):
+                event = {
+                    "type": "ADDED",
+                    "kind": kind_informer.kind,
+                    "name": obj.metadata.name,
+                    "status": summarize(kind_informer.kind, obj),
+                }
+                # events received since the listeners were added are as recent
+                self._loop.call_soon_threadsafe(self._put, event, False)
+
+    def close(self) -> None:
+        for kind_informer, listener in self._listeners.items():
+            kind_informer.remove_listener(listener)
+
+        with _subscriptions_lock:
+            if self in _subscriptions:
+                _subscriptions.remove(self)
+
+    async def get(self, timeout: float) -> List[dict]:
+        """Pending events, at most one per object, waiting up to timeout
+        seconds for one. Events that don't change what was last sent for their
+        object are dropped."""
+
+        if not self._pending:
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                return []
+
+        pending, self._pending = self._pending, {}
+        self._ready.clear()
+
+        events = []
+        for key, event in pending.items():
+            if event["type"] == "DELETED":
+                if self._sent.pop(key, None) is not None:
+                    events.append(event)
+            elif self._sent.get(key) != event["status"]:
+                self._sent[key] = event["status"]
+                events.append(event)
+
+        return events
+
+
+async def subscribe(
+    namespace: str, labels: Optional[Dict[str, str]] = None
+) -> Subscription:
+    """Subscribe to the objects of namespace having all of labels. The first
+    events are a snapshot of the matching objects. Close it when done."""
+
+    subscription = Subscription(namespace, labels, cfg.STREAM_MAX_PENDING)
+    await subscription.open()
+
+    return subscription
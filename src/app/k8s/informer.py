@@ -0,0 +1,204 @@
+"""Watch-backed in-memory cache of cluster objects.
+
+An Informer lists a kind once per namespace, then follows a watch from the
+returned resourceVersion to keep a local index up to date. Reads are served
+from memory instead of calling the API server."""
+
+import logging
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from kubernetes import watch
+from kubernetes.client.exceptions import ApiException
+
+from app.config import cfg
+from app.k8s.client import apps_v1, core_v1
+
+HTTP_GONE = 410
+
+# called with (namespace, event type, object) on every change
+Listener = Callable[[str, str, object], None]
+
+logger = logging.getLogger("uvicorn.error")
+
+
+class CacheNotSynced(Exception):
+    """Raised when the initial list of a namespace did not finish in time."""
+
+
+class _NamespaceIndex:
+    """Objects of one kind in one namespace, indexed by name."""
+
+    def __init__(self):
+        self.objects: Dict[str, object] = {}
+        self.resource_version: str = ""
+        self.synced = threading.Event()
+        self.lock = threading.Lock()
+
+
+class Informer:
+    """List-then-watch cache for one kind of namespaced object."""
+
+    def __init__(self, kind: str, list_func: Callable[[], Callable]):
+        """list_func returns the API method used to list the kind,
+        e.g. lambda: apps_v1().list_namespaced_deployment."""
+
+        self.kind = kind
+        self._list_func = list_func
+        self._indexes: Dict[str, _NamespaceIndex] = {}
+        self._lock = threading.Lock()
+        self._listeners: List[Listener] = []
+
+    def add_listener(self, listener: Listener) -> None:
+        """Call listener, from the informer's threads, after every change to
+        the cache. A relist is notified as ADDED or MODIFIED for every listed
+        object and DELETED for the ones that are gone."""
+
+        with self._lock:
+            self._listeners = self._listeners + [listener]
+
+    def remove_listener(self, listener: Listener) -> None:
+        with self._lock:
+            self._listeners = [other for other in self._listeners if other != listener]
+
+    def _notify(self, namespace: str, event_type: str, obj: object) -> None:
+        for listener in self._listeners:
+            try:
+                listener(namespace, event_type, obj)
+            except Exception as e:  # pylint: disable=broad-except
+                logger.warning(f"{self.kind} informer listener failed: {e}")
+
+    def _index(self, namespace: str) -> _NamespaceIndex:
+        index = self._indexes.get(namespace)
+        if index is not None:
+            return index
+
+        with self._lock:
+            index = self._indexes.get(namespace)
+            if index is None:
+                index = _NamespaceIndex()
+                self._indexes[namespace] = index
+
+                thread = threading.Thread(
+                    target=self._run,
+                    args=(namespace, index),
+                    name=f"informer-{self.kind}-{namespace}",
+                    daemon=True,
+                )
+                thread.start()
+
+        return index
+
+    def _relist(self, namespace: str, index: _NamespaceIndex) -> None:
+        resp = self._list_func()(namespace=namespace)
+
+        with index.lock:
+            previous = index.objects
+            current = {item.metadata.name: item for item in resp.items}
+            index.objects = current
+            index.resource_version = resp.metadata.resource_version
+
+        index.synced.set()
+
+        if not self._listeners:
+            return
+
+        for name, obj in current.items():
+            self._notify(namespace, "MODIFIED" if name in previous else "ADDED", obj)
+        for name, obj in previous.items():
+            if name not in current:
+                self._notify(namespace, "DELETED", obj)
+
+    def _apply(self, namespace: str, index: _NamespaceIndex, event: dict) -> None:
+        event_type = event["type"]
+
+        if event_type == "BOOKMARK":
+            index.resource_version = event["raw_object"]["metadata"]["resourceVersion"]
+            return
+
+        obj = event["object"]
+        with index.lock:
+            if event_type == "DELETED":
+                index.objects.pop(obj.metadata.name, None)
+            else:
+                index.objects[obj.metadata.name] = obj
+
+            index.resource_version = obj.metadata.resource_version
+
+        self._notify(namespace, event_type, obj)
+
+    def _run(self, namespace: str, index: _NamespaceIndex) -> None:
+        backoff = 1
+        need_list = True
+
+        while True:
+            try:
+                if need_list:
+                    self._relist(namespace, index)
+                    need_list = False
+
+                stream = watch.Watch().stream(
+                    self._list_func(),
+                    namespace=namespace,
+                    resource_version=index.resource_version,
+                    timeout_seconds=cfg.K8S_WATCH_TIMEOUT,
+                    allow_watch_bookmarks=True,
+                )
+                for event in stream:
+                    self._apply(namespace, index, event)
+
+                backoff = 1
+            except ApiException as e:
+                # resourceVersion too old: start over from a fresh list
+                need_list = True
+                if e.status != HTTP_GONE:
+                    logger.warning(f"{self.kind} informer for {namespace}: {e.reason}")
+                    time.sleep(backoff)
+                    backoff = min(backoff * 2, 60)
+            except Exception as e:  # pylint: disable=broad-except
+                need_list = True
+                logger.warning(f"{self.kind} informer for {namespace}: {e}")
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 60)
+
+    def _synced_index(self, namespace: str) -> _NamespaceIndex:
+        index = self._index(namespace)
+
+        if not index.synced.wait(cfg.K8S_CACHE_SYNC_TIMEOUT):
+            raise CacheNotSynced(f"{self.kind} cache for {namespace} is not synced.")
+
+        return index
+
+    def list(
+        self, namespace: str, labels: Optional[Dict[str, str]] = None
+    ) -> List[object]:
+        """Cached objects in namespace having all of labels, like a list with
+        an equality label selector. Blocks on the first call for a namespace
+        until the initial list is done."""
+
+        index = self._synced_index(namespace)
+
+        with index.lock:
+            objects = list(index.objects.values())
+
+        if not labels:
+            return objects
+
+        return [
+            obj
+            for obj in objects
+            if labels.items() <= (obj.metadata.labels or {}).items()
+        ]
+
+    def get(self, namespace: str, name: str) -> Optional[object]:
+        """Cached object name in namespace, None if it isn't in the cache."""
+
+        index = self._synced_index(namespace)
+
+        with index.lock:
+            return index.objects.get(name)
+
+
+deployments = Informer("Deployment", lambda: apps_v1().list_namespaced_deployment)
+services = Informer("Service", lambda: core_v1().list_namespaced_service)
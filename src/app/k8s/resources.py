@@ -1,19 +1,13 @@
 """API for listing and deleting resources in the cluster."""
 
-import os
-from typing import NamedTuple, Tuple, List
+from typing import Dict, NamedTuple, Optional, Set, Tuple, List
 
-from kubernetes import client, config
 from kubernetes.client.exceptions import ApiException
 from kubernetes.client.models.v1_status import V1Status
 
-if os.getenv("KUBERNETES_SERVICE_HOST") is None:
-    config.load_kube_config()
-else:
-    config.load_incluster_config()
-
-k8s_core_v1 = client.CoreV1Api()
-k8s_apps_v1 = client.AppsV1Api()
+from app.config import cfg
+from app.k8s import informer
+from app.k8s.client import apps_v1, core_v1
 
 
 class ResourceList(NamedTuple):
@@ -21,39 +15,101 @@ class ResourceList(NamedTuple):
     services: List[dict]
 
 
-def get_all_resources(namespace_name: str) -> ResourceList:
+def label_selector(labels: Optional[Dict[str, str]]) -> Optional[str]:
+    """Equality label selector matching objects having all of labels."""
+
+    if not labels:
+        return None
+
+    return ",".join(f"{key}={value}" for key, value in labels.items())
+
+
+def get_all_resources(
+    namespace_name: str, labels: Optional[Dict[str, str]] = None
+) -> ResourceList:
     return ResourceList(
-        deployments=get_all_deployments(namespace_name),
-        services=get_all_services(namespace_name),
+        deployments=get_all_deployments(namespace_name, labels),
+        services=get_all_services(namespace_name, labels),
     )
 
 
-def get_all_services(namespace_name: str) -> List[dict]:
-    services = k8s_core_v1.list_namespaced_service(
-        namespace=namespace_name, pretty="false"
-    )
+def _list_services(namespace_name: str, labels: Optional[Dict[str, str]]) -> list:
+    if cfg.K8S_CACHE_ENABLED:
+        try:
+            return informer.services.list(namespace_name, labels)
+        except informer.CacheNotSynced:
+            pass
+
+    return core_v1().list_namespaced_service(
+        namespace=namespace_name, label_selector=label_selector(labels), pretty="false"
+    ).items
+
+
+def _list_deployments(namespace_name: str, labels: Optional[Dict[str, str]]) -> list:
+    if cfg.K8S_CACHE_ENABLED:
+        try:
+            return informer.deployments.list(namespace_name, labels)
+        except informer.CacheNotSynced:
+            pass
+
+    return apps_v1().list_namespaced_deployment(
+        namespace=namespace_name, label_selector=label_selector(labels), pretty="false"
+    ).items
+
 
+def get_all_services(
+    namespace_name: str, labels: Optional[Dict[str, str]] = None
+) -> List[dict]:
     ret = []
 
-    services_list = services.items
+    services_list = _list_services(namespace_name, labels)
     for service in services_list:
         ret.append(service.metadata.name)
 
-    return ret
+    return sorted(ret)
 
 
-def get_all_deployments(namespace_name: str) -> List[dict]:
-    deployments = k8s_apps_v1.list_namespaced_deployment(
-        namespace=namespace_name, pretty="false"
-    )
-
+def get_all_deployments(
+    namespace_name: str, labels: Optional[Dict[str, str]] = None
+) -> List[dict]:
     ret = []
 
-    deployments_list = deployments.items
+    deployments_list = _list_deployments(namespace_name, labels)
     for deployment in deployments_list:
         ret.append(deployment.metadata.name)
 
-    return ret
+    return sorted(ret)
+
+
+def get_resource_labels(
+    resource_name: str, resource_type: str, namespace_name: str
+) -> Optional[Dict[str, str]]:
+    """Labels of an object, None if it doesn't exist or resource_type is
+    unknown. Read from the cache when it is enabled."""
+
+    if resource_type == "deployment":
+        cache, read = informer.deployments, apps_v1().read_namespaced_deployment
+    elif resource_type == "service":
+        cache, read = informer.services, core_v1().read_namespaced_service
+    else:
+        return None
+
+    obj = None
+    if cfg.K8S_CACHE_ENABLED:
+        try:
+            obj = cache.get(namespace_name, resource_name)
+        except informer.CacheNotSynced:
+            pass
+
+    if obj is None:
+        try:
+            obj = read(resource_name, namespace_name)
+        except ApiException as e:
+            if e.status == 404:
+                return None
+            raise
+
+    return obj.metadata.labels or {}
 
 
 def delete_resource(
@@ -73,7 +129,7 @@ def delete_deployment(
     namespace_name: str,
 ) -> Tuple[str, str]:
     try:
-        ret: V1Status = k8s_apps_v1.delete_namespaced_deployment(
+        ret: V1Status = apps_v1().delete_namespaced_deployment(
             deployment_name, namespace_name
         )
     except ApiException as e:
@@ -84,10 +140,98 @@ def delete_deployment(
 
 def delete_service(service_name: str, namespace_name: str) -> Tuple[str, str]:
     try:
-        ret: V1Status = k8s_core_v1.delete_namespaced_service(
+        ret: V1Status = core_v1().delete_namespaced_service(
             service_name, namespace_name
         )
     except ApiException as e:
         return "Failure", e.reason
 
     return ret.status, ret.reason
+
+
+def list_resource_names(
+    resource_type: str, namespace_name: str, label_selector: str
+) -> Set[str]:
+    """Names of the objects of resource_type (deployment or service) matching
+    label_selector, listed from the API server."""
+
+    if resource_type == "deployment":
+        items = apps_v1().list_namespaced_deployment(
+            namespace=namespace_name, label_selector=label_selector
+        ).items
+    elif resource_type == "service":
+        items = core_v1().list_namespaced_service(
+            namespace=namespace_name, label_selector=label_selector
+        ).items
+    else:
+        raise ValueError(f"Unknown resource type {resource_type}")
+
+    return {item.metadata.name for item in items}
+
+
+def resource_exists(
+    resource_name: str, resource_type: str, namespace_name: str
+) -> bool:
+    """Whether the object exists, with a read of the single object."""
+
+    try:
+        if resource_type == "deployment":
+            apps_v1().read_namespaced_deployment(resource_name, namespace_name)
+        elif resource_type == "service":
+            core_v1().read_namespaced_service(resource_name, namespace_name)
+        else:
+            raise ValueError(f"Unknown resource type {resource_type}")
+    except ApiException as e:
+        if e.status == 404:
+            return False
+        raise
+
+    return True
+
+
+def resource_exists_cached(
+    resource_name: str, resource_type: str, namespace_name: str
+) -> bool:
+    """Whether the object exists, from the cache when it is enabled and synced
+    (possibly missing an object created an instant ago), else with a read."""
+
+    cache = {"deployment": informer.deployments, "service": informer.services}.get(
+        resource_type
+    )
+
+    if cfg.K8S_CACHE_ENABLED and cache is not None:
+        try:
+            return cache.get(namespace_name, resource_name) is not None
+        except informer.CacheNotSynced:
+            pass
+
+    return resource_exists(resource_name, resource_type, namespace_name)
+
+
+def add_labels(
+    resource_name: str, resource_type: str, namespace_name: str, labels: Dict[str, str]
+) -> None:
+    """Add labels to an existing object."""
+
+    body = {"metadata": {"labels": labels}}
+
+    if resource_type == "deployment":
+        apps_v1().patch_namespaced_deployment(resource_name, namespace_name, body)
+    elif resource_type == "service":
+        core_v1().patch_namespaced_service(resource_name, namespace_name, body)
+    else:
+        raise ValueError(f"Unknown resource type {resource_type}")
+
+
+def delete_deployments(namespace_name: str, selector: str) -> List[str]:
+    """Delete the deployments matching the label selector with a single
+    collection delete. Returns the names of the deployments listed just before,
+    objects created in between are deleted but not returned."""
+
+    names = list_resource_names("deployment", namespace_name, selector)
+    if names:
+        apps_v1().delete_collection_namespaced_deployment(
+            namespace_name, label_selector=selector
+        )
+
+    return sorted(names)
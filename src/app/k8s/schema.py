@@ -0,0 +1,259 @@
+"""Offline validation of documents against the cluster's OpenAPI schema.
+
+The schema is fetched from the API server once, then cached on disk per
+server version, so validating a document doesn't cost a network round trip."""
+
+import json
+import logging
+import os
+import re
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from app.config import cfg
+from app.k8s.client import api_client, server_version
+
+logger = logging.getLogger("uvicorn.error")
+
+_lock = threading.Lock()
+_validator: Optional["SchemaValidator"] = None
+# set once the load in progress, if any, is over
+_loading: Optional[threading.Event] = None
+# don't retry loading the schema before this time.monotonic() value
+_retry_at = 0.0
+
+SCHEMA_RETRY_DELAY = 60
+# seconds to wait for a load in progress in another thread
+SCHEMA_LOAD_WAIT = 2
+
+
+class SchemaValidator:
+    """Validates documents against the definitions of an OpenAPI v2 spec."""
+
+    def __init__(self, spec: dict):
+        self.definitions: Dict[str, dict] = spec.get("definitions", {})
+
+        # (apiVersion, kind) -> definition name
+        self.kinds: Dict[Tuple[str, str], str] = {}
+        for name, definition in self.definitions.items():
+            for gvk in definition.get("x-kubernetes-group-version-kind", []):
+                api_version = gvk["version"]
+                if gvk["group"]:
+                    api_version = f"{gvk['group']}/{api_version}"
+                self.kinds[(api_version, gvk["kind"])] = name
+
+    @classmethod
+    def from_file(cls, path: str) -> "SchemaValidator":
+        """Load a validator from an OpenAPI v2 spec saved as JSON."""
+
+        with open(path) as spec_file:
+            return cls(json.load(spec_file))
+
+    def knows(self, data: dict) -> bool:
+        """Whether the schema has a definition for the document's kind."""
+
+        return (data.get("apiVersion"), data.get("kind")) in self.kinds
+
+    def validate(self, data: dict) -> List[dict]:
+        """Returns the errors of data, in the format of the API server's
+        status causes. An empty list means the document is valid."""
+
+        key = (data.get("apiVersion"), data.get("kind"))
+        name = self.kinds.get(key)  # type: ignore
+        if name is None:
+            return [
+                {
+                    "reason": "FieldValueNotSupported",
+                    "message": f"Unknown kind {data.get('kind')} "
+                    f"in {data.get('apiVersion')}.",
+                    "field": "kind",
+                }
+            ]
+
+        errors: List[dict] = []
+        self._check(data, self.definitions[name], "", errors)
+
+        return errors
+
+    def _check(self, value, schema: dict, path: str, errors: List[dict]) -> None:
+        # pylint: disable=too-many-branches
+        if value is None:
+            return
+
+        field = path or "<root>"
+
+        if "$ref" in schema:
+            name = schema["$ref"].split("/")[-1]
+
+            # declared as strings but also accept numbers, e.g. cpu: 1
+            if name.endswith((".Quantity", ".IntOrString")):
+                if not isinstance(value, (str, int, float)) or isinstance(value, bool):
+                    errors.append(
+                        _cause("FieldValueInvalid", "must be a string or number", field)
+                    )
+                return
+
+            schema = self.definitions.get(name, {})
+
+        schema_type = schema.get("type")
+
+        if schema_type == "object" or "properties" in schema:
+            if not isinstance(value, dict):
+                errors.append(_cause("FieldValueInvalid", "must be an object", field))
+                return
+
+            properties = schema.get("properties")
+            additional = schema.get("additionalProperties")
+
+            for required in schema.get("required", []):
+                if required not in value:
+                    errors.append(
+                        _cause(
+                            "FieldValueRequired",
+                            "Required value",
+                            _join(path, required),
+                        )
+                    )
+
+            for key, item in value.items():
+                if properties is not None and key in properties:
+                    self._check(item, properties[key], _join(path, key), errors)
+                elif additional is not None:
+                    self._check(item, additional, _join(path, key), errors)
+                elif properties is not None:
+                    errors.append(
+                        _cause("FieldValueInvalid", "unknown field", _join(path, key))
+                    )
+        elif schema_type == "array":
+            if not isinstance(value, list):
+                errors.append(_cause("FieldValueInvalid", "must be an array", field))
+                return
+
+            for i, item in enumerate(value):
+                self._check(item, schema.get("items", {}), f"{path}[{i}]", errors)
+        elif schema_type == "string":
+            if schema.get("format") == "int-or-string":
+                valid = isinstance(value, (str, int, float)) and not isinstance(
+                    value, bool
+                )
+            else:
+                valid = isinstance(value, str)
+
+            if not valid:
+                errors.append(_cause("FieldValueInvalid", "must be a string", field))
+        elif schema_type == "integer":
+            if not isinstance(value, int) or isinstance(value, bool):
+                errors.append(_cause("FieldValueInvalid", "must be an integer", field))
+        elif schema_type == "number":
+            if not isinstance(value, (int, float)) or isinstance(value, bool):
+                errors.append(_cause("FieldValueInvalid", "must be a number", field))
+        elif schema_type == "boolean":
+            if not isinstance(value, bool):
+                errors.append(_cause("FieldValueInvalid", "must be a boolean", field))
+
+
+def _join(path: str, key: str) -> str:
+    return f"{path}.{key}" if path else key
+
+
+def _cause(reason: str, message: str, field: str) -> dict:
+    return {"reason": reason, "message": message, "field": field}
+
+
+def fetch_spec() -> dict:
+    """Fetch the OpenAPI v2 spec from the API server."""
+
+    # the client's default timeout doesn't apply without _preload_content
+    timeout = None
+    if cfg.K8S_REQUEST_TIMEOUT > 0:
+        timeout = (cfg.K8S_CONNECT_TIMEOUT, cfg.K8S_REQUEST_TIMEOUT)
+
+    resp = api_client().call_api(
+        "/openapi/v2",
+        "GET",
+        auth_settings=["BearerToken"],
+        _preload_content=False,
+        _request_timeout=timeout,
+    )
+
+    return json.loads(resp[0].data)
+
+
+def cache_path(version: str) -> str:
+    """Path of the cached spec for a server version."""
+
+    safe_version = re.sub(r"[^A-Za-z0-9_.-]", "_", version)
+
+    return os.path.join(cfg.K8S_SCHEMA_CACHE_DIR, f"openapi-{safe_version}.json")
+
+
+def load_validator() -> SchemaValidator:
+    """Validator for the cluster's schema, from the disk cache if present."""
+
+    path = cache_path(server_version())
+
+    if os.path.exists(path):
+        return SchemaValidator.from_file(path)
+
+    spec = fetch_spec()
+
+    os.makedirs(cfg.K8S_SCHEMA_CACHE_DIR, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as spec_file:
+        json.dump(spec, spec_file)
+    os.replace(tmp_path, path)
+
+    return SchemaValidator(spec)
+
+
+def set_validator(validator: Optional[SchemaValidator]) -> None:
+    """Use validator instead of the cluster's schema, e.g. one loaded from a
+    recorded spec with SchemaValidator.from_file()."""
+
+    global _validator
+
+    with _lock:
+        _validator = validator
+
+
+def get_validator() -> Optional[SchemaValidator]:
+    """The shared validator, loaded on first use. None if the schema can't be
+    loaded, in which case callers should fall back to a dry run.
+
+    One thread loads the schema, outside the lock. The others wait for it at
+    most SCHEMA_LOAD_WAIT seconds, so a slow API server doesn't hold up every
+    validation."""
+
+    global _validator, _loading, _retry_at
+
+    if _validator is not None:
+        return _validator
+
+    with _lock:
+        if _validator is not None or time.monotonic() < _retry_at:
+            return _validator
+
+        loading = _loading
+        if loading is None:
+            _loading = done = threading.Event()
+
+    if loading is not None:
+        loading.wait(SCHEMA_LOAD_WAIT)
+        return _validator
+
+    try:
+        validator: Optional[SchemaValidator] = load_validator()
+    except Exception as e:  # pylint: disable=broad-except
+        logger.warning(f"Could not load the cluster's OpenAPI schema: {e}")
+        validator = None
+
+    with _lock:
+        if validator is None:
+            _retry_at = time.monotonic() + SCHEMA_RETRY_DELAY
+        elif _validator is None:
+            _validator = validator
+        _loading = None
+    done.set()
+
+    return _validator
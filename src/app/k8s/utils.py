@@ -1,25 +1,65 @@
-import os
+import threading
+from typing import Dict
 
-from kubernetes import client, config
+from kubernetes import client
 
-if os.getenv("KUBERNETES_SERVICE_HOST") is None:
-    config.load_kube_config()
-else:
-    config.load_incluster_config()
+from app.config import cfg
+from app.k8s.client import core_v1
+from app.utils.cache import TTLCache
 
+# namespaces known to exist
+namespace_cache = TTLCache(maxsize=1024, ttl=cfg.K8S_NAMESPACE_CACHE_TTL)
 
-k8s_core_v1 = client.CoreV1Api()
-k8s_apps_v1 = client.AppsV1Api()
+_locks_lock = threading.Lock()
+_namespace_locks: Dict[str, threading.Lock] = {}
+
+
+def _namespace_lock(namespace_name: str) -> threading.Lock:
+    with _locks_lock:
+        return _namespace_locks.setdefault(namespace_name, threading.Lock())
+
+
+def namespace_known(namespace_name: str) -> bool:
+    """Whether namespace_name was recently seen to exist."""
+
+    return namespace_cache.get(namespace_name, False)
+
+
+def ensure_namespace(namespace_name: str) -> None:
+    """Create the namespace if it doesn't exist yet.
+
+    Only one thread at a time checks a given namespace, the others wait for
+    its result instead of racing to create it."""
+
+    if namespace_known(namespace_name):
+        return
+
+    with _namespace_lock(namespace_name):
+        if namespace_known(namespace_name):
+            return
+
+        try:
+            core_v1().read_namespace(namespace_name)
+        except client.exceptions.ApiException as e:
+            if e.status != 404:
+                raise
+
+            try:
+                core_v1().create_namespace(
+                    client.V1Namespace(
+                        metadata=client.V1ObjectMeta(name=namespace_name)
+                    )
+                )
+            except client.exceptions.ApiException as create_error:
+                # created by someone else in the meantime
+                if create_error.status != 409:
+                    raise
+
+        namespace_cache.set(namespace_name, True)
 
 
 def check_namespace(namespace_name: str):
     def check_namespace_inner() -> None:
-        namespaces = k8s_core_v1.list_namespace()
-        namespace_names = [namespace.metadata.name for namespace in namespaces.items]
-
-        if namespace_name not in namespace_names:
-            k8s_core_v1.create_namespace(
-                client.V1Namespace(metadata=client.V1ObjectMeta(name=namespace_name))
-            )
+        ensure_namespace(namespace_name)
 
     return check_namespace_inner
@@ -1,18 +1,21 @@
+import hashlib
 import json
-import os
+import logging
 from dataclasses import dataclass
-from typing import Optional, Union
+from typing import Optional, Tuple, Union
 
-from kubernetes import client, config
+from kubernetes import client
 
-if os.getenv("KUBERNETES_SERVICE_HOST") is None:
-    config.load_kube_config()
-else:
-    config.load_incluster_config()
+from app.config import cfg
+from app.k8s import resources, schema
+from app.k8s.client import apps_v1, core_v1, server_version
+from app.utils.cache import TTLCache
 
+logger = logging.getLogger("uvicorn.error")
 
-k8s_core_v1 = client.CoreV1Api()
-k8s_apps_v1 = client.AppsV1Api()
+# status codes of dry runs rejecting the document itself. Other failures
+# (conflicts, permissions, server errors) may not happen again so aren't cached
+CACHEABLE_STATUSES = (400, 422)
 
 
 @dataclass
@@ -21,18 +24,42 @@ class ValidationResult():
     reason: Optional[Union[str, dict, list]] = None
 
 
+# verdicts of previously validated documents, see cache_key()
+validation_cache = TTLCache(cfg.VALIDATION_CACHE_SIZE, cfg.VALIDATION_CACHE_TTL)
+
+
+def cache_key(data: dict, target_namespace: str) -> Optional[str]:
+    """Hash of the document's canonical JSON form, the namespace, the server
+    version and the validation mode. None if the server version is unknown."""
+
+    try:
+        version = server_version()
+    except Exception as e:  # pylint: disable=broad-except
+        logger.warning(f"Not caching validation, unknown server version: {e}")
+        return None
+
+    canonical = json.dumps(data, sort_keys=True, separators=(",", ":"), default=str)
+
+    digest = hashlib.sha256()
+    for part in (version, cfg.K8S_VALIDATION_MODE, target_namespace, canonical):
+        digest.update(part.encode())
+        digest.update(b"\0")
+
+    return digest.hexdigest()
+
+
 def validate_one(resource_type: str,
                  data: dict,
                  target_namespace: str) -> Union[str, ValidationResult]:
 
     if resource_type.lower() == "deployment":
-        resp = k8s_apps_v1.create_namespaced_deployment(
+        resp = apps_v1().create_namespaced_deployment(
             body=data,
             namespace=target_namespace,
             dry_run="All"
         )
     elif resource_type.lower() == "service":
-        resp = k8s_core_v1.create_namespaced_service(
+        resp = core_v1().create_namespaced_service(
             body=data,
             namespace=target_namespace,
             dry_run="All"
@@ -45,14 +72,64 @@ def validate_one(resource_type: str,
 
 
 def validate(data: dict, target_namespace: str) -> ValidationResult:
+    """Validate data against the target namespace. The verdict is cached, so
+    identical documents aren't sent to the API server again.
+
+    A successful dry run also meant that no object had the document's name.
+    That stops being true once it is deployed, so cached successes are only
+    returned once the name is checked to be free, see
+    resources.resource_exists_cached ("fast" mode never checks names)."""
+
+    if not isinstance(data, dict):
+        return ValidationResult(False, "Document is not a mapping.")
 
     resource_type = data.get("kind", None)
 
     if resource_type is None:
         return ValidationResult(False, "Missing 'kind' field.")
 
+    # hashed before anything (e.g. deploy) gets a chance to modify data
+    key = cache_key(data, target_namespace)
+    if key is not None:
+        cached = validation_cache.get(key)
+        if cached is not None:
+            if cached.result and cfg.K8S_VALIDATION_MODE != "fast":
+                return _check_name_free(resource_type, data, target_namespace)
+            return cached
+
+    result, cacheable = _validate(resource_type, data, target_namespace)
+
+    if key is not None and cacheable:
+        validation_cache.set(key, result)
+
+    return result
+
+
+def _validate(
+    resource_type: str, data: dict, target_namespace: str
+) -> Tuple[ValidationResult, bool]:
+    """Returns the validation result and whether it can be cached."""
+
+    if cfg.K8S_VALIDATION_MODE in ("local", "fast"):
+        validator = schema.get_validator()
+
+        if validator is not None and validator.knows(data):
+            causes = validator.validate(data)
+            if causes:
+                return ValidationResult(
+                    False,
+                    {
+                        "error": "YAML file validation failed.",
+                        "message": f"{resource_type} is invalid.",
+                        "causes": causes,
+                    },
+                ), True
+
+            if cfg.K8S_VALIDATION_MODE == "fast":
+                return ValidationResult(True), True
+
     try:
-        validate_one(resource_type, data, target_namespace)
+        ret = validate_one(resource_type, data, target_namespace)
     except client.exceptions.ApiException as e:
         body = json.loads(e.body)
 
@@ -62,6 +139,36 @@ def validate(data: dict, target_namespace: str) -> ValidationResult:
             "causes": body.get("details", {}).get("causes")
         }
 
-        return ValidationResult(False, error_details)
+        return (
+            ValidationResult(False, error_details),
+            e.status in CACHEABLE_STATUSES,
+        )
+
+    if isinstance(ret, ValidationResult):
+        return ret, True
+
+    return ValidationResult(True), True
+
+
+def _check_name_free(
+    resource_type: str, data: dict, target_namespace: str
+) -> ValidationResult:
+    """Success unless an object of the document's kind and name exists, with
+    the message a dry run would give."""
+
+    name = (data.get("metadata") or {}).get("name")
+    plural = f"{resource_type.lower()}s"
+
+    if name and resources.resource_exists_cached(
+        name, resource_type.lower(), target_namespace
+    ):
+        return ValidationResult(
+            False,
+            {
+                "error": "YAML file validation failed.",
+                "message": f'{plural} "{name}" already exists',
+                "causes": None,
+            },
+        )
 
     return ValidationResult(True)
@@ -1,6 +1,10 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request, status
+from fastapi.responses import JSONResponse
 
-from app import pre_init, routers
+from app import jobs, metrics, pre_init, reconciler, routers
+from app.utils import timing
+from app.utils.admission import AdmissionRejected
+from app.utils.executor import ExecutorFull
 
 pre_init.pre_init()
 
@@ -8,8 +12,59 @@ app = FastAPI()
 
 app.include_router(routers.router)
 
+app.add_middleware(timing.ServerTimingMiddleware)
+app.add_middleware(metrics.RequestMetricsMiddleware)
+
+
+@app.on_event("startup")
+async def start_reconciler():
+    reconciler.start()
+
+
+@app.on_event("shutdown")
+async def stop_reconciler():
+    await reconciler.stop()
+
+
+@app.on_event("startup")
+async def start_job_workers():
+    jobs.start()
+
+
+@app.on_event("shutdown")
+async def stop_job_workers():
+    await jobs.stop()
+
+
+@app.exception_handler(ExecutorFull)
+async def executor_full_handler(_: Request, exc: ExecutorFull):
+    """Fail fast when a worker pool is saturated instead of queueing forever."""
+
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": f"Server is overloaded, try again later. ({exc})"},
+    )
+
+
+@app.exception_handler(AdmissionRejected)
+async def admission_rejected_handler(_: Request, exc: AdmissionRejected):
+    """Tell clients over their share of the deploy queue when to come back."""
+
+    return JSONResponse(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
 
 @app.get("/")
 async def home():
 
     return {"msg": "Welcome to the quick_k8s API. More info @ /docs"}
+
+
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+    """Metrics for Prometheus to scrape."""
+
+    return metrics.metrics_response()
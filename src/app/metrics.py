@@ -0,0 +1,169 @@
+"""Prometheus metrics of the API, served at /metrics.
+
+Modules record their own timings with the metrics defined here. Pool usage is
+read when metrics are scraped, from the callbacks given to register_pool()."""
+
+import time
+from typing import Callable, Dict, Optional
+
+from fastapi import Response
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+)
+from prometheus_client.core import GaugeMetricFamily
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+REQUEST_DURATION = Histogram(
+    "quick_k8s_http_request_duration_seconds",
+    "Time to answer a request, until the response headers are sent.",
+    ["method", "route", "status"],
+)
+
+K8S_REQUEST_DURATION = Histogram(
+    "quick_k8s_k8s_request_duration_seconds",
+    "Duration of Kubernetes API calls. Watches are timed until the stream starts.",
+    ["verb", "kind"],
+)
+K8S_REQUEST_ERRORS = Counter(
+    "quick_k8s_k8s_request_errors_total",
+    "Kubernetes API calls answered with an error status or that failed.",
+    ["verb", "kind", "code"],
+)
+
+DB_QUERY_DURATION = Histogram(
+    "quick_k8s_db_query_duration_seconds",
+    "Duration of database queries.",
+    ["engine", "statement"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+
+HASH_DURATION = Histogram(
+    "quick_k8s_password_hash_duration_seconds",
+    "Duration of bcrypt password hashing and verification.",
+    ["operation"],
+    buckets=(0.05, 0.1, 0.2, 0.3, 0.4, 0.5, 0.75, 1, 2, 5),
+)
+
+ADMISSION_WAIT = Histogram(
+    "quick_k8s_admission_wait_seconds",
+    "Time validations and deploys waited for a slot of the fair scheduler.",
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+ADMISSION_REJECTED = Counter(
+    "quick_k8s_admission_rejected_total",
+    "Uploads answered 429 because too many were in progress.",
+)
+
+RECONCILE_DURATION = Histogram(
+    "quick_k8s_reconcile_duration_seconds",
+    "Duration of a reconciliation of the resources table with the cluster.",
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+RECONCILE_RUNS = Counter(
+    "quick_k8s_reconcile_runs_total",
+    "Reconciliations of the resources table, by result (ok or error).",
+    ["result"],
+)
+RECONCILE_DRIFT = Gauge(
+    "quick_k8s_reconcile_drift",
+    "Differences found by the last reconciliation: rows of deleted objects "
+    "(orphaned_rows), managed objects without a row (missing_rows) and "
+    "unlabelled objects that were adopted (adopted).",
+    ["drift"],
+)
+
+# pool name -> returns the pool's gauges, e.g. {"checkedout": 3}
+_pools: Dict[str, Callable[[], Dict[str, float]]] = {}
+
+
+def register_pool(name: str, stats: Callable[[], Dict[str, float]]) -> None:
+    """Export the values returned by stats as quick_k8s_pool{pool=name, stat=...}.
+    Registering a name again replaces its callback."""
+
+    _pools[name] = stats
+
+
+class _PoolCollector:
+    def collect(self):
+        gauge = GaugeMetricFamily(
+            "quick_k8s_pool",
+            "Usage of connection and worker pools.",
+            labels=["pool", "stat"],
+        )
+
+        for name, stats in list(_pools.items()):
+            for stat, value in stats().items():
+                gauge.add_metric([name, stat], value)
+
+        yield gauge
+
+
+REGISTRY.register(_PoolCollector())
+
+
+class RequestMetricsMiddleware:
+    """ASGI middleware recording REQUEST_DURATION. Plain ASGI instead of an
+    HTTP middleware, which would run every request in an extra task and copy
+    its response through a queue."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        # endpoint -> path template, built on the first request once all
+        # routes are included
+        self._paths: Optional[Dict[Callable, str]] = None
+
+    def _route_path(self, scope: Scope) -> str:
+        """Path template of the route that handled the request, e.g.
+        /admin/db/user/{username}, so that paths with parameters don't each
+        get their own series. The router sets the endpoint it matched in
+        scope."""
+
+        if self._paths is None:
+            paths: Dict[Callable, str] = {}
+            for route in scope["app"].routes:
+                endpoint = getattr(route, "endpoint", None)
+                if endpoint is not None:
+                    paths.setdefault(endpoint, route.path)
+            self._paths = paths
+
+        return self._paths.get(scope.get("endpoint"), "<unmatched>")  # type: ignore
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        observed = False
+
+        def observe(status_code: int) -> None:
+            nonlocal observed
+            observed = True
+            REQUEST_DURATION.labels(
+                scope["method"], self._route_path(scope), str(status_code)
+            ).observe(time.perf_counter() - start)
+
+        async def send_observed(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                observe(message["status"])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_observed)
+        finally:
+            if not observed:
+                # unhandled exception, answered 500 by ServerErrorMiddleware
+                observe(500)
+
+
+def metrics_response() -> Response:
+    """Current value of all metrics, in Prometheus' text format."""
+
+    return Response(
+        generate_latest(REGISTRY), headers={"Content-Type": CONTENT_TYPE_LATEST}
+    )
@@ -11,14 +11,47 @@ def pre_init():
     logger = logging.getLogger("uvicorn.error")
 
     # setup database engine and tables if first run
-    database.utils.setup_engine(cfg.DATABASE_URL, echo=False)
-    database.utils.create_tables()
-    try:
-        database.roles.populate_roles_table()
-    except sqlalchemy.exc.IntegrityError:
-        logger.info("Kept roles table from previous init.")
+    database.utils.setup_engine(
+        cfg.DATABASE_URL,
+        echo=False,
+        pool_size=cfg.DB_POOL_SIZE,
+        max_overflow=cfg.DB_MAX_OVERFLOW,
+        pool_pre_ping=cfg.DB_POOL_PRE_PING,
+        pool_recycle=cfg.DB_POOL_RECYCLE,
+    )
+    database.utils.setup_async_engine(
+        cfg.DATABASE_URL,
+        echo=False,
+        pool_size=cfg.DB_ASYNC_POOL_SIZE,
+        max_overflow=cfg.DB_ASYNC_MAX_OVERFLOW,
+        pool_pre_ping=cfg.DB_POOL_PRE_PING,
+        pool_recycle=cfg.DB_POOL_RECYCLE,
+    )
+    # several workers may start at once, let them set up the database in turn
+    with database.utils.advisory_lock("quick_k8s_pre_init"):
+        database.utils.create_tables()
+
+        try:
+            added_roles = database.roles.add_missing_roles()
+        except sqlalchemy.exc.IntegrityError:
+            # inserted by another worker, on backends without advisory_lock
+            added_roles = 0
+
+        if added_roles:
+            logger.info(f"Added {added_roles} roles.")
+        else:
+            logger.info("Kept roles table from previous init.")
 
-    # Set default admin profile for first run
+        # Set default admin profile for first run, bcrypt is only paid then
+        if database.users.get_user("admin") is not None:
+            logger.info("Default admin was already inserted.")
+        else:
+            _add_default_admin(logger)
+
+    logger.info("Setup database.")
+
+
+def _add_default_admin(logger: logging.Logger) -> None:
     hashed_password = auth.get_password_hash(cfg.DEFAULT_ADMIN_PASSWORD)
 
     default_admin = database.orm.User(
@@ -37,5 +70,3 @@ def pre_init():
         logger.info("Added default admin profile.")
     except sqlalchemy.exc.IntegrityError:
         logger.info("Default admin was already inserted.")
-
-    logger.info("Setup database.")
@@ -0,0 +1,185 @@
+"""Periodic reconciliation of the resources table with the cluster.
+
+Objects deleted outside of the API (e.g. with kubectl) leave rows that look
+online, and uploads that crashed between deploying and recording leave objects
+without a row. Every RECONCILE_INTERVAL seconds, the online rows are diffed
+against one list call per resource type, filtered with RECONCILE_SELECTOR:
+- rows whose object is gone are marked deleted, in batched UPDATEs
+- objects without a row are logged, their owner is unknown
+
+Objects deployed before they were labelled aren't listed. Rows missing from
+the list are therefore checked with a read of their object before being marked
+deleted, and objects still there are labelled so later runs list them.
+
+Every worker runs its own reconciler. Runs are idempotent, so this only costs
+duplicate list calls."""
+
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import List, NamedTuple, Optional, Tuple
+
+from app import database, k8s, metrics
+from app.config import cfg
+from app.k8s.create_resources import MANAGED_BY, MANAGED_BY_LABEL
+
+logger = logging.getLogger("uvicorn.error")
+
+# resource types reconciled, as stored lowercased in resources.type
+RECONCILED_TYPES = ("deployment", "service")
+
+_task: Optional[asyncio.Task] = None
+
+
+class ReconcileResult(NamedTuple):
+    orphaned_rows: int
+    missing_rows: List[Tuple[str, str]]
+    adopted: int
+
+
+async def _check_candidate(
+    resource: database.orm.Resource, namespace_name: str
+) -> bool:
+    """Whether the object of resource, missing from the labelled list, still
+    exists. If so it is labelled as managed by the API."""
+
+    resource_type = resource.type.lower()
+
+    if not await k8s.aio.resource_exists(resource.name, resource_type, namespace_name):
+        return False
+
+    await k8s.aio.add_labels(
+        resource.name, resource_type, namespace_name, {MANAGED_BY_LABEL: MANAGED_BY}
+    )
+
+    return True
+
+
+async def reconcile(namespace_name: str) -> ReconcileResult:
+    """Diff the online resources with the cluster once, see the module's doc."""
+
+    # rows first: any row was deployed before being recorded, so an object
+    # missing from the lists below was deleted
+    online = [
+        resource
+        for resource in await database.resources.get_online_resources_async()
+        if resource.type.lower() in RECONCILED_TYPES
+    ]
+
+    cluster_names = dict(
+        zip(
+            RECONCILED_TYPES,
+            await asyncio.gather(
+                *(
+                    k8s.aio.list_resource_names(
+                        resource_type, namespace_name, cfg.RECONCILE_SELECTOR
+                    )
+                    for resource_type in RECONCILED_TYPES
+                )
+            ),
+        )
+    )
+
+    candidates = [
+        resource
+        for resource in online
+        if resource.name not in cluster_names[resource.type.lower()]
+    ]
+    # every row is a candidate on the first run after an upgrade (unlabelled
+    # objects): bounded, so the executor shared with requests isn't flooded
+    semaphore = asyncio.Semaphore(cfg.K8S_MAX_FANOUT)
+
+    async def check_bounded(resource: database.orm.Resource) -> bool:
+        async with semaphore:
+            return await _check_candidate(resource, namespace_name)
+
+    still_there = await asyncio.gather(
+        *(check_bounded(resource) for resource in candidates)
+    )
+
+    orphan_ids = [
+        resource.id
+        for resource, exists in zip(candidates, still_there)
+        if not exists
+    ]
+    orphaned_rows = 0
+    if orphan_ids:
+        orphaned_rows = await database.resources.mark_deleted_async(
+            orphan_ids, datetime.now()
+        )
+
+    recorded = {(resource.type.lower(), resource.name) for resource in online}
+    missing_rows = sorted(
+        (resource_type, name)
+        for resource_type, names in cluster_names.items()
+        for name in names
+        if (resource_type, name) not in recorded
+    )
+
+    return ReconcileResult(orphaned_rows, missing_rows, sum(still_there))
+
+
+async def run_forever(namespace_name: str, interval: float) -> None:
+    """Reconcile every interval seconds until cancelled."""
+
+    while True:
+        start = time.perf_counter()
+        try:
+            result = await reconcile(namespace_name)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:  # pylint: disable=broad-except
+            metrics.RECONCILE_RUNS.labels("error").inc()
+            logger.warning(f"Reconciliation of {namespace_name} failed: {e}")
+        else:
+            metrics.RECONCILE_RUNS.labels("ok").inc()
+            metrics.RECONCILE_DRIFT.labels("orphaned_rows").set(result.orphaned_rows)
+            metrics.RECONCILE_DRIFT.labels("missing_rows").set(len(result.missing_rows))
+            metrics.RECONCILE_DRIFT.labels("adopted").set(result.adopted)
+
+            if result.orphaned_rows:
+                logger.info(
+                    f"Marked {result.orphaned_rows} resources missing from "
+                    f"{namespace_name} as deleted."
+                )
+            for resource_type, name in result.missing_rows:
+                logger.warning(
+                    f"{resource_type} {name} in {namespace_name} is managed by "
+                    "the API but has no row in the resources table."
+                )
+        finally:
+            metrics.RECONCILE_DURATION.observe(time.perf_counter() - start)
+
+        await asyncio.sleep(interval)
+
+
+def start() -> None:
+    """Start reconciling TARGET_NAMESPACE in the background, unless disabled
+    with RECONCILE_INTERVAL=0."""
+
+    global _task
+
+    if cfg.RECONCILE_INTERVAL <= 0 or _task is not None:
+        return
+
+    _task = asyncio.ensure_future(
+        run_forever(cfg.TARGET_NAMESPACE, cfg.RECONCILE_INTERVAL)
+    )
+
+
+async def stop() -> None:
+    """Stop the background reconciliation started by start()."""
+
+    global _task
+
+    if _task is None:
+        return
+
+    _task.cancel()
+    try:
+        await _task
+    except asyncio.CancelledError:
+        pass
+
+    _task = None
@@ -1,8 +1,9 @@
 from fastapi import APIRouter
 
-from app.routers.admin import database
+from app.routers.admin import database, stats
 
 
 router = APIRouter(prefix="/admin")
 
 router.include_router(database.router)
+router.include_router(stats.router)
@@ -1,18 +1,22 @@
 from fastapi import APIRouter, HTTPException, status
 from fastapi.param_functions import Depends
 import sqlalchemy.exc
+from sqlalchemy.orm import Session
 
 from app import database
 from app.utils import auth
+from app.utils.pagination import ResourceQuery, split_by_state
 
 router = APIRouter(prefix="/db", tags=["admin | database"])
 
 
 @router.get("/users")
-def get_users(_: auth.UserInDB = Depends(auth.current_user_is_admin)):
+def get_users(
+    session: Session = Depends(database.utils.get_db),
+    _: auth.UserInDB = Depends(auth.current_user_is_admin),
+):
     """Get all users in database."""
 
-    session = database.utils.get_session()
     users = session.query(database.orm.User)
 
     all_users = list(users)
@@ -21,10 +25,12 @@ def get_users(_: auth.UserInDB = Depends(auth.current_user_is_admin)):
 
 
 @router.get("/roles")
-def get_roles(_: auth.UserInDB = Depends(auth.current_user_is_admin)):
+def get_roles(
+    session: Session = Depends(database.utils.get_db),
+    _: auth.UserInDB = Depends(auth.current_user_is_admin),
+):
     """Get all roles in database."""
 
-    session = database.utils.get_session()
     roles = session.query(database.orm.Role)
 
     all_roles = list(roles)
@@ -33,20 +39,16 @@ def get_roles(_: auth.UserInDB = Depends(auth.current_user_is_admin)):
 
 
 @router.get("/resources")
-def get_resources(_: auth.UserInDB = Depends(auth.current_user_is_admin)):
-    """Get all resources in database."""
-
-    session = database.utils.get_session()
-    resources = session.query(database.orm.Resource)
+async def get_resources(
+    query: ResourceQuery = Depends(),
+    _: auth.UserInDB = Depends(auth.current_user_is_admin),
+):
+    """Get resources in database, newest first.
+    Pass next_cursor as cursor to get the next page."""
 
-    ret: dict = {"online": [], "deleted": []}
-    for resource in resources:
-        if resource.deleted_timestamp is not None:
-            ret["deleted"].append(resource)
-        else:
-            ret["online"].append(resource)
+    page = await database.resources.list_resources_async(**query.filters())
 
-    return {"all_resources": ret}
+    return {"all_resources": split_by_state(page), "next_cursor": page.next_cursor}
 
 
 @router.post("/users")
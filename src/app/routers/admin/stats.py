@@ -0,0 +1,25 @@
+from fastapi import APIRouter
+from fastapi.param_functions import Depends
+
+from app import database, k8s
+from app.utils import auth
+
+router = APIRouter(prefix="/stats", tags=["admin | stats"])
+
+
+@router.get("/cache")
+def get_cache_stats(_: auth.UserInDB = Depends(auth.current_user_is_admin)):
+    """Get size and hit rate of the in-memory caches."""
+
+    return {
+        "users": database.users.user_cache.stats(),
+        "tokens": auth.token_cache.stats(),
+        "validations": k8s.validate_yaml.validation_cache.stats(),
+    }
+
+
+@router.get("/db")
+def get_db_stats(_: auth.UserInDB = Depends(auth.current_user_is_admin)):
+    """Get connection pool usage of the database engine."""
+
+    return {"pool": database.utils.pool_status()}
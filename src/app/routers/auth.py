@@ -16,7 +16,7 @@ router = APIRouter(prefix="/auth", tags=["authentication"])
 async def login_for_access_token(
     form_data: OAuth2PasswordRequestForm = Depends(),
 ):
-    user = auth.authenticate_user(form_data.username, form_data.password)
+    user = await auth.authenticate_user_async(form_data.username, form_data.password)
 
     if not user:
         raise HTTPException(
@@ -37,7 +37,7 @@ async def login_for_access_token(
 
 @router.get("/hash")
 async def get_password_hash(password: str):
-    hashed_password = auth.get_password_hash(password)
+    hashed_password = await auth.get_password_hash_async(password)
     return {"hashed_password": hashed_password}
 
 
@@ -1,8 +1,9 @@
 from fastapi import APIRouter
 
-from app.routers.k8s import resources
+from app.routers.k8s import jobs, resources
 
 
 router = APIRouter(prefix="/k8s")
 
 router.include_router(resources.router)
+router.include_router(jobs.router)
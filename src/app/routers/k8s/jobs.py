@@ -0,0 +1,55 @@
+"""Router for following asynchronous uploads."""
+
+from collections import Counter
+
+from fastapi import APIRouter, Depends, HTTPException, status
+
+from app import database
+from app.utils import auth
+
+
+router = APIRouter(prefix="/jobs", tags=["k8s"])
+
+
+@router.get("/{job_id}")
+async def get_job(
+    job_id: str,
+    current_user: auth.User = Depends(auth.get_current_active_user),
+):
+    """State of a job submitted with POST /k8s/resources/?asynchronous=true and
+    of each of its documents. Only its owner and admins may see it."""
+
+    job = await database.jobs.get_job_async(job_id)
+
+    if job is not None and current_user.role != auth.Role.ADMIN.name:
+        owner = await database.users.get_user_async(current_user.username)
+        if owner is None or owner.id != job.owner:
+            job = None
+
+    if job is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Job not found"
+        )
+
+    documents = await database.jobs.get_job_documents_async(job_id)
+
+    return {
+        "job_id": job.id,
+        "filename": job.filename,
+        "state": job.state,
+        "error": job.error,
+        "attempts": job.attempts,
+        "created_timestamp": job.created_timestamp,
+        "finished_timestamp": job.finished_timestamp,
+        "progress": Counter(document.state for document in documents),
+        "documents": [
+            {
+                "position": document.position,
+                "kind": document.kind,
+                "name": document.name,
+                "state": document.state,
+                "reason": document.reason,
+            }
+            for document in documents
+        ],
+    }
@@ -1,106 +1,425 @@
 """Router for manipulating resources."""
 
+import asyncio
+import json
+import uuid
+from contextlib import contextmanager
 from datetime import datetime
+from typing import AsyncIterator, Dict, Iterator, Optional
 
-from fastapi import APIRouter, Depends, File, HTTPException, UploadFile, status
+from fastapi import APIRouter, Depends, File, HTTPException, Request, UploadFile, status
+from fastapi.responses import JSONResponse, StreamingResponse
+from kubernetes.client.exceptions import ApiException
 import yaml  # type: ignore
 
-from app import k8s, database
-from app.utils import auth
+from app import database, jobs, k8s
+from app.k8s import create_resources, informer
+from app.utils import admission, auth, yaml_stream
 from app.config import cfg
 
 
 router = APIRouter(prefix="/resources", tags=["k8s"])
 
 
+def _owner_labels(owner: Optional[str]) -> Optional[Dict[str, str]]:
+    if owner is None:
+        return None
+
+    return {create_resources.OWNER_LABEL: create_resources.owner_label_value(owner)}
+
+
+def _resolve_owner(owner: Optional[str], current_user: auth.User) -> str:
+    """owner defaults to the current user. Only admins may give another owner,
+    or "*" for any owner."""
+
+    if owner is None:
+        return current_user.username
+
+    if owner != current_user.username and current_user.role != auth.Role.ADMIN.name:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED, detail="Unauthorized"
+        )
+
+    return owner
+
+
 @router.get("/")
 async def get_all_resources(
+    owner: Optional[str] = None,
     _: auth.UserInDB = Depends(auth.current_user_is_admin),
 ):
-    all_resources = k8s.resources.get_all_resources(cfg.TARGET_NAMESPACE)
-    print(all_resources._asdict())
+    """Deployments and services in the cluster, only those deployed by the
+    user owner if given."""
+
+    all_resources = await k8s.aio.get_all_resources(
+        cfg.TARGET_NAMESPACE, _owner_labels(owner)
+    )
 
     return all_resources._asdict()
 
 
+@router.get("/mine")
+async def get_own_resources(
+    current_user: auth.User = Depends(auth.get_current_active_user),
+):
+    """Deployments and services in the cluster deployed by the current user."""
+
+    own_resources = await k8s.aio.get_all_resources(
+        cfg.TARGET_NAMESPACE, _owner_labels(current_user.username)
+    )
+
+    return own_resources._asdict()
+
+
+async def _event_stream(
+    request: Request, subscription: k8s.events.Subscription
+) -> AsyncIterator[str]:
+    try:
+        while not await request.is_disconnected():
+            events = await subscription.get(cfg.STREAM_HEARTBEAT_INTERVAL)
+
+            if subscription.overflowed:
+                # too slow to keep up, the client starts over with a snapshot
+                yield "event: overflow\ndata: {}\n\n"
+                return
+
+            if not events:
+                yield ": keepalive\n\n"
+
+            # each yield waits until the client reads (the middlewares pass
+            # send through), meanwhile the subscription coalesces changes
+            for event in events:
+                yield f"event: {event['type'].lower()}\ndata: {json.dumps(event)}\n\n"
+    finally:
+        subscription.close()
+
+
+@router.get("/events")
+async def stream_events(
+    request: Request,
+    owner: Optional[str] = None,
+    current_user: auth.User = Depends(auth.get_current_active_user),
+):
+    """Stream the status of the deployments and services of owner (default:
+    the current user, "*" for everyone, admins only) as server-sent events.
+
+    The first events are a snapshot ("added"), followed by "modified" and
+    "deleted" events when replicas, conditions or addresses change. Idle
+    streams get a keepalive comment every STREAM_HEARTBEAT_INTERVAL seconds.
+    Clients too slow to keep up get an "overflow" event and are disconnected."""
+
+    owner = _resolve_owner(owner, current_user)
+
+    labels = {create_resources.MANAGED_BY_LABEL: create_resources.MANAGED_BY}
+    if owner != "*":
+        labels.update(_owner_labels(owner))  # type: ignore
+
+    try:
+        subscription = await k8s.events.subscribe(cfg.TARGET_NAMESPACE, labels)
+    except informer.CacheNotSynced as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e)
+        ) from None
+
+    return StreamingResponse(
+        _event_stream(request, subscription),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @router.get("/deployments")
 async def get_all_deployments(
+    owner: Optional[str] = None,
     _: auth.UserInDB = Depends(auth.current_user_is_admin),
 ):
-    deployment_list = k8s.resources.get_all_deployments(cfg.TARGET_NAMESPACE)
+    deployment_list = await k8s.aio.get_all_deployments(
+        cfg.TARGET_NAMESPACE, _owner_labels(owner)
+    )
 
     return deployment_list
 
 
 @router.get("/services")
 async def get_all_services(
+    owner: Optional[str] = None,
     _: auth.UserInDB = Depends(auth.current_user_is_admin),
 ):
-    service_list = k8s.resources.get_all_services(cfg.TARGET_NAMESPACE)
+    service_list = await k8s.aio.get_all_services(
+        cfg.TARGET_NAMESPACE, _owner_labels(owner)
+    )
 
     return service_list
 
 
-@router.post("/")
+@contextmanager
+def _upload_errors() -> Iterator[None]:
+    try:
+        yield
+    except yaml_stream.UploadTooLarge as e:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=str(e),
+        ) from None
+    except yaml.YAMLError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid YAML file: {e}",
+        ) from None
+
+
+def _metadata(doc: dict) -> dict:
+    metadata = doc.get("metadata")
+
+    return metadata if isinstance(metadata, dict) else {}
+
+
+async def _submit_job(
+    documents: AsyncIterator[dict], filename: str, owner: database.orm.User
+) -> JSONResponse:
+    """Store the documents as a deploy job for app.jobs, answered 202."""
+
+    with _upload_errors():
+        docs = [doc async for doc in documents]
+
+    # rejected up front like on the synchronous path, the job can't store them
+    if not all(isinstance(doc, dict) for doc in docs):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Document is not a mapping.",
+        )
+
+    job_id = str(uuid.uuid4())
+    job = database.orm.DeployJob(
+        id=job_id,
+        owner=owner.id,
+        filename=filename,
+        state=database.jobs.QUEUED,
+        attempts=0,
+        created_timestamp=datetime.now(),
+    )
+    job_documents = [
+        database.orm.DeployJobDocument(
+            job_id=job_id,
+            position=position,
+            kind=str(doc.get("kind", ""))[:50],
+            name=str(_metadata(doc).get("name", ""))[:253],
+            # dates and the like as strings, as the Kubernetes client sends them
+            body=json.dumps(doc, default=str),
+            state=database.jobs.PENDING,
+        )
+        for position, doc in enumerate(docs)
+    ]
+
+    await database.jobs.add_job_async(job, job_documents)
+    jobs.notify()
+
+    return JSONResponse(
+        status_code=status.HTTP_202_ACCEPTED,
+        content={
+            "job_id": job_id,
+            "status_url": f"/k8s/jobs/{job_id}",
+            "documents": len(job_documents),
+        },
+    )
+
+
+@router.post("/", dependencies=[Depends(admission.admit)])
 async def create_resource(
     yaml_file: UploadFile = File(...),
-    # namespace_exists: None = Depends(k8s.check_namespace(TARGET_NAMESPACE)),
+    asynchronous: bool = False,
+    _: None = Depends(k8s.aio.check_namespace(cfg.TARGET_NAMESPACE)),
     current_user: auth.User = Depends(auth.get_current_active_user),
 ):
-    # print(f"{current_user=}")
+    """Validate and deploy the documents of yaml_file.
+
+    With asynchronous=true, the upload is answered 202 once parsed, with the
+    id of a job deploying it in the background, see GET /k8s/jobs/{id}."""
 
     filename = yaml_file.filename
 
-    # listify generator because we need to use it multiple times
-    yamls_as_dicts = list(yaml.safe_load_all(yaml_file.file))
+    documents = yaml_stream.stream_documents(
+        yaml_file.file, cfg.UPLOAD_MAX_BYTES, cfg.UPLOAD_MAX_DOCUMENTS
+    )
 
-    # validate docs
-    for doc in yamls_as_dicts:
-        validation_result = k8s.validate(doc, cfg.TARGET_NAMESPACE)
+    if asynchronous:
+        owner = await database.users.get_user_async(current_user.username)
+        return await _submit_job(documents, filename, owner)  # type: ignore
 
+    # validate docs as they are parsed, looking up the owner in the meantime
+    owner_lookup = asyncio.ensure_future(
+        database.users.get_user_async(current_user.username)
+    )
+    try:
+        with _upload_errors():
+            yamls_as_dicts, validation_results = await k8s.aio.validate_stream(
+                documents, cfg.TARGET_NAMESPACE
+            )
+    finally:
+        owner = await owner_lookup
+
+    for validation_result in validation_results:
         if not validation_result.result:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail=validation_result.reason,
             )
 
-    owner = database.users.get_user(current_user.username)
     owner_id = owner.id  # type: ignore
 
-    # deploy docs
+    # deploy docs, labelled with their owner and upload
+    upload_id = str(uuid.uuid4())
+    deployment_results = await k8s.aio.deploy_all(
+        yamls_as_dicts,
+        cfg.TARGET_NAMESPACE,
+        create_resources.owner_labels(current_user.username, upload_id),
+    )
+
     deployed = []
-    for doc in yamls_as_dicts:
-        deployment_result = k8s.deploy(doc, cfg.TARGET_NAMESPACE)
+    new_resources = []
+    failure = None
+    for deployment_result in deployment_results:
+        if deployment_result is None:
+            continue
 
         if not deployment_result.result:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=deployment_result.reason,  # type: ignore
-            )
+            failure = failure or deployment_result
+            continue
 
         deployed_type = deployment_result.info.kind  # type: ignore
         deployed_name = deployment_result.info.metadata.name  # type: ignore
         deployed.append({"name": deployed_name, "type": deployed_type})
 
-        new_resource = database.orm.Resource(
-            owner=owner_id,
-            name=deployed_name,
-            type=deployed_type,
-            created_timestamp=datetime.now(),
+        new_resources.append(
+            database.orm.Resource(
+                owner=owner_id,
+                name=deployed_name,
+                type=deployed_type,
+                created_timestamp=datetime.now(),
+            )
+        )
+
+    await database.resources.add_resources_async(new_resources)
+
+    if failure is not None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail={
+                "error": failure.info,
+                "deployed": deployed,
+                "upload_id": upload_id,
+            },
+        )
+
+    return {"deployed": deployed, "filename": filename, "upload_id": upload_id}
+
+
+@router.delete("/")
+async def delete_resources(
+    owner: Optional[str] = None,
+    upload_id: Optional[str] = None,
+    selector: Optional[str] = None,
+    current_user: auth.User = Depends(auth.get_current_active_user),
+):
+    """Delete the deployments and services deployed by owner, by upload
+    upload_id and/or matching the label selector selector.
+
+    owner defaults to the current user. Only admins may give another owner, or
+    "*" for any owner as long as upload_id or selector is given."""
+
+    owner = _resolve_owner(owner, current_user)
+
+    labels = {create_resources.MANAGED_BY_LABEL: create_resources.MANAGED_BY}
+    if owner != "*":
+        labels.update(_owner_labels(owner))  # type: ignore
+    elif upload_id is None and selector is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="upload_id or selector is required to delete for all owners.",
         )
+    if upload_id is not None:
+        labels[create_resources.UPLOAD_ID_LABEL] = upload_id
 
-        database.resources.add_resource(new_resource)
+    full_selector = k8s.resources.label_selector(labels)
+    if selector:
+        full_selector = f"{full_selector},{selector}"
 
-    return {"deployed": deployed, "filename": filename}
+    try:
+        result = await k8s.aio.delete_matching(cfg.TARGET_NAMESPACE, full_selector)
+    except ApiException as e:
+        if e.status == status.HTTP_400_BAD_REQUEST:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Invalid selector {full_selector}: {e.reason}",
+            ) from None
+        if e.status in (status.HTTP_403_FORBIDDEN, status.HTTP_404_NOT_FOUND):
+            raise HTTPException(status_code=e.status, detail=e.reason) from None
+        raise HTTPException(
+            status_code=status.HTTP_502_BAD_GATEWAY,
+            detail=f"Kubernetes API error: {e.reason}",
+        ) from None
+
+    names: Dict[str, list] = {}
+    for resource_type, resource_name in result.deleted:
+        names.setdefault(resource_type, []).append(resource_name)
+    await database.resources.fake_delete_resources_by_name_async(
+        names, None if owner == "*" else owner
+    )
+
+    return {
+        "deleted": [
+            {"name": resource_name, "type": resource_type}
+            for resource_type, resource_name in result.deleted
+        ],
+        "failed": [
+            {"name": resource_name, "type": resource_type, "reason": reason}
+            for resource_type, resource_name, reason in result.failed
+        ],
+    }
+
+
+async def _delete_labelled(
+    resource_type: str, resource_name: str, owner_label: str, username: str
+) -> dict:
+    if owner_label != create_resources.owner_label_value(username):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=(f"Unknown resource {resource_name} in database."),
+        )
+
+    ret, reason = await k8s.aio.delete_resource(
+        resource_name,
+        resource_type,
+        cfg.TARGET_NAMESPACE,
+    )
+
+    if ret == "Failure":
+        return {"status": ret, "reason": reason}
+
+    await database.resources.fake_delete_owned_resource_async(
+        resource_name, resource_type, username
+    )
+
+    return {"status": ret, "reason": reason}
 
 
 @router.delete("/{resource_type}/{resource_name}")
-def delete_deployment(
+async def delete_deployment(
     resource_type: str,
     resource_name: str,
     current_user: auth.User = Depends(auth.get_current_active_user),
 ):
-    user_db = database.users.get_user(current_user.username)
+    # objects labelled with their owner are checked without the database
+    labels = await k8s.aio.get_resource_labels(
+        resource_name, resource_type, cfg.TARGET_NAMESPACE
+    )
+    owner_label = (labels or {}).get(create_resources.OWNER_LABEL)
+    if owner_label is not None:
+        return await _delete_labelled(
+            resource_type, resource_name, owner_label, current_user.username
+        )
+
+    user_db = await database.users.get_user_async(current_user.username)
 
     if user_db is None:
         raise HTTPException(
@@ -108,7 +427,9 @@ def delete_deployment(
             detail=f"Unknow user in database. (user: {current_user.username})",
         )
 
-    resource_db = database.resources.get_resource(resource_name, user_db.id)
+    resource_db = await database.resources.get_resource_async(
+        resource_name, user_db.id
+    )
     if resource_db is None:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -124,7 +445,7 @@ def delete_deployment(
             ),
         )
 
-    ret, reason = k8s.resources.delete_resource(
+    ret, reason = await k8s.aio.delete_resource(
         resource_name,
         resource_type,
         cfg.TARGET_NAMESPACE,
@@ -133,17 +454,17 @@ def delete_deployment(
     if ret == "Failure":
         return {"status": ret, "reason": reason}
 
-    database.resources.fake_delete_resource(resource_db)
+    await database.resources.fake_delete_resource_async(resource_db)
 
     return {"status": ret, "reason": reason}
 
 
 @router.post("/{resource_type}/{resource_name}")
-def update_deployment_dummy(
+async def update_deployment_dummy(
     resource_name: str,
     current_user: auth.User = Depends(auth.get_current_active_user),
 ):
-    user_db = database.users.get_user(current_user.username)
+    user_db = await database.users.get_user_async(current_user.username)
 
     if user_db is None:
         raise HTTPException(
@@ -152,7 +473,7 @@ def update_deployment_dummy(
         )
 
     new_timestamp = datetime.now()
-    database.resources.set_update_time(
+    await database.resources.set_update_time_async(
         resource_name,
         user_db.id,
         new_timestamp,
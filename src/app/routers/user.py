@@ -2,6 +2,7 @@ from fastapi import APIRouter, HTTPException, status
 from fastapi.param_functions import Depends
 
 from app.utils import auth
+from app.utils.pagination import ResourceQuery, split_by_state
 from app import database
 
 router = APIRouter(prefix="/user", tags=["user"])
@@ -9,27 +10,24 @@ router = APIRouter(prefix="/user", tags=["user"])
 
 @router.get("/resources")
 async def get_user_resources(
+    query: ResourceQuery = Depends(),
     current_user: auth.User = Depends(auth.get_current_active_user),
 ):
-    """Get all resources deployed by current user."""
+    """Get resources deployed by current user, newest first.
+    Pass next_cursor as cursor to get the next page."""
 
-    user_db = database.users.get_user(current_user.username)
+    user_db = await database.users.get_user_async(current_user.username)
     if user_db is None:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="User unknown in database.",
         )
 
-    resources = database.resources.get_user_resources(user_db.id)
+    page = await database.resources.list_resources_async(
+        owner_id=user_db.id, **query.filters()
+    )
 
-    ret: dict = {"online": [], "deleted": []}
-    for resource in resources:
-        if resource.deleted_timestamp is not None:
-            ret["deleted"].append(resource)
-        else:
-            ret["online"].append(resource)
-
-    return ret
+    return {**split_by_state(page), "next_cursor": page.next_cursor}
 
 
 @router.get("/me", response_model=auth.User)
@@ -0,0 +1,196 @@
+"""Fair admission of the Kubernetes calls made for uploads.
+
+Validations and deploys of all requests share ADMISSION_MAX_CONCURRENT slots.
+When they are all taken, calls wait in a weighted fair queue (start-time fair
+queuing): every user gets a share of the slots proportional to the weight of
+their role, however many documents or requests they send, so a huge manifest
+or a burst of CI uploads only slows down its own user.
+
+Requests are admitted with the admit dependency, which rejects them with
+AdmissionRejected (answered 429 with Retry-After) when the user or everyone
+already has too many uploads in progress."""
+
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from fastapi import Depends
+
+from app import metrics
+from app.config import cfg
+from app.utils import auth, timing
+
+# user and weight of the calls made for the current request
+_tenant: ContextVar[Optional[Tuple[str, float]]] = ContextVar("tenant", default=None)
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request can't be queued, retry after retry_after seconds."""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def parse_weights(weights: str) -> Dict[str, float]:
+    """Parse "ADMIN=8,NEW=1" into {"ADMIN": 8.0, "NEW": 1.0}."""
+
+    parsed = {}
+    for item in weights.split(","):
+        if item.strip():
+            role, weight = item.split("=", 1)
+            parsed[role.strip().upper()] = float(weight)
+
+    return parsed
+
+
+class FairScheduler:
+    """Concurrency cap with weighted fair queuing between tenants."""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.running = 0
+        # (start tag, sequence, tenant, future) of the waiting calls
+        self._heap: List[Tuple[float, int, str, asyncio.Future]] = []
+        self._sequence = itertools.count()
+        self._virtual_time = 0.0
+        # tenant -> finish tag of its last queued call
+        self._finish: Dict[str, float] = {}
+        self._queued: Dict[str, int] = {}
+        # tenant -> admitted requests in progress
+        self._admitted: Dict[str, int] = {}
+        # moving average of the duration of admitted requests, for Retry-After
+        self._request_time = 1.0
+
+    @property
+    def queued(self) -> int:
+        return sum(self._queued.values())
+
+    @property
+    def admitted(self) -> int:
+        return sum(self._admitted.values())
+
+    def admitted_by(self, tenant: str) -> int:
+        return self._admitted.get(tenant, 0)
+
+    def retry_after(self) -> int:
+        """Seconds after which an admitted request has likely finished."""
+
+        return max(1, math.ceil(self._request_time))
+
+    def enter(self, tenant: str) -> None:
+        self._admitted[tenant] = self._admitted.get(tenant, 0) + 1
+
+    def exit(self, tenant: str, duration: float) -> None:
+        self._admitted[tenant] -= 1
+        if not self._admitted[tenant]:
+            del self._admitted[tenant]
+        self._request_time = 0.9 * self._request_time + 0.1 * duration
+
+    def _dispatch(self) -> None:
+        while self.running < self.capacity and self._heap:
+            start_tag, _, _, future = heapq.heappop(self._heap)
+            if future.cancelled():
+                continue
+
+            self._virtual_time = start_tag
+            self.running += 1
+            future.set_result(None)
+
+        if not self._heap:
+            # nobody waits: the next calls start on an equal footing
+            self._finish.clear()
+
+    async def acquire(self, tenant: str, weight: float) -> None:
+        """Wait for a slot, to be given back with release()."""
+
+        start_tag = max(self._virtual_time, self._finish.get(tenant, 0.0))
+        self._finish[tenant] = start_tag + 1 / weight
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, (start_tag, next(self._sequence), tenant, future))
+        self._queued[tenant] = self._queued.get(tenant, 0) + 1
+        try:
+            self._dispatch()
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release()
+            else:
+                future.cancel()
+            raise
+        finally:
+            self._queued[tenant] -= 1
+            if not self._queued[tenant]:
+                del self._queued[tenant]
+
+    def release(self) -> None:
+        self.running -= 1
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """Hold a slot for the current request's user, see admit."""
+
+        tenant, weight = _tenant.get() or ("", 1.0)
+
+        start = time.perf_counter()
+        with timing.stage("queue"):
+            await self.acquire(tenant, weight)
+        metrics.ADMISSION_WAIT.observe(time.perf_counter() - start)
+
+        try:
+            yield
+        finally:
+            self.release()
+
+
+scheduler = FairScheduler(cfg.ADMISSION_MAX_CONCURRENT)
+weights = parse_weights(cfg.ADMISSION_WEIGHTS)
+
+metrics.register_pool(
+    "admission",
+    lambda: {
+        "admitted": scheduler.admitted,
+        "running": scheduler.running,
+        "queued": scheduler.queued,
+    },
+)
+
+
+def set_tenant(username: str, role: str) -> None:
+    """Schedule the calls made from now on in the current context for
+    username, with the weight of role."""
+
+    _tenant.set((username, weights.get(role, 1.0)))
+
+
+async def admit(current_user: auth.User = Depends(auth.get_current_active_user)):
+    """Dependency admitting a request whose Kubernetes calls go through the
+    scheduler, with the weight of the user's role, until it is answered."""
+
+    username = current_user.username
+
+    if scheduler.admitted >= cfg.ADMISSION_MAX_QUEUED:
+        reason = "Too many uploads in progress"
+    elif scheduler.admitted_by(username) >= cfg.ADMISSION_MAX_QUEUED_PER_USER:
+        reason = "Too many of your uploads in progress"
+    else:
+        reason = None
+
+    if reason is not None:
+        metrics.ADMISSION_REJECTED.inc()
+        raise AdmissionRejected(f"{reason}, try again later.", scheduler.retry_after())
+
+    set_tenant(username, current_user.role)
+    scheduler.enter(username)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        scheduler.exit(username, time.perf_counter() - start)
@@ -1,4 +1,6 @@
 # pylint: disable=too-few-public-methods
+import hashlib
+import time
 from enum import Enum
 from datetime import datetime, timedelta
 from typing import Literal, Optional, Union
@@ -9,15 +11,33 @@ from jose import jwt, JWTError
 from passlib.context import CryptContext
 from pydantic import BaseModel, validator  # pylint: disable=no-name-in-module
 
-from app import database
+from app import database, metrics
 from app.config import cfg
+from app.utils.cache import TTLCache
+from app.utils.executor import BoundedExecutor
 
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+# bcrypt is CPU bound and takes hundreds of milliseconds, keep it off the event loop
+hash_executor = BoundedExecutor(
+    max_workers=cfg.HASH_MAX_WORKERS,
+    max_pending=cfg.HASH_MAX_PENDING,
+    name="bcrypt",
+)
+metrics.register_pool("bcrypt_workers", lambda: {"pending": hash_executor.pending})
+
+_HASH_DURATION = metrics.HASH_DURATION.labels("hash")
+_VERIFY_DURATION = metrics.HASH_DURATION.labels("verify")
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/token")
 api_key_scheme = APIKeyQuery(name="api_key")
 
+# Verified token payloads, keyed by a digest of the token. SECRET_KEY and
+# ALGORITHM are read once at import, so a rotated key only takes effect after a
+# restart, which starts with an empty cache too
+token_cache = TTLCache(cfg.TOKEN_CACHE_SIZE, cfg.TOKEN_CACHE_TTL)
+
 
 class Role(Enum):
     """Roles class."""
@@ -76,29 +96,77 @@ class Password(BaseModel):
     is_hashed: bool
 
 
+def _verify(plain_password, hashed_password):
+    with _VERIFY_DURATION.time():
+        return pwd_context.verify(plain_password, hashed_password)
+
+
+def _hash(password):
+    with _HASH_DURATION.time():
+        return pwd_context.hash(password)
+
+
 def verify_password(plain_password, hashed_password):
     """Verify provided password against stored password."""
 
-    return pwd_context.verify(plain_password, hashed_password)
+    return hash_executor.submit(_verify, plain_password, hashed_password).result()
+
+
+async def verify_password_async(plain_password, hashed_password):
+    """Async version of verify_password."""
+
+    return await hash_executor.run(_verify, plain_password, hashed_password)
 
 
 def get_password_hash(password):
     """Get hash from plain password."""
 
-    return pwd_context.hash(password)
+    return hash_executor.submit(_hash, password).result()
+
+
+async def get_password_hash_async(password):
+    """Async version of get_password_hash."""
+
+    return await hash_executor.run(_hash, password)
 
 
 def get_user(username: str) -> Optional[UserInDB]:
-    """Get user data from username."""
+    """Get user data from username. Served from database.users.user_cache
+    when possible."""
+
+    cached_user = database.users.user_cache.get(username)
+    if cached_user is not None:
+        return cached_user
 
     user = database.users.get_user(username)
     if user is None:
         return None
 
+    return _cache_user(user)
+
+
+async def get_user_async(username: str) -> Optional[UserInDB]:
+    """Async version of get_user."""
+
+    cached_user = database.users.user_cache.get(username)
+    if cached_user is not None:
+        return cached_user
+
+    user = await database.users.get_user_async(username)
+    if user is None:
+        return None
+
+    return _cache_user(user)
+
+
+def _cache_user(user: database.orm.User) -> UserInDB:
     user_dict = user.dict()
     user_dict["role"] = Role(user_dict["role"]).name
 
-    return UserInDB(**user_dict)
+    user_in_db = UserInDB(**user_dict)
+    database.users.user_cache.set(user_in_db.username, user_in_db)
+
+    return user_in_db
 
 
 def authenticate_user(
@@ -119,6 +187,23 @@ def authenticate_user(
     return User(**user.dict())
 
 
+async def authenticate_user_async(
+    username: str,
+    password: str,
+) -> Union[User, Literal[False]]:
+    """Async version of authenticate_user."""
+
+    user = await get_user_async(username)
+
+    if user is None:
+        return False
+
+    if not await verify_password_async(password, user.hashed_password):
+        return False
+
+    return User(**user.dict())
+
+
 def create_access_token(
     data: dict,
     expires_delta: Optional[timedelta] = None,
@@ -142,6 +227,33 @@ def create_access_token(
     return encoded_jwt
 
 
+def decode_token(token: str) -> dict:
+    """Verify token and return its payload. Raises JWTError if invalid.
+
+    Verified payloads are cached until the token expires, so a token reused
+    across requests is only verified once."""
+
+    token_digest = hashlib.sha256(token.encode()).digest()
+
+    payload = token_cache.get(token_digest)
+    if payload is not None:
+        if payload.get("exp", float("inf")) > time.time():
+            return payload
+
+        token_cache.invalidate(token_digest)
+        raise JWTError("Signature has expired.")
+
+    payload = jwt.decode(token, cfg.SECRET_KEY, algorithms=[cfg.ALGORITHM])
+
+    ttl = token_cache.ttl
+    if "exp" in payload:
+        ttl = min(ttl, payload["exp"] - time.time())
+    if ttl > 0:
+        token_cache.set(token_digest, payload, ttl=ttl)
+
+    return payload
+
+
 async def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
     """Get current user from token."""
 
@@ -152,7 +264,7 @@ async def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
     )
 
     try:
-        payload = jwt.decode(token, cfg.SECRET_KEY, algorithms=[cfg.ALGORITHM])
+        payload = decode_token(token)
         username: str = payload.get("sub")
         if username is None:
             raise credentials_exception
@@ -164,7 +276,7 @@ async def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
     if token_data.username is None:
         raise credentials_exception
 
-    user = get_user(username=token_data.username)
+    user = await get_user_async(username=token_data.username)
 
     if user is None:
         raise credentials_exception
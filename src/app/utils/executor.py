@@ -0,0 +1,72 @@
+"""Bounded thread pool for running blocking calls from async code."""
+
+import asyncio
+import contextvars
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+
+class ExecutorFull(Exception):
+    """Raised when a BoundedExecutor already holds its maximum of pending calls."""
+
+
+class BoundedExecutor:
+    """Thread pool with a cap on running + queued calls.
+
+    Calls over the cap are rejected with ExecutorFull instead of piling up
+    in the pool's unbounded queue."""
+
+    def __init__(self, max_workers: int, max_pending: int, name: str):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._pool = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix=name
+        )
+        self._slots = threading.BoundedSemaphore(max_workers + max_pending)
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    @property
+    def pending(self) -> int:
+        """Number of calls currently running or waiting for a worker."""
+
+        return self._pending
+
+    def _release(self, _future) -> None:
+        with self._lock:
+            self._pending -= 1
+        self._slots.release()
+
+    def submit(self, func: Callable, *args, **kwargs):
+        """Submit func to the pool, raising ExecutorFull if the pool is saturated."""
+
+        if not self._slots.acquire(blocking=False):
+            raise ExecutorFull(
+                f"{self.max_workers + self.max_pending} calls already pending."
+            )
+
+        with self._lock:
+            self._pending += 1
+
+        # copy context so that contextvars set by the caller are visible
+        ctx = contextvars.copy_context()
+        try:
+            future = self._pool.submit(ctx.run, functools.partial(func, *args, **kwargs))
+        except BaseException:
+            self._release(None)
+            raise
+        future.add_done_callback(self._release)
+
+        return future
+
+    async def run(self, func: Callable, *args, **kwargs) -> Any:
+        """Run func in the pool and await its result."""
+
+        return await asyncio.wrap_future(self.submit(func, *args, **kwargs))
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Shut down the underlying pool."""
+
+        self._pool.shutdown(wait=wait)
@@ -0,0 +1,56 @@
+"""Query parameters shared by the paginated resource listings."""
+
+# pylint: disable=too-few-public-methods
+from datetime import datetime
+from typing import Optional
+
+from fastapi import Query
+
+from app.database.resources import ResourcePage
+
+MAX_PAGE_SIZE = 1000
+
+
+class ResourceQuery:
+    """Filters and cursor of a resource listing, as a FastAPI dependency."""
+
+    def __init__(
+        self,
+        state: Optional[str] = Query(None, regex="^(online|deleted)$"),
+        type: Optional[str] = None,  # pylint: disable=redefined-builtin
+        created_after: Optional[datetime] = None,
+        created_before: Optional[datetime] = None,
+        cursor: Optional[int] = None,
+        limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+    ):
+        self.state = state
+        self.resource_type = type
+        self.created_after = created_after
+        self.created_before = created_before
+        self.cursor = cursor
+        self.limit = limit
+
+    def filters(self) -> dict:
+        """Keyword arguments for database.resources.list_resources."""
+
+        return {
+            "state": self.state,
+            "resource_type": self.resource_type,
+            "created_after": self.created_after,
+            "created_before": self.created_before,
+            "cursor": self.cursor,
+            "limit": self.limit,
+        }
+
+
+def split_by_state(page: ResourcePage) -> dict:
+    """Online and deleted resources of page."""
+
+    ret: dict = {"online": [], "deleted": []}
+    for resource in page.resources:
+        if resource.deleted_timestamp is not None:
+            ret["deleted"].append(resource)
+        else:
+            ret["online"].append(resource)
+
+    return ret
@@ -0,0 +1,197 @@
+"""Stage timing of requests, returned in a Server-Timing header.
+
+Code on the request path marks its stages with stage() or record(). Timings
+are kept in a context variable, so they follow the request into tasks and
+threads started with a copy of its context; both are no-ops outside a request.
+Spans of a stage may overlap (documents are validated concurrently), so the
+duration of a stage is the wall time during which at least one of its spans
+was running, and the summed duration of its spans is given as description."""
+
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional
+
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.config import cfg
+
+logger = logging.getLogger("uvicorn.error")
+
+_trace_lock = threading.Lock()
+
+
+class RequestTimings:
+    """Stages and spans of a single request."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.started_at = time.time()
+        self.spans: List[dict] = []
+        self._lock = threading.Lock()
+
+    def add(self, name: str, start: float, duration: float) -> None:
+        """Add a span of duration seconds that started at start (perf_counter)."""
+
+        span = {
+            "name": name,
+            "start_ms": round((start - self.start) * 1000, 3),
+            "duration_ms": round(duration * 1000, 3),
+            "thread": threading.current_thread().name,
+        }
+        with self._lock:
+            self.spans.append(span)
+
+    def summary(self) -> Dict[str, dict]:
+        """Wall time, summed time and number of spans of each stage, in ms."""
+
+        with self._lock:
+            spans = sorted(self.spans, key=lambda span: span["start_ms"])
+
+        stages: Dict[str, dict] = {}
+        # end of the last span of each stage, to merge overlapping ones
+        ends: Dict[str, float] = {}
+        for span in spans:
+            name, start = span["name"], span["start_ms"]
+            end = start + span["duration_ms"]
+
+            stage = stages.setdefault(
+                name, {"wall_ms": 0.0, "total_ms": 0.0, "count": 0}
+            )
+            stage["total_ms"] += span["duration_ms"]
+            stage["count"] += 1
+
+            covered_until = max(ends.get(name, start), start)
+            if end > covered_until:
+                stage["wall_ms"] += end - covered_until
+            ends[name] = max(ends.get(name, end), end)
+
+        for stage in stages.values():
+            stage["wall_ms"] = round(stage["wall_ms"], 3)
+            stage["total_ms"] = round(stage["total_ms"], 3)
+
+        return stages
+
+    def header(self, total: float) -> str:
+        """Value of the Server-Timing header."""
+
+        metrics = [
+            f'{name};dur={stage["wall_ms"]};desc="{stage["count"]}x, '
+            f'{stage["total_ms"]}ms summed"'
+            for name, stage in self.summary().items()
+        ]
+        metrics.append(f"total;dur={round(total * 1000, 3)}")
+
+        return ", ".join(metrics)
+
+
+_timings: ContextVar[Optional[RequestTimings]] = ContextVar("timings", default=None)
+
+
+def current() -> Optional[RequestTimings]:
+    """Timings of the current request, None outside of a request."""
+
+    return _timings.get()
+
+
+def record(
+    name: str, start: float, duration: float, timings: Optional[RequestTimings] = None
+) -> None:
+    """Add a span to timings, by default those of the current request."""
+
+    timings = timings or _timings.get()
+    if timings is not None:
+        timings.add(name, start, duration)
+
+
+@contextmanager
+def stage(name: str, timings: Optional[RequestTimings] = None) -> Iterator[None]:
+    """Time the enclosed block as a span of stage name. Pass timings explicitly
+    in threads that don't run in a copy of the request's context."""
+
+    timings = timings or _timings.get()
+    if timings is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, start, time.perf_counter() - start)
+
+
+def _write_trace(line: str) -> None:
+    with _trace_lock:
+        os.makedirs(os.path.dirname(cfg.TIMING_TRACE_FILE) or ".", exist_ok=True)
+        with open(cfg.TIMING_TRACE_FILE, "a") as trace_file:
+            trace_file.write(line + "\n")
+
+
+class ServerTimingMiddleware:
+    """ASGI middleware collecting the request's timings, returning them in the
+    Server-Timing header and optionally logging and exporting them.
+
+    send is passed through, not copied through a queue like HTTP middlewares
+    do, so a streamed response still waits for slow clients (see
+    app.k8s.events)."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = RequestTimings()
+
+        async def send_timed(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                total = time.perf_counter() - timings.start
+                MutableHeaders(scope=message).append(
+                    "Server-Timing", timings.header(total)
+                )
+                _export(scope, message["status"], timings, total)
+            await send(message)
+
+        token = _timings.set(timings)
+        try:
+            await self.app(scope, receive, send_timed)
+        finally:
+            _timings.reset(token)
+
+
+def _export(scope: Scope, status: int, timings: RequestTimings, total: float) -> None:
+    if not (cfg.TIMING_LOG_ENABLED or cfg.TIMING_TRACE_ENABLED) or not timings.spans:
+        return
+
+    record_line = {
+        "method": scope["method"],
+        "path": scope["path"],
+        "status": status,
+        "total_ms": round(total * 1000, 3),
+        "stages": timings.summary(),
+    }
+
+    if cfg.TIMING_LOG_ENABLED:
+        logger.info(json.dumps(record_line))
+
+    if cfg.TIMING_TRACE_ENABLED and total * 1000 >= cfg.TIMING_TRACE_MIN_MS:
+        trace = {
+            "trace_id": uuid.uuid4().hex,
+            "start": timings.started_at,
+            **record_line,
+            "spans": timings.spans,
+        }
+        # appending to the file is blocking, keep it off the event loop
+        asyncio.get_running_loop().run_in_executor(
+            None, _write_trace, json.dumps(trace)
+        )
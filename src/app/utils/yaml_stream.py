@@ -0,0 +1,105 @@
+"""Incremental parsing of multi-document YAML uploads with size limits."""
+
+import asyncio
+import threading
+from typing import AsyncIterator, BinaryIO, Iterator
+
+import yaml  # type: ignore
+
+from app.utils import timing
+
+try:
+    # libyaml bindings, much faster than the pure Python loader
+    from yaml import CSafeLoader as SafeLoader  # type: ignore
+except ImportError:
+    from yaml import SafeLoader  # type: ignore
+
+
+class UploadTooLarge(ValueError):
+    """Raised when an upload exceeds the byte or document limit."""
+
+
+class _LimitedReader:
+    """File wrapper raising UploadTooLarge once more than max_bytes were read."""
+
+    def __init__(self, stream: BinaryIO, max_bytes: int):
+        self._stream = stream
+        self._max_bytes = max_bytes
+        self._read = 0
+
+    def read(self, size: int = -1) -> bytes:
+        data = self._stream.read(size)
+        self._read += len(data)
+
+        if self._read > self._max_bytes:
+            raise UploadTooLarge(f"File is larger than {self._max_bytes} bytes.")
+
+        return data
+
+
+def iter_documents(
+    stream: BinaryIO, max_bytes: int, max_documents: int
+) -> Iterator[dict]:
+    """Yield the documents of stream one by one as they are parsed.
+    Empty documents are skipped."""
+
+    loader = SafeLoader(_LimitedReader(stream, max_bytes))
+    count = 0
+
+    try:
+        while loader.check_data():
+            doc = loader.get_data()
+            if doc is None:
+                continue
+
+            count += 1
+            if count > max_documents:
+                raise UploadTooLarge(f"File has more than {max_documents} documents.")
+
+            yield doc
+    finally:
+        loader.dispose()
+
+
+async def stream_documents(
+    stream: BinaryIO, max_bytes: int, max_documents: int
+) -> AsyncIterator[dict]:
+    """Async version of iter_documents. Parsing runs in a separate thread so
+    the caller can start working on a document while the next ones are parsed."""
+
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    done = object()
+    stop = threading.Event()
+    # run_in_executor doesn't pass the context on to the parser thread
+    timings = timing.current()
+
+    def parse() -> None:
+        documents = iter_documents(stream, max_bytes, max_documents)
+        try:
+            while True:
+                with timing.stage("parse", timings):
+                    doc = next(documents, None)
+                if doc is None or stop.is_set():
+                    return
+                loop.call_soon_threadsafe(queue.put_nowait, doc)
+        except (yaml.YAMLError, UploadTooLarge) as e:
+            loop.call_soon_threadsafe(queue.put_nowait, e)
+        finally:
+            documents.close()
+            loop.call_soon_threadsafe(queue.put_nowait, done)
+
+    parser = loop.run_in_executor(None, parse)
+
+    try:
+        while True:
+            item = await queue.get()
+            if item is done:
+                break
+            if isinstance(item, Exception):
+                raise item
+
+            yield item
+    finally:
+        stop.set()
+        await parser
@@ -0,0 +1,21 @@
+"""Benchmarks for the quick_k8s API.
+
+Run from the src directory, e.g. ``python -m benchmarks.jwt_cache``.
+They use a throwaway SQLite database and never touch a real cluster."""
+
+import os
+import tempfile
+
+
+def setup_env() -> None:
+    """Set the configuration app.config requires, unless already set.
+    Must be called before importing anything from app."""
+
+    db_path = os.path.join(tempfile.mkdtemp(prefix="quick_k8s_bench_"), "bench.db")
+
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{db_path}")
+    os.environ.setdefault("SECRET_KEY", "bench" * 8)
+    os.environ.setdefault("ALGORITHM", "HS256")
+    os.environ.setdefault("TARGET_NAMESPACE", "quick-k8s-bench")
+    os.environ.setdefault("DEFAULT_ADMIN_EMAIL", "admin@bench.local")
+    os.environ.setdefault("DEFAULT_ADMIN_PASSWORD", "admin")
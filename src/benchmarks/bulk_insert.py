@@ -0,0 +1,81 @@
+"""Compare recording an upload's resources one commit per row against a single
+bulk transaction, for uploads of 1, 10 and 100 documents."""
+
+import argparse
+import asyncio
+import time
+from datetime import datetime
+from typing import List
+
+from benchmarks import setup_env
+
+setup_env()
+
+# pylint: disable=wrong-import-position
+from sqlalchemy import event  # noqa: E402
+
+from app import database  # noqa: E402
+from app.config import cfg  # noqa: E402
+
+commits = 0
+
+
+def count_commit(*_):
+    global commits
+    commits += 1
+
+
+def make_resources(count: int) -> List[database.orm.Resource]:
+    return [
+        database.orm.Resource(
+            owner=1,
+            name=f"bench-{i}",
+            type="Deployment",
+            created_timestamp=datetime.now(),
+        )
+        for i in range(count)
+    ]
+
+
+async def per_row(count: int) -> None:
+    for resource in make_resources(count):
+        await database.resources.add_resource_async(resource)
+
+
+async def bulk(count: int) -> None:
+    await database.resources.add_resources_async(make_resources(count))
+
+
+async def measure(func, count: int, repeat: int) -> tuple:
+    """Returns (commits per upload, mean latency in ms) of func."""
+
+    global commits
+    commits = 0
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        await func(count)
+    elapsed = time.perf_counter() - start
+
+    return commits / repeat, elapsed / repeat * 1000
+
+
+async def main(repeat: int):
+    database.utils.setup_engine(cfg.DATABASE_URL)
+    database.utils.create_tables()
+    engine = database.utils.setup_async_engine(cfg.DATABASE_URL)
+    event.listen(engine.sync_engine, "commit", count_commit)
+
+    print(f"{'documents':>10} {'mode':>8} {'commits':>8} {'latency (ms)':>13}")
+    for count in (1, 10, 100):
+        for name, func in (("per-row", per_row), ("bulk", bulk)):
+            upload_commits, latency = await measure(func, count, repeat)
+            print(f"{count:>10} {name:>8} {upload_commits:>8.0f} {latency:>13.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-r", "--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    asyncio.run(main(args.repeat))
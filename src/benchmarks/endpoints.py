@@ -0,0 +1,270 @@
+"""Latency and throughput of the API's routes, against SQLite and an in-process
+fake Kubernetes API server (see benchmarks.fake_k8s).
+
+Uploads use the manifests of test_k8s_files, renamed for every request so they
+don't conflict, and the uploaded resources are then deleted one by one.
+
+Running with several concurrency levels (the default is 1 and 16) shows whether
+requests waiting on the Kubernetes API hold up each other: with an injected
+latency, throughput should grow with the concurrency.
+
+Needs the packages of benchmarks/requirements.txt."""
+
+import argparse
+import asyncio
+import os
+import statistics
+import time
+from typing import Callable, Dict, List, NamedTuple
+
+from benchmarks import setup_env
+
+setup_env()
+
+# pylint: disable=wrong-import-position
+import httpx  # noqa: E402
+import yaml  # noqa: E402
+
+from app.config import cfg  # noqa: E402
+from app.k8s import client as k8s_client  # noqa: E402
+from app.main import app  # noqa: E402
+from benchmarks.fake_k8s import FakeKubernetes  # noqa: E402
+
+CORPUS_DIR = os.path.join(
+    os.path.dirname(__file__), os.pardir, os.pardir, "test_k8s_files"
+)
+VALID_FILES = ["deployment.yml", "service.yml", "wm_all.yml", "kubectl_deploy.yml"]
+INVALID_FILES = ["bad_deployment.yml", "bad_service.yml"]
+
+
+class Request(NamedTuple):
+    method: str
+    url: str
+    # keyword arguments of httpx.AsyncClient.request()
+    kwargs: dict
+    expected_status: int
+
+
+class Result(NamedTuple):
+    route: str
+    requests: int
+    errors: int
+    latencies: List[float]
+    elapsed: float
+    responses: List[httpx.Response]
+
+
+def load_corpus(filenames: List[str]) -> List[List[dict]]:
+    corpus = []
+    for filename in filenames:
+        with open(os.path.join(CORPUS_DIR, filename)) as yaml_file:
+            corpus.append([doc for doc in yaml.safe_load_all(yaml_file) if doc])
+
+    return corpus
+
+
+def upload(docs: List[dict], suffix: str, headers: dict) -> dict:
+    """Keyword arguments uploading docs with suffix appended to their names."""
+
+    renamed = []
+    for doc in docs:
+        doc = dict(doc, metadata=dict(doc.get("metadata", {})))
+        doc["metadata"]["name"] = f"{doc['metadata'].get('name', 'doc')}-{suffix}"
+        renamed.append(doc)
+
+    content = yaml.safe_dump_all(renamed).encode()
+
+    return {
+        "files": {"yaml_file": ("upload.yml", content, "application/x-yaml")},
+        "headers": headers,
+    }
+
+
+async def run(
+    http: httpx.AsyncClient, route: str, requests: List[Request], concurrency: int
+) -> Result:
+    latencies: List[float] = []
+    responses: List[httpx.Response] = []
+    errors = 0
+    queue = list(reversed(requests))
+
+    async def worker():
+        nonlocal errors
+        while queue:
+            request = queue.pop()
+
+            start = time.perf_counter()
+            response = await http.request(request.method, request.url, **request.kwargs)
+            latencies.append(time.perf_counter() - start)
+
+            responses.append(response)
+            if response.status_code != request.expected_status:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    return Result(route, len(requests), errors, latencies, elapsed, responses)
+
+
+def report(result: Result) -> None:
+    if len(result.latencies) > 1:
+        percentiles = statistics.quantiles(result.latencies, n=100)
+        p50, p95, p99 = (percentiles[i] * 1000 for i in (49, 94, 98))
+    else:
+        p50 = p95 = p99 = result.latencies[0] * 1000
+
+    print(
+        f"{result.route:<34} {result.requests:>6} {result.errors:>6}"
+        f" {p50:>9.1f} {p95:>9.1f} {p99:>9.1f}"
+        f" {result.requests / result.elapsed:>9.1f}"
+    )
+
+
+async def bench(
+    http: httpx.AsyncClient, requests: int, logins: int, concurrency: int, run_id: str
+) -> None:
+    print(f"\nconcurrency {concurrency}")
+    print(
+        f"{'route':<34} {'reqs':>6} {'errors':>6}"
+        f" {'p50 (ms)':>9} {'p95 (ms)':>9} {'p99 (ms)':>9} {'req/s':>9}"
+    )
+
+    login = {
+        "data": {"username": "admin", "password": cfg.DEFAULT_ADMIN_PASSWORD},
+    }
+    result = await run(
+        http,
+        "POST /auth/token",
+        [Request("POST", "/auth/token", login, 200)] * logins,
+        concurrency,
+    )
+    report(result)
+
+    token = result.responses[0].json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    valid = load_corpus(VALID_FILES)
+    invalid = load_corpus(INVALID_FILES)
+
+    uploads = [
+        Request(
+            "POST",
+            "/k8s/resources/",
+            upload(valid[i % len(valid)], f"{run_id}-{i}", headers),
+            200,
+        )
+        for i in range(requests)
+    ]
+    result = await run(http, "POST /k8s/resources/", uploads, concurrency)
+    report(result)
+
+    deployed = [
+        resource
+        for response in result.responses
+        if response.status_code == 200
+        for resource in response.json()["deployed"]
+    ]
+
+    rejected = [
+        Request(
+            "POST",
+            "/k8s/resources/",
+            upload(invalid[i % len(invalid)], f"{run_id}-bad-{i}", headers),
+            400,
+        )
+        for i in range(requests)
+    ]
+    report(await run(http, "POST /k8s/resources/ (invalid)", rejected, concurrency))
+
+    reads: Dict[str, Callable[[], Request]] = {
+        "GET /k8s/resources/": lambda: Request(
+            "GET", "/k8s/resources/", {"headers": headers}, 200
+        ),
+        "GET /admin/db/users": lambda: Request(
+            "GET", "/admin/db/users", {"headers": headers}, 200
+        ),
+        "GET /admin/db/roles": lambda: Request(
+            "GET", "/admin/db/roles", {"headers": headers}, 200
+        ),
+        "GET /admin/db/resources": lambda: Request(
+            "GET", "/admin/db/resources", {"headers": headers}, 200
+        ),
+    }
+    for route, make_request in reads.items():
+        report(await run(http, route, [make_request()] * requests, concurrency))
+
+    deletes = [
+        Request(
+            "DELETE",
+            f"/k8s/resources/{resource['type'].lower()}/{resource['name']}",
+            {"headers": headers},
+            200,
+        )
+        for resource in deployed
+    ]
+    report(await run(http, "DELETE /k8s/resources/{type}/{name}", deletes, concurrency))
+
+
+async def main(
+    requests: int,
+    logins: int,
+    concurrency_levels: List[int],
+    latency: float,
+    jitter: float,
+) -> None:
+    fake = FakeKubernetes(latency, jitter).start()
+    k8s_client.set_configuration(fake.configuration())
+
+    print(
+        f"fake Kubernetes API at {fake.url},"
+        f" latency {latency * 1000:.0f} ms + up to {jitter * 1000:.0f} ms"
+    )
+
+    try:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://bench", timeout=None
+        ) as http:
+            for run_id, concurrency in enumerate(concurrency_levels):
+                await bench(http, requests, logins, concurrency, f"r{run_id}")
+    finally:
+        fake.stop()
+
+    print("\nKubernetes API calls:")
+    for (method, target), count in sorted(fake.calls.items()):
+        print(f"  {method:<7} {target:<12} {count:>6}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "-n", "--requests", type=int, default=100, help="requests per route"
+    )
+    parser.add_argument(
+        "--logins",
+        type=int,
+        default=20,
+        help="requests to /auth/token, each one costs a bcrypt verification",
+    )
+    parser.add_argument(
+        "-c", "--concurrency", type=int, nargs="+", default=[1, 16]
+    )
+    parser.add_argument(
+        "--latency", type=float, default=20, help="ms added to each Kubernetes call"
+    )
+    parser.add_argument(
+        "--jitter", type=float, default=5, help="random ms added on top of latency"
+    )
+    args = parser.parse_args()
+
+    asyncio.run(
+        main(
+            args.requests,
+            args.logins,
+            args.concurrency,
+            args.latency / 1000,
+            args.jitter / 1000,
+        )
+    )
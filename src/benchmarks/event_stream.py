@@ -0,0 +1,140 @@
+"""Check that GET /k8s/resources/events applies backpressure to slow clients.
+
+The app is called directly, through all its middleware, with a send that
+stalls after the snapshot like the socket of a client that stopped reading.
+While it is stalled, the stream must not produce anything more, and once more
+objects than STREAM_MAX_PENDING changed, the client must get an "overflow"
+event and be disconnected. Exits with status 1 otherwise.
+
+Runs against the fake Kubernetes API server (see benchmarks.fake_k8s)."""
+
+import asyncio
+import os
+import sys
+import time
+
+# few objects are enough to overflow
+os.environ.setdefault("STREAM_MAX_PENDING", "20")
+
+# pylint: disable=wrong-import-position
+from benchmarks import setup_env  # noqa: E402
+
+setup_env()
+
+from app import k8s  # noqa: E402
+from app.config import cfg  # noqa: E402
+from app.k8s import client as k8s_client  # noqa: E402
+from app.k8s import create_resources  # noqa: E402
+from app.main import app  # noqa: E402
+from app.utils import auth  # noqa: E402
+from benchmarks.fake_k8s import FakeKubernetes  # noqa: E402
+
+
+def deployment(name: str) -> dict:
+    return {
+        "apiVersion": "apps/v1",
+        "kind": "Deployment",
+        "metadata": {
+            "name": name,
+            "labels": {create_resources.MANAGED_BY_LABEL: create_resources.MANAGED_BY},
+        },
+        "spec": {
+            "replicas": 1,
+            "selector": {"matchLabels": {"app": name}},
+            "template": {
+                "metadata": {"labels": {"app": name}},
+                "spec": {"containers": [{"name": name, "image": "nginx"}]},
+            },
+        },
+    }
+
+
+async def wait_for(condition, timeout: float) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        await asyncio.sleep(0.01)
+
+    return True
+
+
+async def check(fake: FakeKubernetes) -> bool:
+    token = auth.create_access_token({"sub": "admin"})
+    scope = {
+        "type": "http",
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": "/k8s/resources/events",
+        "raw_path": b"/k8s/resources/events",
+        "root_path": "",
+        "query_string": b"owner=*",
+        "headers": [(b"authorization", f"Bearer {token}".encode())],
+        "client": ("127.0.0.1", 1),
+        "server": ("127.0.0.1", 80),
+    }
+
+    async def receive() -> dict:
+        # the client never disconnects
+        await asyncio.Event().wait()
+        return {}
+
+    chunks = []
+    unstalled = asyncio.Event()
+
+    async def send(message: dict) -> None:
+        if message["type"] == "http.response.body" and message.get("body"):
+            chunks.append(message["body"].decode())
+            # the client stops reading after the snapshot
+            if len(chunks) == 1:
+                await unstalled.wait()
+
+    # the snapshot has one event
+    fake.create(cfg.TARGET_NAMESPACE, "deployments", deployment("first"), False)
+
+    stream = asyncio.ensure_future(app(scope, receive, send))
+    try:
+        if not await wait_for(lambda: chunks or stream.done(), 10) or not chunks:
+            print("no snapshot received")
+            return False
+
+        for i in range(cfg.STREAM_MAX_PENDING + 5):
+            fake.create(cfg.TARGET_NAMESPACE, "deployments", deployment(f"d{i}"), False)
+
+        overflowed = await wait_for(
+            lambda: any(s.overflowed for s in k8s.events._subscriptions), 10
+        )
+        sent_while_stalled = len(chunks) - 1
+        print(f"sent while stalled: {sent_while_stalled}, overflowed: {overflowed}")
+
+        unstalled.set()
+        try:
+            await asyncio.wait_for(asyncio.shield(stream), 10)
+        except asyncio.TimeoutError:
+            pass
+    finally:
+        stream.cancel()
+
+    disconnected = stream.done() and "event: overflow" in chunks[-1]
+    print(f"disconnected: {disconnected}, last event: {chunks[-1].splitlines()[0]}")
+
+    return sent_while_stalled == 0 and overflowed and disconnected
+
+
+def main():
+    fake = FakeKubernetes().start()
+    k8s_client.set_configuration(fake.configuration())
+    try:
+        fake.create_namespace({"metadata": {"name": cfg.TARGET_NAMESPACE}})
+        ok = asyncio.run(check(fake))
+    finally:
+        fake.stop()
+
+    print("ok" if ok else "WRONG: a stalled client wasn't disconnected")
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
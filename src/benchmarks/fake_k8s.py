@@ -0,0 +1,534 @@
+"""In-process fake of the parts of the Kubernetes API the app uses.
+
+Stores namespaces, deployments and services in memory and supports create
+(including dry runs), get, list, label patches, delete, collection delete and
+watch, with an optional latency added to every call. Validation is minimal:
+just enough for the manifests of test_k8s_files to be accepted or rejected
+like a real API server would. /openapi/v2 serves the recorded spec of
+SPEC_FILE, for the "local" and "fast" validation modes."""
+
+import copy
+import json
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from kubernetes import client
+
+# plural -> (kind, apiVersion, required fields of spec)
+RESOURCES = {
+    "deployments": ("Deployment", "apps/v1", ("selector", "template")),
+    "services": ("Service", "v1", ("ports",)),
+}
+
+_NAMESPACED = re.compile(
+    r"^/(?:api/v1|apis/apps/v1)/namespaces/(?P<namespace>[^/]+)"
+    r"/(?P<plural>deployments|services)(?:/(?P<name>[^/]+))?$"
+)
+_NAMESPACES = re.compile(r"^/api/v1/namespaces(?:/(?P<name>[^/]+))?$")
+
+VERSION = {
+    "major": "1",
+    "minor": "21",
+    "gitVersion": "v1.21.0-fake",
+    "gitCommit": "0000000000000000000000000000000000000000",
+    "gitTreeState": "clean",
+    "buildDate": "2021-04-08T16:25:06Z",
+    "goVersion": "go1.16.1",
+    "compiler": "gc",
+    "platform": "linux/amd64",
+}
+
+# trimmed OpenAPI v2 spec, see benchmarks.schema_validation
+SPEC_FILE = os.path.join(os.path.dirname(__file__), "openapi-v1.18.0.json")
+
+
+class FakeApiError(Exception):
+    """Answered as a Status object with code."""
+
+    def __init__(self, code: int, reason: str, message: str, causes=None):
+        super().__init__(message)
+        self.code = code
+        self.reason = reason
+        self.message = message
+        self.causes = causes
+
+    def status(self) -> dict:
+        status = {
+            "kind": "Status",
+            "apiVersion": "v1",
+            "metadata": {},
+            "status": "Failure",
+            "message": self.message,
+            "reason": self.reason,
+            "code": self.code,
+        }
+        if self.causes:
+            status["details"] = {"causes": self.causes}
+
+        return status
+
+
+def _matches(obj: dict, selector: Optional[str]) -> bool:
+    """Equality based label selectors only (a=b,c!=d)."""
+
+    if not selector:
+        return True
+
+    labels = obj["metadata"].get("labels") or {}
+    for requirement in selector.split(","):
+        if "!=" in requirement:
+            key, value = requirement.split("!=", 1)
+            if labels.get(key.strip()) == value.strip():
+                return False
+        elif "=" in requirement:
+            key, value = requirement.replace("==", "=").split("=", 1)
+            if labels.get(key.strip()) != value.strip():
+                return False
+        else:
+            raise FakeApiError(
+                400, "BadRequest", f"unable to parse requirement: {requirement}"
+            )
+
+    return True
+
+
+class FakeKubernetes:
+    """The fake API server. Call start() and point the app to url, e.g. with
+    app.k8s.client.set_configuration(fake.configuration())."""
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0):
+        """latency and jitter are in seconds, each call waits for latency plus
+        a random delay of up to jitter."""
+
+        self.latency = latency
+        self.jitter = jitter
+
+        self.namespaces: Dict[str, dict] = {}
+        # (namespace, plural) -> name -> object
+        self.objects: Dict[Tuple[str, str], Dict[str, dict]] = {}
+        # (resourceVersion, namespace, plural, event)
+        self.events: List[Tuple[int, str, str, dict]] = []
+        self.resource_version = 0
+        # calls per (method, plural or path)
+        self.calls: Dict[Tuple[str, str], int] = {}
+
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    @property
+    def url(self) -> str:
+        if self._server is None:
+            raise ValueError("Fake Kubernetes API server is not started.")
+
+        host, port = self._server.server_address[:2]
+
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeKubernetes":
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self._server.daemon_threads = True
+        self._server.fake = self  # type: ignore
+
+        threading.Thread(
+            target=self._server.serve_forever, name="fake-k8s", daemon=True
+        ).start()
+
+        return self
+
+    def stop(self) -> None:
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    @property
+    def stopped(self) -> bool:
+        return self._stopped
+
+    def configuration(self) -> client.Configuration:
+        configuration = client.Configuration()
+        configuration.host = self.url
+
+        return configuration
+
+    def wait(self) -> None:
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+    def count(self, method: str, target: str) -> None:
+        with self._cond:
+            self.calls[(method, target)] = self.calls.get((method, target), 0) + 1
+
+    # namespaces
+
+    def get_namespace(self, name: str) -> dict:
+        with self._cond:
+            if name not in self.namespaces:
+                raise FakeApiError(404, "NotFound", f'namespaces "{name}" not found')
+
+            return self.namespaces[name]
+
+    def create_namespace(self, body: dict) -> dict:
+        name = body.get("metadata", {}).get("name")
+        with self._cond:
+            if name in self.namespaces:
+                raise FakeApiError(
+                    409, "AlreadyExists", f'namespaces "{name}" already exists'
+                )
+
+            self.resource_version += 1
+            namespace = {
+                "kind": "Namespace",
+                "apiVersion": "v1",
+                "metadata": {
+                    "name": name,
+                    "uid": str(uuid.uuid4()),
+                    "resourceVersion": str(self.resource_version),
+                },
+                "status": {"phase": "Active"},
+            }
+            self.namespaces[name] = namespace
+
+            return namespace
+
+    # deployments and services
+
+    def _validate(self, plural: str, body: dict) -> None:
+        kind, _, required = RESOURCES[plural]
+        causes = []
+
+        if not body.get("metadata", {}).get("name"):
+            causes.append(
+                {
+                    "reason": "FieldValueRequired",
+                    "message": "Required value: name or generateName is required",
+                    "field": "metadata.name",
+                }
+            )
+
+        spec = body.get("spec") or {}
+        for field in required:
+            if field not in spec:
+                causes.append(
+                    {
+                        "reason": "FieldValueRequired",
+                        "message": "Required value",
+                        "field": f"spec.{field}",
+                    }
+                )
+
+        if causes:
+            name = body.get("metadata", {}).get("name", "")
+            raise FakeApiError(
+                422,
+                "Invalid",
+                f'{kind} "{name}" is invalid: {causes[0]["field"]}: '
+                f'{causes[0]["message"]}',
+                causes,
+            )
+
+    def create(self, namespace: str, plural: str, body: dict, dry_run: bool) -> dict:
+        self._validate(plural, body)
+
+        kind, api_version, _ = RESOURCES[plural]
+        name = body["metadata"]["name"]
+
+        with self._cond:
+            if namespace not in self.namespaces:
+                raise FakeApiError(
+                    404, "NotFound", f'namespaces "{namespace}" not found'
+                )
+
+            store = self.objects.setdefault((namespace, plural), {})
+            if name in store:
+                raise FakeApiError(
+                    409, "AlreadyExists", f'{plural} "{name}" already exists'
+                )
+
+            obj = copy.deepcopy(body)
+            obj.update(kind=kind, apiVersion=api_version)
+            obj["metadata"].update(
+                namespace=namespace,
+                uid=str(uuid.uuid4()),
+                creationTimestamp="2021-04-08T16:25:06Z",
+                resourceVersion=str(self.resource_version + 1),
+            )
+
+            if not dry_run:
+                self._record(namespace, plural, "ADDED", obj)
+                store[name] = obj
+
+            return obj
+
+    def list(self, namespace: str, plural: str, selector: Optional[str]) -> dict:
+        kind, api_version, _ = RESOURCES[plural]
+
+        with self._cond:
+            items = [
+                obj
+                for obj in self.objects.get((namespace, plural), {}).values()
+                if _matches(obj, selector)
+            ]
+
+            return {
+                "kind": f"{kind}List",
+                "apiVersion": api_version,
+                "metadata": {"resourceVersion": str(self.resource_version)},
+                "items": items,
+            }
+
+    def read(self, namespace: str, plural: str, name: str) -> dict:
+        with self._cond:
+            store = self.objects.get((namespace, plural), {})
+            if name not in store:
+                raise FakeApiError(404, "NotFound", f'{plural} "{name}" not found')
+
+            return store[name]
+
+    def patch(self, namespace: str, plural: str, name: str, body: dict) -> dict:
+        """Merges the labels of body, the only patch the API sends."""
+
+        with self._cond:
+            store = self.objects.get((namespace, plural), {})
+            if name not in store:
+                raise FakeApiError(404, "NotFound", f'{plural} "{name}" not found')
+
+            obj = store[name]
+            labels = body.get("metadata", {}).get("labels", {})
+            obj["metadata"].setdefault("labels", {}).update(labels)
+            self._record(namespace, plural, "MODIFIED", obj)
+
+            return obj
+
+    def delete(self, namespace: str, plural: str, name: str) -> dict:
+        kind, _, _ = RESOURCES[plural]
+
+        with self._cond:
+            store = self.objects.get((namespace, plural), {})
+            if name not in store:
+                raise FakeApiError(404, "NotFound", f'{plural} "{name}" not found')
+
+            obj = store.pop(name)
+            self._record(namespace, plural, "DELETED", obj)
+
+        return {
+            "kind": "Status",
+            "apiVersion": "v1",
+            "metadata": {},
+            "status": "Success",
+            "details": {"name": name, "kind": kind, "uid": obj["metadata"]["uid"]},
+        }
+
+    def delete_collection(
+        self, namespace: str, plural: str, selector: Optional[str]
+    ) -> dict:
+        with self._cond:
+            store = self.objects.get((namespace, plural), {})
+            names = [name for name, obj in store.items() if _matches(obj, selector)]
+            for name in names:
+                self._record(namespace, plural, "DELETED", store.pop(name))
+
+        return {"kind": "Status", "apiVersion": "v1", "status": "Success"}
+
+    def _record(self, namespace: str, plural: str, event_type: str, obj: dict) -> None:
+        # caller holds self._cond
+        self.resource_version += 1
+        obj["metadata"]["resourceVersion"] = str(self.resource_version)
+        self.events.append(
+            (
+                self.resource_version,
+                namespace,
+                plural,
+                {"type": event_type, "object": copy.deepcopy(obj)},
+            )
+        )
+        self._cond.notify_all()
+
+    def watch(
+        self,
+        namespace: str,
+        plural: str,
+        resource_version: str,
+        timeout: float,
+        selector: Optional[str],
+    ):
+        """Yields the events after resource_version until timeout."""
+
+        with self._cond:
+            since = int(resource_version) if resource_version else self.resource_version
+        deadline = time.monotonic() + timeout
+        position = 0
+
+        while True:
+            with self._cond:
+                pending = []
+                while not pending:
+                    remaining = deadline - time.monotonic()
+                    if self._stopped or remaining <= 0:
+                        return
+
+                    for i in range(position, len(self.events)):
+                        version, event_namespace, event_plural, event = self.events[i]
+                        if (
+                            version > since
+                            and event_namespace == namespace
+                            and event_plural == plural
+                            and _matches(event["object"], selector)
+                        ):
+                            pending.append(event)
+                    position = len(self.events)
+
+                    if not pending:
+                        self._cond.wait(remaining)
+
+            yield from pending
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+    @property
+    def fake(self) -> FakeKubernetes:
+        return self.server.fake  # type: ignore
+
+    def _send_json(self, code: int, body: dict, reason: Optional[str] = None) -> None:
+        data = json.dumps(body).encode()
+
+        self.send_response(code, reason)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _body(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _handle(self, method: str) -> None:
+        if self.fake.stopped:
+            # drop kept alive connections, e.g. of watches being restarted
+            self.close_connection = True
+            return
+
+        url = urlsplit(self.path)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        # read DELETE bodies too, or they'd be parsed as the next request
+        body = self._body()
+
+        try:
+            namespaced = _NAMESPACED.match(url.path)
+
+            if namespaced and method == "GET" and query.get("watch", "").lower() == "true":
+                self.fake.count("WATCH", namespaced["plural"])
+                self._watch(namespaced["namespace"], namespaced["plural"], query)
+                return
+
+            self.fake.wait()
+
+            if namespaced:
+                namespace, plural, name = namespaced.group("namespace", "plural", "name")
+                self.fake.count(method, plural)
+
+                if method == "POST" and name is None:
+                    dry_run = query.get("dryRun") == "All"
+                    obj = self.fake.create(namespace, plural, body, dry_run)
+                    self._send_json(201, obj)
+                elif method == "GET" and name is None:
+                    self._send_json(
+                        200, self.fake.list(namespace, plural, query.get("labelSelector"))
+                    )
+                elif method == "GET":
+                    self._send_json(200, self.fake.read(namespace, plural, name))
+                elif method == "PATCH" and name is not None:
+                    self._send_json(200, self.fake.patch(namespace, plural, name, body))
+                elif method == "DELETE" and name is not None:
+                    self._send_json(200, self.fake.delete(namespace, plural, name))
+                elif method == "DELETE":
+                    self._send_json(
+                        200,
+                        self.fake.delete_collection(
+                            namespace, plural, query.get("labelSelector")
+                        ),
+                    )
+                else:
+                    raise FakeApiError(405, "MethodNotAllowed", f"{method} not allowed")
+                return
+
+            namespaces = _NAMESPACES.match(url.path)
+            if namespaces:
+                self.fake.count(method, "namespaces")
+
+                if method == "GET" and namespaces["name"]:
+                    self._send_json(200, self.fake.get_namespace(namespaces["name"]))
+                elif method == "POST" and not namespaces["name"]:
+                    self._send_json(201, self.fake.create_namespace(body))
+                else:
+                    raise FakeApiError(405, "MethodNotAllowed", f"{method} not allowed")
+                return
+
+            if url.path.rstrip("/") == "/version":
+                self.fake.count(method, "version")
+                self._send_json(200, VERSION)
+                return
+
+            if url.path.rstrip("/") == "/openapi/v2":
+                self.fake.count(method, "openapi")
+                with open(SPEC_FILE) as spec_file:
+                    self._send_json(200, json.load(spec_file))
+                return
+
+            raise FakeApiError(404, "NotFound", f"the server could not find {url.path}")
+        except FakeApiError as e:
+            self._send_json(e.code, e.status(), e.reason)
+
+    def _watch(self, namespace: str, plural: str, query: dict) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        events = self.fake.watch(
+            namespace,
+            plural,
+            query.get("resourceVersion", ""),
+            float(query.get("timeoutSeconds") or 300),
+            query.get("labelSelector"),
+        )
+
+        try:
+            for event in events:
+                line = json.dumps(event).encode() + b"\n"
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+                self.wfile.flush()
+
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        self._handle("GET")
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        self._handle("POST")
+
+    def do_PATCH(self):  # pylint: disable=invalid-name
+        self._handle("PATCH")
+
+    def do_DELETE(self):  # pylint: disable=invalid-name
+        self._handle("DELETE")
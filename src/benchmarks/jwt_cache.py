@@ -0,0 +1,57 @@
+"""Compare bearer token verification with and without the verified-token cache."""
+
+import argparse
+import time
+from datetime import timedelta
+
+from benchmarks import setup_env
+
+setup_env()
+
+# pylint: disable=wrong-import-position
+from jose import jwt  # noqa: E402
+
+from app.config import cfg  # noqa: E402
+from app.utils import auth  # noqa: E402
+
+
+def uncached(token: str) -> None:
+    jwt.decode(token, cfg.SECRET_KEY, algorithms=[cfg.ALGORITHM])
+
+
+def cached(token: str) -> None:
+    auth.decode_token(token)
+
+
+def run(func, token: str, iterations: int) -> float:
+    """Returns verifications per second."""
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func(token)
+
+    return iterations / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", "--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    token = auth.create_access_token(
+        data={"sub": "admin"}, expires_delta=timedelta(minutes=144)
+    )
+
+    auth.token_cache.clear()
+    results = {
+        "uncached": run(uncached, token, args.iterations),
+        "cached": run(cached, token, args.iterations),
+    }
+
+    for name, throughput in results.items():
+        print(f"{name:>10}: {throughput:12.0f} verifications/s")
+    print(f"{'speedup':>10}: {results['cached'] / results['uncached']:12.1f}x")
+
+
+if __name__ == "__main__":
+    main()
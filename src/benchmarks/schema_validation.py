@@ -0,0 +1,168 @@
+"""Check app.k8s.schema against a recorded OpenAPI spec, without a cluster,
+and compare the throughput of local validation with dry runs against the fake
+Kubernetes API server (see benchmarks.fake_k8s).
+
+The manifests of test_k8s_files must get the same verdict as from a real API
+server: the good ones no errors, the bad ones at least one. Exits with status 1
+otherwise.
+
+The spec, benchmarks/openapi-v1.18.0.json, holds the definitions Deployment and
+Service reference, without descriptions. It was trimmed from the definitions of
+Kubernetes v1.18.0 with --record, which works on any OpenAPI v2 spec, e.g. one
+saved with ``kubectl get --raw /openapi/v2 > spec.json``."""
+
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Iterator, List
+
+import yaml  # type: ignore
+
+from benchmarks import setup_env
+
+setup_env()
+
+# pylint: disable=wrong-import-position
+from app.k8s import client as k8s_client  # noqa: E402
+from app.k8s import schema, validate_yaml  # noqa: E402
+from benchmarks.fake_k8s import SPEC_FILE, FakeKubernetes  # noqa: E402
+
+CORPUS_DIR = os.path.join(
+    os.path.dirname(__file__), os.pardir, os.pardir, "test_k8s_files"
+)
+VALID_FILES = ["deployment.yml", "service.yml", "wm_all.yml", "kubectl_deploy.yml"]
+INVALID_FILES = ["bad_deployment.yml", "bad_service.yml"]
+
+NAMESPACE = "schema-bench"
+
+# definitions the fixture is trimmed to, with those they reference
+RECORDED_DEFINITIONS = ["io.k8s.api.apps.v1.Deployment", "io.k8s.api.core.v1.Service"]
+
+
+def _refs(value) -> Iterator[str]:
+    if isinstance(value, dict):
+        if "$ref" in value:
+            yield value["$ref"].split("/")[-1]
+        for item in value.values():
+            yield from _refs(item)
+    elif isinstance(value, list):
+        for item in value:
+            yield from _refs(item)
+
+
+def _strip_descriptions(value):
+    if isinstance(value, dict):
+        return {
+            key: _strip_descriptions(item)
+            for key, item in value.items()
+            if not (key == "description" and isinstance(item, str))
+        }
+    if isinstance(value, list):
+        return [_strip_descriptions(item) for item in value]
+
+    return value
+
+
+def trim_spec(spec: dict, roots: List[str]) -> dict:
+    """The definitions of roots and those they reference, transitively."""
+
+    definitions = spec["definitions"]
+    kept = {}
+    pending = list(roots)
+    while pending:
+        name = pending.pop()
+        if name in kept:
+            continue
+
+        kept[name] = _strip_descriptions(definitions[name])
+        pending.extend(_refs(kept[name]))
+
+    return {
+        "swagger": "2.0",
+        "info": spec.get("info", {"title": "Kubernetes"}),
+        "definitions": dict(sorted(kept.items())),
+    }
+
+
+def load_docs(filename: str) -> List[dict]:
+    with open(os.path.join(CORPUS_DIR, filename)) as yaml_file:
+        return [doc for doc in yaml.safe_load_all(yaml_file) if doc]
+
+
+def check(validator: schema.SchemaValidator) -> bool:
+    """Print the verdict of every manifest, returns whether all are right."""
+
+    ok = True
+    for filename in VALID_FILES + INVALID_FILES:
+        causes = [
+            cause for doc in load_docs(filename) for cause in validator.validate(doc)
+        ]
+        right = bool(causes) == (filename in INVALID_FILES)
+        ok = ok and right
+
+        print(f"{'ok' if right else 'WRONG':>5} {filename:<20} {len(causes)} errors")
+        for cause in causes:
+            print(f"{'':>6}{cause['field']}: {cause['message']}")
+
+    return ok
+
+
+def throughput(validator: schema.SchemaValidator, rounds: int) -> None:
+    docs = [doc for filename in VALID_FILES for doc in load_docs(filename)]
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for doc in docs:
+            validator.validate(doc)
+    elapsed = time.perf_counter() - start
+    print(f"{'local':>7}: {rounds * len(docs) / elapsed:10.0f} documents/s")
+
+    fake = FakeKubernetes().start()
+    k8s_client.set_configuration(fake.configuration())
+    try:
+        k8s_client.core_v1().create_namespace({"metadata": {"name": NAMESPACE}})
+
+        # a tenth of the rounds, dry runs are much slower
+        dry_rounds = max(1, rounds // 10)
+        start = time.perf_counter()
+        for _ in range(dry_rounds):
+            for doc in docs:
+                validate_yaml.validate_one(doc["kind"], doc, NAMESPACE)
+        elapsed = time.perf_counter() - start
+        print(f"{'dry run':>7}: {dry_rounds * len(docs) / elapsed:10.0f} documents/s")
+    finally:
+        fake.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", "--rounds", type=int, default=200)
+    parser.add_argument(
+        "--record",
+        metavar="SPEC",
+        help=f"trim the OpenAPI v2 spec SPEC into {SPEC_FILE} and exit",
+    )
+    args = parser.parse_args()
+
+    if args.record:
+        with open(args.record) as spec_file:
+            trimmed = trim_spec(json.load(spec_file), RECORDED_DEFINITIONS)
+        with open(SPEC_FILE, "w") as spec_file:
+            json.dump(trimmed, spec_file, indent=1, sort_keys=True)
+            spec_file.write("\n")
+        print(f"{len(trimmed['definitions'])} definitions written to {SPEC_FILE}")
+        return
+
+    validator = schema.SchemaValidator.from_file(SPEC_FILE)
+    print(f"{len(validator.definitions)} definitions in {SPEC_FILE}")
+
+    if not check(validator):
+        sys.exit(1)
+
+    throughput(validator, args.rounds)
+
+
+if __name__ == "__main__":
+    main()
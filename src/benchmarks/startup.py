@@ -0,0 +1,114 @@
+"""Time to import app.main, which runs pre_init, in a fresh interpreter.
+
+Measures the first start on an empty database, the following starts, and
+several workers starting at once on an empty database, checking that they
+leave a single admin and one row per role behind."""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import List
+
+from benchmarks import setup_env
+
+setup_env()
+
+# pylint: disable=wrong-import-position
+import sqlalchemy  # noqa: E402
+
+SRC_DIR = os.path.join(os.path.dirname(__file__), os.pardir)
+
+# time spent in the child, to leave out the interpreter start
+CHILD = """
+import time
+start = time.perf_counter()
+import app.main
+print(time.perf_counter() - start)
+"""
+
+
+def fresh_database_url() -> str:
+    db_path = os.path.join(tempfile.mkdtemp(prefix="quick_k8s_bench_"), "bench.db")
+
+    return f"sqlite:///{db_path}"
+
+
+def start_workers(database_url: str, workers: int) -> List[float]:
+    """Start workers processes at once, returns their import times in seconds."""
+
+    env = dict(os.environ, DATABASE_URL=database_url)
+    processes = [
+        subprocess.Popen(
+            [sys.executable, "-c", CHILD],
+            cwd=SRC_DIR,
+            env=env,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        for _ in range(workers)
+    ]
+
+    times = []
+    for process in processes:
+        out, err = process.communicate()
+        if process.returncode != 0:
+            raise RuntimeError(f"Worker failed to start:\n{err.decode()}")
+        times.append(float(out.decode().strip().splitlines()[-1]))
+
+    return times
+
+
+def count_rows(database_url: str) -> tuple:
+    engine = sqlalchemy.create_engine(database_url)
+    with engine.connect() as conn:
+        admins = conn.execute(
+            sqlalchemy.text("SELECT COUNT(*) FROM users WHERE username = 'admin'")
+        ).scalar()
+        roles = conn.execute(sqlalchemy.text("SELECT COUNT(*) FROM roles")).scalar()
+    engine.dispose()
+
+    return admins, roles
+
+
+def report(name: str, times: List[float]) -> None:
+    print(
+        f"{name:<24} {len(times):>5} {statistics.mean(times) * 1000:>10.0f}"
+        f" {min(times) * 1000:>10.0f} {max(times) * 1000:>10.0f}"
+    )
+
+
+def main(repeat: int, workers: int) -> None:
+    database_url = fresh_database_url()
+
+    print(f"{'start':<24} {'runs':>5} {'mean (ms)':>10} {'min (ms)':>10} {'max (ms)':>10}")
+    report("first (empty database)", start_workers(database_url, 1))
+
+    warm = []
+    for _ in range(repeat):
+        warm += start_workers(database_url, 1)
+    report("next (initialized)", warm)
+
+    database_url = fresh_database_url()
+    start = time.perf_counter()
+    times = start_workers(database_url, workers)
+    elapsed = time.perf_counter() - start
+    report(f"{workers} workers at once", times)
+
+    admins, roles = count_rows(database_url)
+    print(
+        f"\n{workers} concurrent workers took {elapsed * 1000:.0f} ms in total"
+        f" and left {admins} admin(s) and {roles} role(s)."
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-r", "--repeat", type=int, default=10)
+    parser.add_argument("-w", "--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    main(args.repeat, args.workers)
@@ -0,0 +1,65 @@
+"""Compare parse throughput of the previous upload path (pure Python
+yaml.safe_load_all) with app.utils.yaml_stream on a generated manifest of
+ConfigMaps."""
+
+import argparse
+import io
+import time
+
+import yaml  # type: ignore
+
+from benchmarks import setup_env
+
+setup_env()
+
+# pylint: disable=wrong-import-position
+from app.utils import yaml_stream  # noqa: E402
+
+
+def make_manifest(documents: int) -> bytes:
+    docs = [
+        {
+            "apiVersion": "v1",
+            "kind": "ConfigMap",
+            "metadata": {"name": f"config-{i}", "labels": {"app": "bench"}},
+            "data": {f"key-{j}": f"value-{i}-{j}" for j in range(20)},
+        }
+        for i in range(documents)
+    ]
+
+    return yaml.safe_dump_all(docs).encode()
+
+
+def previous(manifest: bytes) -> int:
+    return len(list(yaml.safe_load_all(io.BytesIO(manifest))))
+
+
+def streaming(manifest: bytes) -> int:
+    return sum(
+        1
+        for _ in yaml_stream.iter_documents(
+            io.BytesIO(manifest), len(manifest), 1 << 30
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-d", "--documents", type=int, default=2000)
+    args = parser.parse_args()
+
+    manifest = make_manifest(args.documents)
+    print(
+        f"{args.documents} documents, {len(manifest) / 1024:.0f} KiB, "
+        f"loader: {yaml_stream.SafeLoader.__name__}"
+    )
+
+    for name, func in (("safe_load_all", previous), ("yaml_stream", streaming)):
+        start = time.perf_counter()
+        count = func(manifest)
+        elapsed = time.perf_counter() - start
+        print(f"{name:>14}: {count / elapsed:10.0f} documents/s ({elapsed:.2f}s)")
+
+
+if __name__ == "__main__":
+    main()